@@ -1,10 +1,12 @@
 from sqlalchemy.exc import IntegrityError
 from flask import request, jsonify, Blueprint
-from ..models import db, Book, Author, ma, BookSchema, AuthorSchema
+from ..models import db, Book, Author, ma, BookSchema, AuthorSchema, author_serializer, book_serializer
+from ..serializers import json_response
 from dateutil.parser import parse
 from http import HTTPStatus
-from ..cache import cache
+from ..cache import cached_response, tag_response, CATALOG_TTL
 from ..auth import token_required, admin_required
+from ..conditional import conditional, collection_version, row_version, combine
 
 
 # import datetime
@@ -80,8 +82,9 @@ def add_author(username):
 
 # GET author
 @api.route("/authors/<id>", methods=['GET'])
-@cache.cached(timeout=5)
 @token_required
+@conditional(lambda id: row_version(Author, id))
+@cached_response(timeout=CATALOG_TTL)
 def author_details(username,id):
     """ This endpoint returns an author
         HTTP Method: GET
@@ -110,13 +113,15 @@ def author_details(username,id):
     if author is None:
         return jsonify(msg={"message": f"Could not retreive Author with ID: {id}"}), HTTPStatus.INTERNAL_SERVER_ERROR
     
+    tag_response(f"author:{author.id}")
     return jsonify(author=author.as_dict()), HTTPStatus.OK
 
 
 # GET all authors
 @api.route("/authors", methods=['GET'])
-@cache.cached(timeout=5)
 @token_required
+@conditional(lambda: collection_version('authors'))
+@cached_response(timeout=CATALOG_TTL)
 def all_authors(username):
     """ This endpoint returns all authors in server
         HTTP Method: GET
@@ -130,21 +135,23 @@ def all_authors(username):
             unsuccessful:
                 json response: returns a json error message
     """
-    authors = Author.query.all()
+    authors = db.session.execute(author_serializer.select().order_by(Author.id)).all()
 
     if authors == {}:
         return jsonify(msg={"message":"No authors found"}), HTTPStatus.NOT_FOUND
     
     # create a list of authors converted as dicts
-    authors = [author.as_dict() for author in authors]
+    authors = author_serializer.dump_rows(authors)
     
-    return jsonify(all_authors=authors), HTTPStatus.OK
+    tag_response("authors:list")
+    return json_response({"all_authors": authors}, HTTPStatus.OK)
 
 
 # GET books by author
 @api.route("/authors/<author_id>/books", methods=['GET'])
-@cache.cached(timeout=5)
 @token_required
+@conditional(lambda author_id: combine(row_version(Author, author_id), collection_version('books')))
+@cached_response(timeout=CATALOG_TTL)
 def books_by_author(username, author_id):
     """ This endpoint returns an author
         HTTP Method: GET
@@ -172,12 +179,14 @@ def books_by_author(username, author_id):
     if author is None:
         return jsonify({"message": f"No author with ID: {author_id} in our system"}), HTTPStatus.NOT_FOUND
     
-    author_books = list(author.books)
+    # all the author's books in one query, as plain rows
+    author_books = db.session.execute(book_serializer.select().where(Book.author_id == author.id).order_by(Book.id))
     author_name = f"{author.first_name} {author.last_name}"
     
     # creates a list of books converted as dicts
-    books = [book.as_dict() for book in author_books]
-    return jsonify(books_by_author={"total":len(books), author_name:books}), HTTPStatus.OK
+    books = book_serializer.dump_rows(author_books)
+    tag_response(f"author:{author.id}", f"author-books:{author.id}", *(f"book:{book['id']}" for book in books))
+    return json_response({"books_by_author": {"total":len(books), author_name:books}}, HTTPStatus.OK)
 
 
 # PUT (update) author
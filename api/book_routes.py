@@ -2,11 +2,18 @@ from lib2to3.pgen2 import token
 from sqlalchemy.exc import IntegrityError
 
 from flask import request, jsonify, Blueprint, make_response
-from ..models import db, Book, Author, ma, BookSchema, User, UserSchema
+from ..models import db, Book, Author, ma, BookSchema, User, UserSchema, book_serializer
+from ..serializers import json_response
 from dateutil.parser import parse
 from http import HTTPStatus
-from ..cache import cache
+from ..cache import cached_response, tag_response, get_items, set_items, CATALOG_TTL
 from ..auth import token_required, admin_required
+from ..pagination import parse_page_args, keyset_page, wants_stream, stream_ndjson, encode_cursor
+from ..instrumentation import max_statements
+from ..bulk_import import import_books, read_rows, text_stream, CHUNK_SIZE
+from ..search import search_statement
+from ..rankings import top_sellers, MAX_TOP_SELLERS
+from ..conditional import conditional, collection_version, make_etag, not_modified, with_validators
 
 
 import datetime
@@ -16,9 +23,57 @@ import jwt
 import datetime
 from werkzeug.security import generate_password_hash,check_password_hash
 import jwt
+import math
 
 api = Blueprint('book_routes', __name__)
 
+# columns GET /books can be paginated on (both are unique)
+BOOK_SORT_COLUMNS = {'id': Book.id, 'isbn': Book.isbn}
+
+# POST /books/batch takes at most this many isbns/ids, and looks them up BATCH_CHUNK_SIZE at a time
+# (sqlite allows 999 bound parameters per query)
+MAX_BATCH_SIZE = 1000
+BATCH_CHUNK_SIZE = 500
+
+# single books are cached as items (not whole responses) under both their isbn and their id,
+# so GET /books/<isbn> and POST /books/batch share them
+BOOK_ITEM_KEYS = {'isbn': "item:book:isbn:{}", 'id': "item:book:id:{}"}
+
+
+def book_item(row):
+    """ what GET /books/<isbn> returns for a book, from a book_serializer row """
+    data = book_serializer.dump_row(row)
+    # the average comes from the running totals on the book, not an AVG() over its ratings
+    data['average_rating'] = Book.average_rating(data['rating_count'], data['rating_sum'])
+    return data
+
+
+def cached_books(field, values):
+    """ returns ({value: book item} for the books whose `field` ('isbn' or 'id') is in values, cache hits).
+        cached books come from one cache lookup, the rest from one IN (...) query per BATCH_CHUNK_SIZE values,
+        and are cached for next time
+    """
+    keys = {BOOK_ITEM_KEYS[field].format(value): value for value in values}
+    books = {keys[key]: item for key, item in get_items(keys).items()}
+    hits = len(books)
+
+    missing = [value for value in values if value not in books]
+    column = BOOK_SORT_COLUMNS[field]
+    for i in range(0, len(missing), BATCH_CHUNK_SIZE):
+        rows = db.session.execute(book_serializer.select().where(column.in_(missing[i:i + BATCH_CHUNK_SIZE])))
+        items = {}
+        for row in rows:
+            item = book_item(row)
+            books[item[field]] = item
+            # evicted with the rest of the book's cached responses when it changes
+            tags = {f"book:{row.id}"}
+            for key_field, key in BOOK_ITEM_KEYS.items():
+                if item[key_field] is not None:
+                    items[key.format(item[key_field])] = (item, tags)
+        set_items(items, timeout=CATALOG_TTL)
+
+    return books, hits
+
 
 # POST (create) book
 @api.route("/books", methods=['POST'])
@@ -149,9 +204,283 @@ def add_book(username):
         return jsonify(message={"Error": e}), HTTPStatus.INTERNAL_SERVER_ERROR
 
 
+# POST (bulk create) books
+@api.route("/books/import", methods=['POST'])
+@admin_required
+@max_statements(None)
+def import_books_route(username):
+    """ This endpoint creates many books from an uploaded CSV or NDJSON file
+        HTTP Method: POST
+        Headers:
+            content-type = multipart/form-data (file in a field called "file"),
+                           text/csv or application/x-ndjson (file as the raw body)
+        authentication: Admin
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |     format        |   string  |      No       |   "csv" or "ndjson". guessed  |
+        |                   |           |               |   from the content type or    |
+        |                   |           |               |   file name if missing        |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |   chunk_size      |   Integer |      No       |   rows validated and inserted |
+        |                   |           |               |   per transaction (def. 500)  |
+        |___________________|___________|_______________|_______________________________|
+        every row has the same fields as the POST /books body (csv: one column per field, header line first).
+        rows that fail validation, have an ISBN that already exists or an unknown author_id are skipped
+        and reported, the rest are inserted.
+    Example (csv):
+        isbn,title,author_id,genre,price,date_published,publisher
+        1-87-876587-9879,cien años de soledad,5,fiction,25,2022-05-22,penguin
+    Returns:
+        successful:
+            json response: {"inserted", "failed", "errors": [{"row", "errors"}], "elapsed_seconds", "rows_per_second"}
+        unsuccessful:
+            json response: returns a json error message
+    """
+    upload = request.files.get('file')
+    name = upload.filename if upload else ''
+    mimetype = upload.mimetype if upload else request.mimetype
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'ndjson' if 'ndjson' in mimetype or name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    try:
+        chunk_size = int(request.args.get('chunk_size', CHUNK_SIZE))
+        rows = read_rows(text_stream(upload.stream if upload else request.stream), fmt)
+    except ValueError as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+    if chunk_size < 1:
+        return jsonify(message={"Error": "chunk_size must be greater than 0"}), HTTPStatus.BAD_REQUEST
+
+    report = import_books(rows, min(chunk_size, CHUNK_SIZE)).as_dict()
+    status = HTTPStatus.CREATED if report['inserted'] else HTTPStatus.BAD_REQUEST
+    return json_response(report, status)
+
+
+def price_arg(name):
+    """ a price filter from the query string as a float, None if it isn't there.
+        raises ValueError for anything that isn't a finite number (request.args.get(type=...) would just drop it)
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        price = math.nan
+    if not math.isfinite(price):
+        raise ValueError(f"{name} must be a number, got: {value}")
+    return price
+
+
+# GET books matching a search
+@api.route("/books/search", methods=['GET'])
+@token_required
+@cached_response(timeout=CATALOG_TTL)
+def search_books(username):
+    """ This endpoint searches the title, description, genre, publisher and author name of every book
+        HTTP Method: GET
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |        q          |   string  |      Yes      |   words to search for. all of |
+        |                   |           |               |   them must match. the last   |
+        |                   |           |               |   word (and any ending in *)  |
+        |                   |           |               |   matches as a prefix         |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      genre        |   string  |      No       |   exact genre                 |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        | min_price /       |   number  |      No       |   price range (inclusive)     |
+        | max_price         |           |               |                               |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        | published_after / |   date    |      No       |   "YYYY-MM-DD", inclusive     |
+        | published_before  |   string  |               |                               |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |  limit / after    |           |      No       |   same as GET /books          |
+        |___________________|___________|_______________|_______________________________|
+        Example:
+            /books/search?q=soledad gab&genre=fiction&max_price=30
+        Returns:
+            successful:
+                json response: the matching books, best match first, and the cursor for the next page
+            unsuccessful:
+                json response: returns a json error message
+    """
+    try:
+        limit, _, offset = parse_page_args(request.args, {'rank': None}, default_sort='rank')
+        filters = {
+            'genre': request.args.get('genre'),
+            'min_price': price_arg('min_price'),
+            'max_price': price_arg('max_price'),
+            'published_after': parse(request.args['published_after']).date() if 'published_after' in request.args else None,
+            'published_before': parse(request.args['published_before']).date() if 'published_before' in request.args else None,
+        }
+    except (ValueError, OverflowError) as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+
+    # results are ordered by relevance, which no index can walk, so the cursor holds an offset
+    offset = offset or 0
+    if type(offset) is not int or offset < 0:
+        return jsonify(message={"Error": "Invalid cursor"}), HTTPStatus.BAD_REQUEST
+    stmt = search_statement(request.args.get('q', ''), limit + 1, offset, **filters)
+    if stmt is None:
+        return jsonify(message={"Error": "q must contain at least one word"}), HTTPStatus.BAD_REQUEST
+
+    books = db.session.execute(stmt).all()
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        next_cursor = encode_cursor('rank', offset + limit)
+
+    tag_response("books:search")
+    return json_response({"books_list": book_serializer.dump_rows(books), "next_cursor": next_cursor}, HTTPStatus.OK)
+
+
+# GET best selling books
+@api.route("/books/top-sellers", methods=['GET'])
+@token_required
+@cached_response(timeout=CATALOG_TTL)
+def top_selling_books(username):
+    """ This endpoint returns the best selling books, most copies sold first
+        HTTP Method: GET
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      limit        |   Integer |      No       |   defaults to 10, max 100     |
+        |___________________|___________|_______________|_______________________________|
+        Example:
+            /books/top-sellers?limit=10
+        Returns:
+            successful:
+                json response: returns a list of books
+            unsuccessful:
+                json response: returns a json error message
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify(message={"Error": f"limit must be an integer, got: {request.args.get('limit')}"}), HTTPStatus.BAD_REQUEST
+    if not 1 <= limit <= MAX_TOP_SELLERS:
+        return jsonify(message={"Error": f"limit must be between 1 and {MAX_TOP_SELLERS}"}), HTTPStatus.BAD_REQUEST
+
+    # the ranking is kept in memory, so this is a primary key lookup of `limit` books
+    ids = top_sellers.top(limit)
+    rows = {row.id: row for row in db.session.execute(book_serializer.select().where(Book.id.in_(ids)))}
+    books = [book_serializer.dump_row(rows[id]) for id in ids if id in rows]
+
+    tag_response("books:top-sellers", *(f"book:{id}" for id in ids))
+    return json_response({"books_list": books}, HTTPStatus.OK)
+
+
+# GET a page of books in a genre
+@api.route("/books/genre/<genre>", methods=['GET'])
+@token_required
+@cached_response(timeout=CATALOG_TTL)
+def books_by_genre(username, genre: str):
+    """ This endpoint returns a page of the books in a genre
+        HTTP Method: GET
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |  limit / after    |           |      No       |   same as GET /books          |
+        |___________________|___________|_______________|_______________________________|
+        Example:
+            /books/genre/horror?limit=20
+        Returns:
+            successful:
+                json response: returns a list of books and the cursor for the next page
+                (next_cursor is null on the last page)
+            unsuccessful:
+                json response: returns a json error message
+    """
+    try:
+        limit, sort_key, after = parse_page_args(request.args, {'id': Book.id})
+    except ValueError as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+
+    # a range scan of the (genre, id) index, same cost on page 1 and page 1000
+    books, next_cursor = keyset_page(book_serializer.select().where(Book.genre == genre), Book.id, sort_key,
+                                     limit, after, session=db.session)
+
+    tag_response(f"genre:{genre}", *(f"book:{book.id}" for book in books))
+    return json_response({"books_list": book_serializer.dump_rows(books), "next_cursor": next_cursor}, HTTPStatus.OK)
+
+
+# POST (look up) many books at once
+@api.route("/books/batch", methods=['POST'])
+@token_required
+def books_batch(username):
+    """ This endpoint returns many books in one request, instead of one GET /books/<isbn> per book
+        HTTP Method: POST
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters (send one of them):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      isbns        | list of   |      No       |   up to 1000                  |
+        |                   | strings   |               |                               |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |       ids         | list of   |      No       |   up to 1000                  |
+        |                   | integers  |               |                               |
+        |___________________|___________|_______________|_______________________________|
+        Example body:
+            {
+                "isbns": ["1-87-876587-9879", "0-306-40615-2"]
+            }
+        Returns:
+            successful:
+                json response: {"books": [...], "missing": [...]}. books are in the order they were asked
+                for (the same as GET /books/<isbn> returns), missing lists the isbns/ids we don't have
+            unsuccessful:
+                json response: returns a json error message
+    """
+    body = request.get_json(silent=True) or {}
+    fields = [field for field in ('isbns', 'ids') if field in body]
+    if len(fields) != 1:
+        return jsonify(message={"Error": "body must include either isbns or ids"}), HTTPStatus.BAD_REQUEST
+    field = fields[0]
+    values = body[field]
+
+    expected = str if field == 'isbns' else int
+    if type(values) is not list or not all(type(value) is expected for value in values):
+        return jsonify(message={"Error": f"{field} must be a list of {'strings' if expected is str else 'integers'}"}), HTTPStatus.BAD_REQUEST
+    if len(values) > MAX_BATCH_SIZE:
+        return jsonify(message={"Error": f"at most {MAX_BATCH_SIZE} {field} per request"}), HTTPStatus.BAD_REQUEST
+
+    values = list(dict.fromkeys(values))  # drop duplicates, keep the order
+    books, hits = cached_books(field[:-1], values)
+
+    resp = json_response({
+        "books": [books[value] for value in values if value in books],
+        "missing": [value for value in values if value not in books],
+    }, HTTPStatus.OK)
+    resp.headers['X-Cache-Hits'] = f"{hits}/{len(values)}"
+    return resp
+
+
 # GET a book by ISBN
 @api.route("/books/<isbn>", methods=['GET'])
-@cache.cached(timeout=5)
 @token_required
 def book_details(usename, isbn: str):
     """ This endpoint returns the book for a given ISBN
@@ -178,40 +507,99 @@ def book_details(usename, isbn: str):
                 json response: returns a json error message
         
     """
-    book = Book.query.filter_by(isbn=isbn).first()
+    books, hits = cached_books('isbn', [isbn])
     
-    if book is None:
+    if isbn not in books:
         return jsonify(message={"Error": f"We dont have a book with ISBN:{isbn} in our system."}), HTTPStatus.NOT_FOUND
 
-    return jsonify(book.as_dict()), HTTPStatus.OK
+    # the cached item has the book's version, so a client that already has it gets a 304 without a body
+    book = books[isbn]
+    etag = make_etag(f"books:{book['id']}={book['version']}")
+    last_modified = datetime.datetime.fromisoformat(book['updated_at']) if book['updated_at'] else None
+    resp = not_modified(etag, last_modified)
+    if resp is None:
+        resp = with_validators(jsonify(book), etag, last_modified)
+    resp.headers['X-Cache'] = 'HIT' if hits else 'MISS'
+    return resp
 
 
 # GET ALL books
 @api.route("/books", methods=['GET'])
-@cache.cached(timeout=5)
 @token_required
+@conditional(lambda: collection_version('books'))
+@cached_response(timeout=CATALOG_TTL, unless=lambda: wants_stream(request))
 def all_books(username):
-    """ This endpoint returns all books in server
+    """ This endpoint returns a page of books in server
         HTTP Method: GET
         Headers:
             content-type = application/json
+            Accept = application/x-ndjson (optional, same as stream=true)
         authentication: user (TODO)
-        available parameters: None needed
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      limit        |   Integer |      No       |   books per page. defaults    |
+        |                   |           |               |   to 50, max 500              |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      after        |   string  |      No       |   the next_cursor value from  |
+        |                   |           |               |   the previous page           |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |    order_by       |   string  |      No       |   "id" (default) or "isbn"    |
+        |                   |           |               |                               |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |     stream        |  boolean  |      No       |   if true, every book is      |
+        |                   |           |               |   streamed back as NDJSON     |
+        |                   |           |               |   (one book per line)         |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |   min_rating      |   number  |      No       |   only books with an average  |
+        |                   |           |               |   rating of at least this     |
+        |___________________|___________|_______________|_______________________________|
+        Example:
+            /books?limit=100&after=eyJrIjoiaWQiLCJ2IjoxMDB9
         Returns:
             successful:
-                json response: returns a list of all books in server
+                json response: returns a list of books and the cursor for the next page
+                (next_cursor is null on the last page)
             unsuccessful:
                 json response: returns a json error message
     """
-    books = Book.query.all() # returns list of books
-    
-    if books is None:
-        return jsonify(message={"Error:": "No books found"}), HTTPStatus.NOT_FOUND
-    
-    # convert book obj to dict and store in list of book dicts
-    books = [book.as_dict() for book in books] 
-        
-    return jsonify(books_list=books), HTTPStatus.OK
+    stmt = book_serializer.select()
+    min_rating = request.args.get('min_rating')
+    if min_rating is not None:
+        try:
+            min_rating = float(min_rating)
+        except ValueError:
+            return jsonify(message={"Error": f"min_rating must be a number, got: {min_rating}"}), HTTPStatus.BAD_REQUEST
+        # average >= min_rating without dividing (or aggregating): sum >= min_rating * count
+        stmt = stmt.where(Book.rating_count > 0, Book.rating_sum >= min_rating * Book.rating_count)
+
+    if wants_stream(request):
+        return stream_ndjson(db.session, stmt.order_by(Book.id), book_serializer.dump_row)
+
+    try:
+        limit, sort_key, after = parse_page_args(request.args, BOOK_SORT_COLUMNS)
+    except ValueError as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+
+    # plain rows from a Core select, no Book objects (or lazy loads) involved
+    books, next_cursor = keyset_page(stmt, BOOK_SORT_COLUMNS[sort_key], sort_key,
+                                     limit, after, session=db.session)
+
+    # tag the page so changing any book on it (or adding a book that would land on it) evicts it
+    tag_response(*(f"book:{book.id}" for book in books))
+    if min_rating is not None:
+        tag_response("books:rated")
+    if sort_key == 'isbn':
+        tag_response("books:order:isbn")
+    elif next_cursor is None:
+        tag_response("books:tail")
+
+    return json_response({"books_list": book_serializer.dump_rows(books), "next_cursor": next_cursor}, HTTPStatus.OK)
 
 
 # PUT (update) book 
@@ -18,12 +18,13 @@ from ..models import db, Book, Author, ma, BookSchema, User, UserSchema, CreditC
 from dateutil.parser import parse
 from http import HTTPStatus
 
-from ..auth import token_required, admin_required
-import jwt
+from ..auth import (token_required, admin_required, issue_tokens, verify_refresh_token, revoke_refresh_token,
+                    revoke_user_tokens, InvalidToken)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
+from ..passwords import hash_password, verify_password
 # keep this if an endpoint requires caching 
-from werkzeug.security import generate_password_hash, check_password_hash
-import datetime
 from ..cache import cache
 
 # update name-> V-----V     
@@ -32,7 +33,8 @@ api = Blueprint('profile_management_routes', __name__)
 @api.route("/create-user", methods=['POST'])
 def add_user():
     data = request.get_json()
-    hashed_password = generate_password_hash(data['password'], method='sha256')
+    # hashed on the password pool, a 503 if it's full
+    hashed_password = hash_password(data['password'])
     data['password'] = hashed_password
     user = User(**data)
     db.session.add(user)
@@ -41,7 +43,6 @@ def add_user():
 
 @api.route("/get-token", methods=['POST'])
 def login():
-    from ..app import app
     auth = request.authorization  
     if not auth or not auth.username or not auth.password: 
         return make_response('could not verify', 401, {'Authentication': 'login required"'})   
@@ -49,14 +50,49 @@ def login():
     user = User.query.filter_by(username=auth.username).first() 
     if not user:
         return jsonify({"message":"user not found"}), 404
-    print(check_password_hash(user.password, auth.password)) 
-    if check_password_hash(user.password, auth.password):
-        token = jwt.encode({'username' : user.username, 'id': user.id, 'exp' : datetime.datetime.utcnow() + datetime.timedelta(minutes=1000)}, app.config['SECRET_KEY'], "HS256")
-
-        return jsonify({'token' : token})
+    matches, new_hash = verify_password(auth.password, user.password)
+    if matches:
+        if new_hash:
+            # an old hash (or an old cost), upgrade it now that we have the password
+            user.password = new_hash
+            db.session.commit()
+        # a short-lived access token (the `token`) and a refresh token for POST /refresh-token
+        return jsonify(issue_tokens(user))
 
     return make_response('could not verify',  401, {'Authentication': '"login required"'})  
 
+# trade a refresh token for a new access token (and a new refresh token, each one only works once)
+@api.route("/refresh-token", methods=['POST'])
+def refresh_token():
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = verify_refresh_token(data.get('refresh_token') or '')
+    except InvalidToken:
+        return jsonify({'message': 'refresh token is invalid'}), HTTPStatus.UNAUTHORIZED
+    user = User.query.get(claims['id'])
+    # the version check catches revocations this worker's denylist hasn't synced yet
+    if user is None or user.token_version != claims['ver']:
+        return jsonify({'message': 'refresh token is invalid'}), HTTPStatus.UNAUTHORIZED
+    revoke_refresh_token(claims)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # someone else refreshed with this token first
+        db.session.rollback()
+        return jsonify({'message': 'refresh token is invalid'}), HTTPStatus.UNAUTHORIZED
+    return jsonify(issue_tokens(user)), HTTPStatus.OK
+
+# log out everywhere: every access and refresh token the user has stops working
+@api.route("/logout", methods=['POST'])
+@token_required
+def logout(current_user):
+    user = User.query.get(current_user.id)
+    if user is None:
+        return jsonify({'message': 'token is invalid'}), HTTPStatus.UNAUTHORIZED
+    revoke_user_tokens(user)
+    db.session.commit()
+    return jsonify({'message': 'logged out'}), HTTPStatus.OK
+
 @api.route("/user", methods=['GET'])
 def get_user():
     id = request.json['id']
@@ -68,26 +104,27 @@ def get_user():
 # route that returns all credit cards for a user given the users username
 @api.route("/credit-cards", methods=['GET'])
 @token_required
-def get_credit_cards(username):
+def get_credit_cards(current_user):
     user_name = request.json['username']
     user = User.query.filter_by(username=user_name).first()
-    if username != user_name:
+    if current_user.username != user_name:
         return jsonify({"Error": "you are not authorized to view this data"}), HTTPStatus.UNAUTHORIZED
     if user is None:
-        return jsonify(msg={"Error":f"User with username:{username}, does not exist."}), HTTPStatus.NOT_FOUND
-    credit_cards = CreditCard.query.filter_by(user_id=user.id).all()
+        return jsonify(msg={"Error":f"User with username:{user_name}, does not exist."}), HTTPStatus.NOT_FOUND
+    # CreditCardSchema nests the user, load it with the cards
+    credit_cards = CreditCard.query.options(joinedload(CreditCard.user)).filter_by(user_id=user.id).all()
     credit_cards_schema = CreditCardSchema(many=True)
     return jsonify(credit_cards_schema.dump(credit_cards)), HTTPStatus.ACCEPTED
 
 # create endpoint that adds a new credit card to the users creditCard column
 @api.route("/add-cc", methods=['POST'])
 @token_required
-def add_cc(username):
+def add_cc(current_user):
     user = User.query.filter_by(username=request.json['username']).first()
-    if username != user.username:
-        return jsonify({"Error": "You are not authorized to add a credit card to this user."}), HTTPStatus.UNAUTHORIZED
     if user is None:
         return jsonify({"Error":"User does not exist."}), HTTPStatus.NOT_FOUND
+    if current_user.username != user.username:
+        return jsonify({"Error": "You are not authorized to add a credit card to this user."}), HTTPStatus.UNAUTHORIZED
     cc = request.json['credit_card']
     creditCard = CreditCard(user=user, credit_card=cc)
     
@@ -104,13 +141,13 @@ def add_cc(username):
 # define endpoint that retrieves the first credit card for a user
 @api.route("/get-cc", methods=['GET'])
 @token_required
-def get_cc(username):
+def get_cc(current_user):
     user_name = request.json['username']
     user = User.query.filter_by(username=user_name).first()
-    if username != user_name:
+    if current_user.username != user_name:
         return jsonify({"Error": f"You do not have access to this information"}), HTTPStatus.UNAUTHORIZED
     if user is None:
-        return jsonify({"Error":f"User with username:{username}, does not exist."}), HTTPStatus.NOT_FOUND
+        return jsonify({"Error":f"User with username:{user_name}, does not exist."}), HTTPStatus.NOT_FOUND
     credit_card = CreditCard.query.filter_by(user_id=user.id).first()
     credit_cards_schema = CreditCardSchema()
     return jsonify(credit_cards_schema.dump(credit_card)), HTTPStatus.ACCEPTED
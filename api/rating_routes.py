@@ -0,0 +1,216 @@
+from datetime import datetime
+
+from flask import request, jsonify, Blueprint
+from sqlalchemy import update
+
+from ..models import db, Book, Rating, Comment, CommentSchema, comment_serializer, rating_serializer
+from ..serializers import json_response
+from http import HTTPStatus
+from ..cache import cached_response, tag_response, CATALOG_TTL
+from ..auth import token_required
+from ..pagination import parse_page_args, keyset_page
+from ..carts import _insert
+from ..invalidation import evict_on_commit, rating_tags
+from ..conditional import bump_collections
+
+api = Blueprint('rating_routes', __name__)
+
+MIN_RATING = 1
+MAX_RATING = 5
+
+
+def rating_summary(book):
+    return {
+        "average_rating": Book.average_rating(book.rating_count, book.rating_sum),
+        "rating_count": book.rating_count,
+    }
+
+
+# POST (create or change) the current user's rating of a book
+@api.route("/books/<isbn>/ratings", methods=['POST'])
+@token_required
+def add_rating(current_user, isbn: str):
+    """ This endpoint rates a book. rating it again changes the user's rating
+        HTTP Method: POST
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters:
+        |      Name         |   Type    |   Required    |           Comments            |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      rating       |   Integer |      Yes      |   1 to 5                      |
+        |___________________|___________|_______________|_______________________________|
+        Example body:
+            {
+                "rating": 4
+            }
+        Returns:
+            successful:
+                json response: the rating plus the book's new average_rating and rating_count
+            unsuccessful:
+                json response: returns a json error message
+    """
+    value = (request.get_json(silent=True) or {}).get('rating')
+    if type(value) is not int or not MIN_RATING <= value <= MAX_RATING:
+        return jsonify(message={"Error": f"rating must be an integer from {MIN_RATING} to {MAX_RATING}"}), HTTPStatus.BAD_REQUEST
+
+    book = Book.query.filter_by(isbn=isbn).first()
+    if book is None:
+        return jsonify(message={"Error": f"We dont have a book with ISBN:{isbn} in our system."}), HTTPStatus.NOT_FOUND
+
+    # insert-or-nothing on the unique (book_id, user_id) index: two first ratings at once can't both insert,
+    # and only the one that did counts it
+    inserted = db.session.execute(
+        _insert(Rating).values(book_id=book.id, user_id=current_user.id, rating=value)
+        .on_conflict_do_nothing(index_elements=['book_id', 'user_id'])
+    ).rowcount == 1
+    # FOR UPDATE (a no-op on sqlite, where the insert above already took the write lock) so a concurrent
+    # change of the same rating waits for this one, and the sum delta is computed from what's really there
+    rating = Rating.query.filter_by(book_id=book.id, user_id=current_user.id).with_for_update().one()
+    if inserted:
+        count_delta, sum_delta, status = 1, value, HTTPStatus.CREATED
+    else:
+        count_delta, sum_delta, status = 0, value - (rating.rating or 0), HTTPStatus.OK
+        rating.rating = value
+    # the insert is a Core statement, collect_tags and the ORM's collection bump don't see it
+    evict_on_commit(db.session, *rating_tags(rating))
+    bump_collections(db.session.connection(), ['books'])
+
+    try:
+        # the totals are updated in sql (count = count + 1), in the same transaction as the rating,
+        # so two ratings of the same book at the same time can't overwrite each other's update
+        db.session.execute(
+            update(Book)
+            .where(Book.id == book.id)
+            .values(rating_count=Book.rating_count + count_delta, rating_sum=Book.rating_sum + sum_delta,
+                    # a Core update doesn't bump version_id_col/onupdate columns by itself
+                    version=Book.version + 1, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return jsonify(rating=rating.as_dict(), **rating_summary(book)), status
+
+
+# GET a book's ratings
+@api.route("/books/<isbn>/ratings", methods=['GET'])
+@token_required
+@cached_response(timeout=CATALOG_TTL)
+def book_ratings(username, isbn: str):
+    """ This endpoint returns a page of a book's ratings plus its average rating
+        HTTP Method: GET
+        authentication: user
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |  limit / after    |           |      No       |   same as GET /books          |
+        |___________________|___________|_______________|_______________________________|
+        Returns:
+            successful:
+                json response: average_rating, rating_count, a list of ratings and the cursor for the next page
+            unsuccessful:
+                json response: returns a json error message
+    """
+    book = Book.query.filter_by(isbn=isbn).first()
+    if book is None:
+        return jsonify(message={"Error": f"We dont have a book with ISBN:{isbn} in our system."}), HTTPStatus.NOT_FOUND
+
+    try:
+        limit, sort_key, after = parse_page_args(request.args, {'id': Rating.id})
+    except ValueError as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+
+    ratings, next_cursor = keyset_page(rating_serializer.select().where(Rating.book_id == book.id), Rating.id,
+                                       sort_key, limit, after, session=db.session)
+
+    tag_response(f"book:{book.id}", f"ratings:{book.id}")
+    return json_response({**rating_summary(book), "ratings": rating_serializer.dump_rows(ratings),
+                          "next_cursor": next_cursor}, HTTPStatus.OK)
+
+
+# POST a comment on a book
+@api.route("/books/<isbn>/comments", methods=['POST'])
+@token_required
+def add_comment(current_user, isbn: str):
+    """ This endpoint adds a comment to a book
+        HTTP Method: POST
+        Headers:
+            content-type = application/json
+        authentication: user
+        available parameters:
+        |      Name         |   Type    |   Required    |           Comments            |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |   comment_text    |   string  |      Yes      |   up to 200 chars             |
+        |___________________|___________|_______________|_______________________________|
+        Example body:
+            {
+                "comment_text": "loved it"
+            }
+        Returns:
+            successful:
+                json response: returns the comment
+            unsuccessful:
+                json response: returns a json error message
+    """
+    body = request.get_json(silent=True) or {}
+    invalid_msg = CommentSchema(only=('comment_text',)).validate(body)
+    if invalid_msg:
+        return jsonify(invalid_msg), HTTPStatus.BAD_REQUEST
+    if not body.get('comment_text'):
+        return jsonify(message={"Error": "comment_text must be included in the body"}), HTTPStatus.BAD_REQUEST
+
+    book = Book.query.filter_by(isbn=isbn).first()
+    if book is None:
+        return jsonify(message={"Error": f"We dont have a book with ISBN:{isbn} in our system."}), HTTPStatus.NOT_FOUND
+
+    comment = Comment(book_id=book.id, user_id=current_user.id, comment_text=body['comment_text'])
+    db.session.add(comment)
+    db.session.commit()
+    return jsonify(comment.as_dict()), HTTPStatus.CREATED
+
+
+# GET a book's comments
+@api.route("/books/<isbn>/comments", methods=['GET'])
+@token_required
+@cached_response(timeout=CATALOG_TTL)
+def book_comments(username, isbn: str):
+    """ This endpoint returns a page of a book's comments, oldest first
+        HTTP Method: GET
+        authentication: user
+        available parameters (query string):
+        |      Name         |   Type    |   Required    |           Comments            |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |  limit / after    |           |      No       |   same as GET /books          |
+        |___________________|___________|_______________|_______________________________|
+        Example:
+            /books/1-87-876587-9879/comments?limit=20
+        Returns:
+            successful:
+                json response: a list of comments and the cursor for the next page
+                (next_cursor is null on the last page)
+            unsuccessful:
+                json response: returns a json error message
+    """
+    book = Book.query.filter_by(isbn=isbn).first()
+    if book is None:
+        return jsonify(message={"Error": f"We dont have a book with ISBN:{isbn} in our system."}), HTTPStatus.NOT_FOUND
+
+    try:
+        limit, sort_key, after = parse_page_args(request.args, {'id': Comment.id})
+    except ValueError as e:
+        return jsonify(message={"Error": str(e)}), HTTPStatus.BAD_REQUEST
+
+    # (book_id, id) range scan: comments are filtered by ix_comments_book_id, whose entries are in rowid order
+    comments, next_cursor = keyset_page(comment_serializer.select().where(Comment.book_id == book.id), Comment.id,
+                                        sort_key, limit, after, session=db.session)
+
+    tag_response(f"comments:{book.id}")
+    return json_response({"comments": comment_serializer.dump_rows(comments), "next_cursor": next_cursor},
+                         HTTPStatus.OK)
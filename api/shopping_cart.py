@@ -14,17 +14,29 @@ import json
 from flask import request, jsonify, Blueprint
 
 # add your models to the models.py file then import them here
-from ..models import db, Book, Author, ma, BookSchema, User, ShoppingCart, ShoppingCartSchema
+from ..models import db, Book, Author, ma, BookSchema, User, ShoppingCart, ShoppingCartSchema, Wishlist
+from ..serializers import json_response
 from dateutil.parser import parse
 from http import HTTPStatus
 
 # keep this if an endpoint requires caching 
 from ..cache import cache
 from ..auth import token_required, admin_required
+from ..instrumentation import max_statements
+from ..transactions import atomic
+from ..carts import (cart_for, wishlist_for, touch_cart, add_to_cart, remove_from_cart, add_to_wishlist,
+                     remove_from_wishlist, clear_cart, clear_wishlist, move_to_cart, move_to_wishlist)
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 
 # update name-> V-----V     
 api = Blueprint('shopping_cart_routes', __name__)
 
+MAX_BATCH_OPERATIONS = 100
+MAX_QUANTITY = 100
+BATCH_OPS = ('add', 'remove', 'move', 'clear')
+BATCH_LISTS = ('cart', 'wishlist')
+
 # example route definition
 # the decorator below starts with `@api` because that what the blueprint was name on line 14
 @api.route("/route", methods=['GET'])
@@ -35,29 +47,35 @@ def routeFunction():
 # Creates shopping cart for given user
 @api.route("/shopping-cart", methods=['POST'])
 @token_required
+@atomic()
 def add_shopping_cart(username):
     
     username = request.json['username']
 
     user = User.query.filter_by(username=username).first()
-    if user.shoppingCart:
-        return jsonify(message={"Error": f"User {username} already has a shopping cart"}), HTTPStatus.BAD_REQUEST
+    if user is None:
+        return jsonify(message={"Error": "Did not provide a proper username"}), HTTPStatus.NOT_FOUND
 
-    shopping_cart = ShoppingCart(user=user)
+    if cart_for(user.id, create=False) is not None:
+        return jsonify(message={"Error": f"User {username} already has a shopping cart"}), HTTPStatus.BAD_REQUEST
 
-    try:
-        db.session.add(shopping_cart)
-        db.session.commit()
+    cart = cart_for(user.id)
 
-    except Exception as e:
-        return jsonify({"Error": "something went wrong"}), 500
+    return jsonify(ShoppingCart={"user": user.username, "shopping cart": ShoppingCart.cart_books(cart.id)}), 200
 
-    return jsonify(ShoppingCart={"user": user.username, "shopping cart": shopping_cart.books}), 200
 
+# adding a book runs at most: the user and the book (2), the cart lookup, plus an insert and a second lookup
+# if the user has no cart yet (3), the cart's version bump and the cart upsert (2), the cart's books for the
+# response (1), and with an Idempotency-Key the key lookup, the delete of expired keys and the key insert (3)
+UPDATE_CART_STATEMENTS = 11
 
 # Updates shopping cart for given user
+# one upsert of the cart item (quantity + 1 if the book is already in the cart), in one transaction
+# with the cart's version bump. send an Idempotency-Key header to make retries safe
 @api.route("/shopping-cart", methods=['PUT'])
 @token_required
+@atomic()
+@max_statements(UPDATE_CART_STATEMENTS)
 def update_shopping_cart(username):
     if not 'username' in request.json:
         return jsonify({"Error": "Did not provide username in request body"}), 500
@@ -71,38 +89,23 @@ def update_shopping_cart(username):
     user = User.query.filter_by(username=username).first()
     book = Book.query.filter_by(isbn=isbn).first()
 
+    if user is None:
+        return jsonify(message={"Error": "Did not provide a proper username"}), HTTPStatus.NOT_FOUND
+
     if book is None:
         return jsonify({"Error": "Book does not exist"}), 404
-    
-
-
-    if user.shoppingCart is None:
-        shopping_cart = ShoppingCart(user=user,book=book)
-        try:
-            db.session.add(shopping_cart)
-            db.session.commit()
 
-        except Exception as e:
-            return jsonify({"Error": "something went wrong"}), 500
+    cart = cart_for(user.id)
+    touch_cart(cart)
+    add_to_cart(cart.id, book.id)
 
-    else: 
-        try:
-            shopping_cart=ShoppingCart.query.get(user.shoppingCart.id)
-            shopping_cart.books.append(book)
-            db.session.add(shopping_cart)
-            db.session.commit()
-
-        except Exception as e:
-            return jsonify({"Error": "something went wrong"}), 500            
-
-    books = user.shoppingCart.books 
-    books = [book.as_dict() for book in books]
-
-    return jsonify({"shopping_cart":books}), 200      
+    return jsonify({"shopping_cart": ShoppingCart.cart_books(cart.id)}), 200
 
 # Removes given book from given users shopping cart
+# one DELETE of the cart item, instead of loading the cart's books and looking for the isbn in python
 @api.route("/delete-book", methods=['PUT'])
 @token_required
+@atomic()
 def delete_book(username):
     if not 'username' in request.json:
         return jsonify({"Error": "Did not provide username in request body"}), 500
@@ -111,35 +114,171 @@ def delete_book(username):
         return jsonify({"Error": "Did not provide isbn in request body"}), 500  
 
     username=request.json['username']
-    deletedbook = None
 
     user = User.query.filter_by(username=username).first()
 
     if user is None:
         return jsonify(message={"Error": "Did not provide a proper username"}), HTTPStatus.NOT_FOUND
 
-    if user.shoppingCart is None:
+    cart = cart_for(user.id, create=False)
+    if cart is None:
         return jsonify(message={"Error": "Username given does not have a shopping cart"})
 
-    shoppingcart = ShoppingCart.query.get(user.shoppingCart.id)
-    
-
-
-    books = shoppingcart.books
+    book = Book.query.filter_by(isbn=request.json['isbn']).first()
 
-    
-    for book in books:
-        if book.isbn == request.json['isbn']:
-            deletedbook = book
-            shoppingcart.books.remove(book)
-
-    db.session.commit()  
-
-    if deletedbook is None:
+    if book is None or not remove_from_cart(cart.id, book.id):
         return jsonify({"Error": "Book with isbn provided is not in shopping cart"})  
 
-    schema = ShoppingCartSchema()
-    return jsonify({"You removed this book from your shopping cart":deletedbook.as_dict()}), 200
+    touch_cart(cart)
+
+    return jsonify({"You removed this book from your shopping cart":book.as_dict()}), 200
+
+
+# checks the operations of a batch, returns {index: error} for the ones that are wrong
+def operation_errors(operations):
+    errors = {}
+    for i, operation in enumerate(operations):
+        if type(operation) is not dict:
+            errors[i] = "must be an object"
+            continue
+        op, target, isbn = operation.get('op'), operation.get('list'), operation.get('isbn')
+        quantity = operation.get('quantity', 1)
+        if op not in BATCH_OPS:
+            errors[i] = f"op must be one of: {', '.join(BATCH_OPS)}"
+        elif target not in BATCH_LISTS:
+            errors[i] = f"list must be one of: {', '.join(BATCH_LISTS)}"
+        elif isbn is not None and type(isbn) is not str:
+            errors[i] = "isbn must be a string"
+        elif op in ('add', 'remove') and isbn is None:
+            errors[i] = f"{op} needs an isbn"
+        elif op == 'clear' and isbn is not None:
+            errors[i] = "clear empties the whole list, it doesn't take an isbn"
+        elif 'quantity' in operation and (op, target) != ('add', 'cart'):
+            errors[i] = "quantity only applies to adding to the cart"
+        elif type(quantity) is not int or not 1 <= quantity <= MAX_QUANTITY:
+            errors[i] = f"quantity must be an integer from 1 to {MAX_QUANTITY}"
+    return errors
+
+
+# applies one operation of a batch, returns how many books it changed
+def apply_operation(operation, cart_id, wishlist_id, book_ids):
+    op, target = operation['op'], operation['list']
+    book_id = book_ids.get(operation.get('isbn'))
+
+    if op == 'add' and target == 'cart':
+        add_to_cart(cart_id, book_id, operation.get('quantity', 1))
+        return 1
+    if op == 'add':
+        return int(add_to_wishlist(wishlist_id, book_id))
+    if op == 'remove' and target == 'cart':
+        return int(remove_from_cart(cart_id, book_id))
+    if op == 'remove':
+        return int(remove_from_wishlist(wishlist_id, book_id))
+    if op == 'clear' and target == 'cart':
+        return clear_cart(cart_id)
+    if op == 'clear':
+        return clear_wishlist(wishlist_id)
+
+    # move: from `list` to the other one. no isbn moves everything
+    only = None if book_id is None else [book_id]
+    if target == 'wishlist':
+        return move_to_cart(wishlist_id, cart_id, only)
+    return move_to_wishlist(cart_id, wishlist_id, only)
+
+
+# Applies many cart/wishlist changes at once
+@api.route("/shopping-cart/batch", methods=['POST'])
+@token_required
+@atomic()
+@max_statements(None) # one or two statements per operation, up to MAX_BATCH_OPERATIONS of them
+def batch_update(current_user):
+    """ This endpoint applies a list of changes to the current user's shopping cart and wishlist, in order,
+        all in one transaction: either every operation is applied or none is
+        HTTP Method: POST
+        Headers:
+            content-type = application/json
+            Idempotency-Key (optional, see README)
+        authentication: user
+        available parameters:
+        |      Name         |   Type    |   Required    |           Comments            |            
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |    operations     | list of   |      Yes      |   up to 100, each one is      |
+        |                   | objects   |               |   {op, list, isbn, quantity}  |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |       op          |   string  |      Yes      |   add, remove, move or clear  |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      list         |   string  |      Yes      |   cart or wishlist. move      |
+        |                   |           |               |   moves from it to the other  |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |      isbn         |   string  |  add/remove   |   move without an isbn moves  |
+        |                   |           |               |   every book in the list      |
+        |___________________|___________|_______________|_______________________________|
+        |                   |           |               |                               |
+        |    quantity       |  Integer  |      No       |   add to the cart only,       |
+        |                   |           |               |   defaults to 1               |
+        |___________________|___________|_______________|_______________________________|
+        Example body (move the whole wishlist to the cart, add two of a book and take another one out):
+            {
+                "operations": [
+                    {"op": "move", "list": "wishlist"},
+                    {"op": "add", "list": "cart", "isbn": "1-87-876587-9879", "quantity": 2},
+                    {"op": "remove", "list": "cart", "isbn": "0-306-40615-2"}
+                ]
+            }
+        Returns:
+            successful:
+                json response: {"shopping_cart": [...], "wishlist": [...], "results": [...]}, the final
+                cart and wishlist, and for each operation how many books it changed
+            unsuccessful:
+                json response: returns a json error message. nothing is changed
+    """
+    body = request.get_json(silent=True) or {}
+    operations = body.get('operations')
+    if type(operations) is not list or not operations:
+        return jsonify(message={"Error": "operations must be a non-empty list"}), HTTPStatus.BAD_REQUEST
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify(message={"Error": f"at most {MAX_BATCH_OPERATIONS} operations per request"}), HTTPStatus.BAD_REQUEST
+
+    errors = operation_errors(operations)
+    if errors:
+        return jsonify(message={"Error": "invalid operations", "operations": errors}), HTTPStatus.BAD_REQUEST
+
+    # every isbn in the batch in one query
+    isbns = {operation['isbn'] for operation in operations if operation.get('isbn') is not None}
+    book_ids = dict(db.session.execute(select(Book.isbn, Book.id).where(Book.isbn.in_(isbns))).all()) if isbns else {}
+    missing = sorted(isbns - book_ids.keys())
+    if missing:
+        return jsonify(message={"Error": "We dont have books with these ISBNs", "missing": missing}), HTTPStatus.NOT_FOUND
+
+    # a list is only created if an operation writes to it (moves write to both)
+    writes = {operation['list'] for operation in operations if operation['op'] == 'add'}
+    if any(operation['op'] == 'move' for operation in operations):
+        writes.update(BATCH_LISTS)
+    cart = cart_for(current_user.id, create='cart' in writes)
+    wishlist = wishlist_for(current_user.id, create='wishlist' in writes)
+
+    # the version is bumped once for the whole batch, before any of it is applied
+    if cart is not None:
+        touch_cart(cart)
+
+    results = []
+    for operation in operations:
+        # removing from/clearing a list the user doesn't have changes nothing
+        if (operation['list'] == 'cart' and cart is None) or (operation['list'] == 'wishlist' and wishlist is None):
+            changed = 0
+        else:
+            changed = apply_operation(operation, cart and cart.id, wishlist and wishlist.id, book_ids)
+        results.append(dict(operation, changed=changed))
+
+    return json_response({
+        "shopping_cart": ShoppingCart.cart_books(cart.id) if cart is not None else [],
+        "wishlist": Wishlist.wishlist_books(wishlist.id) if wishlist is not None else [],
+        "results": results,
+    }, HTTPStatus.OK)
 
 # Retrieves given users shopping cart items
 @api.route("/get-shopping-cart", methods = ['GET'])   
@@ -149,7 +288,7 @@ def retrieve_shopping_cart():
         
     username=request.json['username']
 
-    user = User.query.filter_by(username=username).first()
+    user = User.query.options(joinedload(User.shoppingCart)).filter_by(username=username).first()
 
     if user is None:
         return jsonify(message={"Error": "Did not provide a proper username"}), HTTPStatus.NOT_FOUND
@@ -158,10 +297,9 @@ def retrieve_shopping_cart():
         return jsonify(message={"Error": "Username " + username + " has no shopping cart"})
 
     else:   
-        books = user.shoppingCart.books
-        books = [book.as_dict() for book in books]
+        books = user.shoppingCart.books_as_dicts()
 
-        return jsonify({"shopping_cart":books}), 200      
+        return json_response({"shopping_cart":books}, 200)      
     return jsonify(message={"Error": "Fatal error occurred"})
 
 
@@ -15,12 +15,17 @@ from flask import request, jsonify, Blueprint
 
 # add your models to the models.py file then import them here
 from ..models import db, Book, Author, ma, BookSchema, User, Wishlist, ShoppingCart, WishlistSchema
+from ..serializers import json_response
+from ..instrumentation import max_statements
 from dateutil.parser import parse
 from http import HTTPStatus
 
 # keep this if an endpoint requires caching 
-from ..cache import cache
+from ..cache import cached_response, tag_response, USER_TTL
 from ..auth import token_required, admin_required
+from ..transactions import atomic
+from ..carts import cart_for, touch_cart, add_to_cart, add_to_wishlist, remove_from_wishlist
+from sqlalchemy.orm import joinedload
 
 # update name-> V-----V     
 api = Blueprint('wishlist_routes', __name__)
@@ -30,17 +35,19 @@ api = Blueprint('wishlist_routes', __name__)
 
 # Getting a wishlist by user_id
 @api.route("/wishlist/<user_id>", methods=['GET'])
-@cache.cached(timeout=5) # add this decorator to cache data on GET routes (this one caches data for 5 seconds)
 @token_required
+@cached_response(timeout=USER_TTL, per_user=True) # cached per user, for USER_TTL seconds
 def get_wishlist(username, user_id):
 
-    user = User.query.get(user_id)
+    # user + wishlist in one query, the wishlist's books in a second one
+    user = User.query.options(joinedload(User.wishlist)).get(user_id)
 
     if not user:
         return jsonify({"Error": "No user exists"}), 404
 
     if user.wishlist is None:
-        return jsonify({"Error": "No wishlist exists for user"})
+        # a 404 isn't cached, so the wishlist shows up as soon as it's created
+        return jsonify({"Error": "No wishlist exists for user"}), 404
 
     wishlist = Wishlist.query.get(user.wishlist.id)
 
@@ -48,9 +55,10 @@ def get_wishlist(username, user_id):
     if not wishlist:
         return jsonify({"Error": "No wishlist exists"}), 404
 
-    books = [book.as_dict() for book in wishlist.books]
+    books = wishlist.books_as_dicts()
+    tag_response(f"wishlist:{wishlist.id}", *(f"book:{book['id']}" for book in books))
 
-    return jsonify(message={f"{user.username}'s Wishlist ": books}), 200
+    return json_response({"message": {f"{user.username}'s Wishlist ": books}}, 200)
 
 
 # Creating a wishlist for a user
@@ -72,6 +80,7 @@ def add_wishlist(username):
         db.session.add(wishlist)
         db.session.commit()
     except Exception as e:
+        db.session.rollback()
         print(e)
         return jsonify(msg={"Error": f"error {e}"}), 500
 
@@ -81,6 +90,7 @@ def add_wishlist(username):
 # Adding a book to a wishlist
 @api.route("/wishlist/add", methods=['POST'])
 @token_required
+@atomic()
 def add_book(username):
 
     user = User.query.filter_by(username=request.json['username']).first()
@@ -91,26 +101,32 @@ def add_book(username):
     if user.wishlist is None:
         return jsonify({"Error": "User does not have a wishlist"})
 
-    wishlist = Wishlist.query.get(user.wishlist.id)
     book = Book.query.filter_by(isbn=request.json['isbn']).first()
 
     if not book:
         return jsonify({"Error": "No book exists"}), 404
 
-    if not user:
-        return jsonify({"Error": "No user exists"}), 404
+    # books are only in a wishlist once (a no-op insert if it's already there)
+    add_to_wishlist(user.wishlist.id, book.id)
 
-    wishlist.books.append(book)
-    db.session.commit()
+    books = Wishlist.wishlist_books(user.wishlist.id)
 
-    books = [book.as_dict() for book in wishlist.books]
+    return json_response({"wishlist": books}, 200)
 
-    return jsonify({"wishlist": books}), 200
 
+# moving a book runs at most: the user, their wishlist and the book (3), the wishlist delete (1), the cart
+# lookup, plus an insert and a second lookup if the user has no cart yet (3), the cart's version bump and
+# the cart upsert (2), the wishlist's and the cart's books for the response (2), and with an Idempotency-Key
+# the key lookup, the delete of expired keys and the key insert (3)
+REMOVE_BOOK_STATEMENTS = 14
 
 # Removing a book from a user's wishlist and adding it to the shopping cart
+# the delete from the wishlist and the upsert into the cart are one transaction: the book can't end up
+# in both, or in neither
 @api.route("/wishlist/<user_id>/remove/<isbn>", methods=['PUT'])
+@max_statements(REMOVE_BOOK_STATEMENTS)
 @token_required
+@atomic()
 def remove_book(username, user_id, isbn):
 
     user = User.query.get(user_id)
@@ -121,29 +137,20 @@ def remove_book(username, user_id, isbn):
     if user.wishlist is None:
         return jsonify({"Error": "No wishlist exist for user"})
 
-    wishlist = Wishlist.query.get(user.wishlist.id)
+    wishlist_id = user.wishlist.id
     book = Book.query.filter_by(isbn=isbn).first()
 
-    if not wishlist:
-        return jsonify({"Error": "No wishlist exists"}), 404
-
     if not book:
         return jsonify({"Error": "No book exists"}), 404
-    elif book not in wishlist.books:
-        return jsonify({"Error": "Book does not exist in wishlist"}), 404
 
-    if user.shoppingCart is None:
-        shopping_cart = ShoppingCart(user=user)
-        shopping_cart.books.append(book)
-        db.session.add(shopping_cart)
-        db.session.commit()
-    else:
-        user.shoppingCart.books.append(book)
+    if not remove_from_wishlist(wishlist_id, book.id):
+        return jsonify({"Error": "Book does not exist in wishlist"}), 404
 
-    wishlist.books.remove(book)
-    db.session.commit()
+    cart = cart_for(user.id)
+    touch_cart(cart)
+    add_to_cart(cart.id, book.id)
 
-    books = [book.as_dict() for book in wishlist.books]
-    shopping_cart_books = [book.as_dict() for book in user.shoppingCart.books]
+    books = Wishlist.wishlist_books(wishlist_id)
+    shopping_cart_books = ShoppingCart.cart_books(cart.id)
 
-    return jsonify({f"{user.username}'s Wishlist": books, "Book Removed": book.as_dict(), f"{user.username}'s Shopping Cart": shopping_cart_books}), 200 
\ No newline at end of file
+    return json_response({f"{user.username}'s Wishlist": books, "Book Removed": book.as_dict(), f"{user.username}'s Shopping Cart": shopping_cart_books}, 200)
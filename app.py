@@ -3,10 +3,21 @@ from flask_migrate import Migrate
 from .models import db, Book, Author, ma, BookSchema, AuthorSchema, User
 from dateutil.parser import parse
 from http import HTTPStatus
-from .cache import cache
+from .cache import cache, cache_stats, cache_config_from_env
+from .database import database_config_from_env, pool_stats
+from .auth import admin_required
+from . import invalidation  # registers the cache invalidation hooks on the db session
+from . import search  # registers the books_fts DDL with db.create_all()
+from . import rankings  # keeps the top sellers ranking up to date on commit
+from .query_plan import check_query_plans
+from . import instrumentation
+from .bulk_import import import_books_command
+from .passwords import passwords, PasswordPoolBusy
+from .ratelimit import limiter
 
 from functools import wraps
 import jwt
+import os
 
 
 # import blueprint api routes below
@@ -17,6 +28,7 @@ from .api.author_routes import api as author_routes
 from .api.profile_management_routes import api as profile_management_routes
 from .api.wishlist_routes import api as wishlist_routes
 from .api.shopping_cart import api as shopping_cart_routes
+from .api.rating_routes import api as rating_routes
 
 
 # create flask app 
@@ -33,23 +45,46 @@ app.config['SECRET_KEY'] = "SECRET!"
 
 app.register_blueprint(wishlist_routes)
 app.register_blueprint(shopping_cart_routes)
+app.register_blueprint(rating_routes)
 
 
 
-# config cache
-app.config['CACHE_TYPE'] = 'simple'
+# config cache (set CACHE_TYPE & co. in the environment to change the backend)
+app.config.from_mapping(cache_config_from_env())
 
-# database configs
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+# database configs (DATABASE_URL & DB_PROFILE in the environment, see database.py)
+app.config.from_mapping(database_config_from_env())
+# nothing listens to flask_sqlalchemy's model signals, tracking them is just overhead on every flush
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# log hot queries that would scan a whole table on the first request (QUERY_PLAN_CHECK=0 to skip)
+app.config['QUERY_PLAN_CHECK'] = os.environ.get('QUERY_PLAN_CHECK', '1') == '1'
+
+# token lifetimes and how often each worker reloads the token denylist (see auth.py)
+app.config['ACCESS_TOKEN_MINUTES'] = int(os.environ.get('ACCESS_TOKEN_MINUTES', 15))
+app.config['REFRESH_TOKEN_DAYS'] = int(os.environ.get('REFRESH_TOKEN_DAYS', 14))
+app.config['TOKEN_DENYLIST_SYNC'] = int(os.environ.get('TOKEN_DENYLIST_SYNC', 5))
 
 # migrate config
-migrate = Migrate(app, db, render_as_batch=True)
+migrate = Migrate(app, db, render_as_batch=True, include_name=search.include_name)
 
 # init database, Marshmallow & cache
 db.init_app(app)
 ma.init_app(app)
 cache.init_app(app)
+instrumentation.init_app(app)
+# per client token buckets & per worker concurrency limits (RATE_LIMIT_* / MAX_CONCURRENT_* in the environment, see ratelimit.py)
+limiter.init_app(app)
+# password hashing pool (PASSWORD_* in the environment, see passwords.py)
+passwords.init_app(app)
+
+# flask import-books FILE
+app.cli.add_command(import_books_command)
+
+@app.before_first_request
+def startup_checks():
+    if app.config['QUERY_PLAN_CHECK']:
+        check_query_plans()
 
 # place holder for eventual user auth
 isAdmin = True  # just in the mean time...
@@ -61,12 +96,38 @@ def home():
     authors = db.session.query(Author).all()
     return render_template("index.html", books=books, authors=authors)
 
+# response cache hit/miss/eviction counters for this worker
+@app.route("/cache-stats", methods=['GET'])
+@admin_required
+def get_cache_stats(username):
+    return jsonify(cache_stats=cache_stats()), HTTPStatus.OK
+
+# per endpoint request count, SQL statements, db time (with histograms) and slowest statement for this worker,
+# plus the password hashing pool's and the rate limiter's counters
+@app.route("/metrics", methods=['GET'])
+@admin_required
+def get_metrics(username):
+    return jsonify(endpoints=instrumentation.metrics(), passwords=passwords.stats(),
+                   rate_limits=limiter.stats()), HTTPStatus.OK
+
+# db connection pool state and counters for this worker
+@app.route("/db-stats", methods=['GET'])
+@admin_required
+def get_db_stats(username):
+    return jsonify(profile=app.config['DB_PROFILE'], db_stats=pool_stats(db.engine, db.replica_engines(app))), HTTPStatus.OK
+
 # something went really bad
 @app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return jsonify(error_msg={"code":error.code, "description": error.description}), HTTPStatus.INTERNAL_SERVER_ERROR
 
+# every password hashing worker is busy, the client should come back in a bit
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(error):
+    return jsonify(error_msg={"code":error.code, "description": error.description}), HTTPStatus.SERVICE_UNAVAILABLE, \
+        {'Retry-After': str(error.retry_after)}
+
 # for undefined endpoints
 @app.errorhandler(404)
 def not_found_error(error):
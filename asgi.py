@@ -0,0 +1,260 @@
+"""
+    ASGI entry point, for serving the api with an async server:
+        pip install -r requirements.txt   (has uvicorn & aiosqlite, asyncpg instead of aiosqlite on postgresql)
+        uvicorn GeekText.asgi:application --workers 4
+
+    the hot read routes (ASYNC_ENDPOINTS) run on the event loop: the request goes through the normal flask app
+    (auth, response cache, ETags, Server-Timing, all the same), but its db.session is the sync side of an
+    AsyncSession on an async driver (aiosqlite/asyncpg). the view runs in a greenlet (sqlalchemy's greenlet_spawn,
+    what its asyncio extension is built on), and every query it sends hands the event loop back to the other
+    requests until the db answers, instead of holding a thread while it waits.
+    every other route (writes, streamed responses) runs the WSGI app on a pool of ASGI_WSGI_THREADS threads
+    (default 32), like a threaded WSGI server would.
+
+    the async engine's pool is ASGI_DB_POOL_SIZE connections (default: the DB_PROFILE's pool_size, or 10), the
+    requests above that wait for a connection on the event loop.
+
+    the limitation: everything else a request does is still plain blocking python. the sqlite cache backend
+    (response cache, the replica stickiness flag, the rate limiter's buckets) hands its calls to a thread
+    (database.run_blocking), so one stuck on the cache file's lock doesn't hold up the loop, but that's a thread
+    hop per cache call. anything else that blocks (another cache backend's client, password hashing, a slow view)
+    stalls every request on the loop while it runs, so keep those routes out of ASYNC_ENDPOINTS.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+import asyncio
+import os
+import sys
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import greenlet_spawn, await_only
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from .app import app
+from .api.book_routes import wants_stream
+from .database import session_override, instrument_engine, engine_pragmas
+from .passwords import passwords
+
+# routes served on the event loop
+ASYNC_ENDPOINTS = {
+    'book_routes.all_books',
+    'book_routes.book_details',
+    'author_routes.books_by_author',
+    'wishlist_routes.get_wishlist',
+    'shopping_cart_routes.retrieve_shopping_cart',
+}
+ASYNC_METHODS = ('GET', 'HEAD')
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+DEFAULT_POOL_SIZE = 10
+DEFAULT_WSGI_THREADS = 32
+# request bodies bigger than this are kept in a temp file instead of memory (i.e. POST /books/import)
+MAX_MEMORY_BODY = 10 * 1024 * 1024
+
+
+def async_url(app):
+    """ the app's SQLALCHEMY_DATABASE_URI with the async driver (relative sqlite paths are relative to the app) """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"no async driver for {backend}, ASGI mode supports: {', '.join(ASYNC_DRIVERS)}")
+    if backend == 'sqlite' and url.database and url.database != ':memory:' and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(app.root_path, url.database))
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_engine(app):
+    url = async_url(app)
+    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    options.pop('poolclass', None)
+    options['pool_size'] = int(os.environ.get('ASGI_DB_POOL_SIZE', options.get('pool_size') or DEFAULT_POOL_SIZE))
+    if url.get_backend_name() == 'sqlite':
+        # aiosqlite file dbs get a NullPool by default, a connection (and a thread) per request
+        options['poolclass'] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **options)
+    instrument_engine(engine.sync_engine, engine_pragmas(app, url))
+    return engine
+
+
+def wsgi_environ(scope, body=None, length=0):
+    """ the WSGI environ of an ASGI http request. `body` is a file with the request body """
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body if body is not None else SpooledTemporaryFile(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """ the request body as (file, length) """
+    body = SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    length = body.tell()
+    body.seek(0)
+    return body, length
+
+
+def respond(wsgi_app, environ, send):
+    """ runs a WSGI app and sends its response as ASGI messages, chunk by chunk. `send` is a sync function """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    def send_start():
+        status, headers = started
+        send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        })
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        sent_start = False
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not sent_start:
+                send_start()
+                sent_start = True
+            send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not sent_start:
+            send_start()
+        send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class AsyncApp:
+    """ the ASGI app: ASYNC_ENDPOINTS on the event loop, the rest on a thread pool """
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASGI_WSGI_THREADS', DEFAULT_WSGI_THREADS)),
+                                           thread_name_prefix='wsgi')
+        self._startup_lock = asyncio.Lock()
+        self._started = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"{scope['type']} connections aren't supported")
+
+        body, length = await read_body(receive)
+        environ = wsgi_environ(scope, body, length)
+        if self.runs_async(scope):
+            await self.startup()
+            await self.run(self.app.wsgi_app, environ, send)
+        else:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, respond, self.app.wsgi_app, environ,
+                                       lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result())
+
+    def runs_async(self, scope):
+        if scope['method'] not in ASYNC_METHODS:
+            return False
+        try:
+            endpoint, _ = self.app.url_map.bind('localhost').match(scope['path'], scope['method'])
+        except HTTPException:
+            # 404s, 405s and redirects are the WSGI app's business
+            return False
+        if endpoint not in ASYNC_ENDPOINTS:
+            return False
+        return not (endpoint == 'book_routes.all_books' and wants_stream(Request(wsgi_environ(scope))))
+
+    async def run(self, wsgi_app, environ, send):
+        """ runs the WSGI app for one request in a greenlet, with db.session on the async engine """
+        if self.engine is None:
+            self.engine = create_engine(self.app)
+        async with AsyncSession(self.engine) as session:
+            await greenlet_spawn(self._respond, wsgi_app, environ, lambda message: await_only(send(message)),
+                                 session.sync_session)
+
+    @staticmethod
+    def _respond(wsgi_app, environ, send, session):
+        token = session_override.set(session)
+        try:
+            respond(wsgi_app, environ, send)
+        finally:
+            session_override.reset(token)
+
+    async def startup(self):
+        """ runs the app's before_first_request functions (they query the db) once, before any request does.
+            flask runs them under a threading.Lock, which a second request on the same event loop would block
+            on for good
+        """
+        if self._started:
+            return
+        async with self._startup_lock:
+            if self._started:
+                return
+
+            def first_request(environ, start_response):
+                with self.app.request_context(environ):
+                    self.app.try_trigger_before_first_request_functions()
+                start_response('204 No Content', [])
+                return []
+
+            async def discard(message):
+                pass
+
+            environ = wsgi_environ({'method': 'GET', 'path': '/', 'query_string': b'', 'http_version': '1.1',
+                                    'headers': []})
+            await self.run(first_request, environ, discard)
+            self._started = True
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                passwords.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AsyncApp(app)
@@ -1,27 +1,260 @@
+"""
+    tokens.
+
+    POST /get-token hands out a short-lived access token (ACCESS_TOKEN_MINUTES, 15 by default) and a refresh token
+    (REFRESH_TOKEN_DAYS, 14). the access token is signed and carries everything the decorators below need
+    (id, username, role and the user's token_version), so authorizing a request doesn't touch the users table.
+    POST /refresh-token trades a refresh token for new tokens, that's where a changed role gets picked up, and
+    every refresh token only works once.
+
+    revoking: bumping a user's token_version (see revoke_user_tokens, done for you when a user's admin flag or
+    username changes, or the user is deleted) revokes every token they have. the revocations are rows in
+    token_revocations, and each worker keeps all the live ones in memory (the denylist), reloading them every
+    TOKEN_DENYLIST_SYNC seconds (5). revocations made by this worker apply right away, the other workers
+    see them within TOKEN_DENYLIST_SYNC.
+"""
+from collections import OrderedDict, namedtuple
 from functools import wraps
-from flask import request, jsonify
+from threading import Lock
+from uuid import uuid4
+import time
+
+from flask import request, jsonify, current_app, g
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 import jwt
 from http import HTTPStatus
 
-# from models import User
+from .models import db, User, TokenRevocation
+from .instrumentation import statements_so_far, uncount_since
+
+# what the route decorators pass to the views as the current user
+Principal = namedtuple('Principal', ['id', 'username', 'isAdmin'])
+
+ACCESS_TOKEN_MINUTES = 15
+REFRESH_TOKEN_DAYS = 14
+TOKEN_DENYLIST_SYNC = 5
+
+# decoded tokens are remembered for TOKEN_CACHE_TTL seconds (or until they expire, whichever is first)
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenCache:
+    """ bounded LRU of token -> (Principal, token version, jti) so a token that was already verified
+        doesn't pay for jwt.decode again
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            verified, expires = entry
+            if time.time() >= expires:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return verified
+
+    def set(self, token, verified, token_exp=None):
+        expires = time.time() + self.ttl
+        if token_exp is not None:
+            expires = min(expires, token_exp)
+        with self._lock:
+            self._entries[token] = (verified, expires)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class Denylist:
+    """ the live rows of token_revocations: user id -> lowest token version still valid, and revoked jtis """
+
+    def __init__(self):
+        self._versions = {}
+        self._jtis = {}
+        self._synced_at = 0
+        # (added at, revocation) of this worker's own, so a reload that started before one was committed keeps it
+        self._recent = []
+        self._lock = Lock()
+
+    def add(self, user_id, version, jti, expires_at):
+        with self._lock:
+            self._recent.append((time.time(), (user_id, version, jti, expires_at)))
+            self._add(user_id, version, jti, expires_at)
+
+    def _add(self, user_id, version, jti, expires_at):
+        if version is not None:
+            current = self._versions.get(user_id)
+            if current is None or version > current[0]:
+                self._versions[user_id] = (version, expires_at)
+        if jti is not None:
+            self._jtis[jti] = expires_at
+
+    def revoked(self, user_id, version, jti):
+        now = time.time()
+        with self._lock:
+            lowest = self._versions.get(user_id)
+            if lowest is not None and version < lowest[0] and now < lowest[1]:
+                return True
+            return jti is not None and now < self._jtis.get(jti, 0)
+
+    def sync(self, every=TOKEN_DENYLIST_SYNC):
+        """ reloads the denylist from the db if it's more than `every` seconds old. the table only has
+            revocations whose tokens haven't all expired yet, so it stays small
+        """
+        now = time.time()
+        if now - self._synced_at < every:
+            return
+        # whoever gets here first reloads, the others keep using the current list meanwhile
+        with self._lock:
+            if now - self._synced_at < every:
+                return
+            self._synced_at = now
+        rows = db.session.query(TokenRevocation.user_id, TokenRevocation.version, TokenRevocation.jti,
+                                TokenRevocation.expires_at).filter(TokenRevocation.expires_at > int(now)).all()
+        with self._lock:
+            self._versions, self._jtis = {}, {}
+            for revocation in rows:
+                self._add(*revocation)
+            # (the query's snapshot may have started a bit before `now`, keep them for another round)
+            self._recent = [(added, revocation) for added, revocation in self._recent if added >= now - every]
+            for _, revocation in self._recent:
+                self._add(*revocation)
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+            self._jtis.clear()
+            self._recent.clear()
+            self._synced_at = 0
+
+
+denylist = Denylist()
+
+
+def _encode(claims):
+    return jwt.encode(claims, current_app.config['SECRET_KEY'], "HS256")
+
+
+def issue_tokens(user):
+    """ a new access token and refresh token for a user, as the json /get-token and /refresh-token return """
+    config = current_app.config
+    now = int(time.time())
+    access_ttl = config.get('ACCESS_TOKEN_MINUTES', ACCESS_TOKEN_MINUTES) * 60
+    refresh_ttl = config.get('REFRESH_TOKEN_DAYS', REFRESH_TOKEN_DAYS) * 86400
+    claims = {'id': user.id, 'username': user.username, 'role': 'admin' if user.isAdmin else 'user',
+              'ver': user.token_version or 0, 'iat': now}
+    return {
+        'token': _encode(dict(claims, type='access', jti=uuid4().hex, exp=now + access_ttl)),
+        'refresh_token': _encode({'id': user.id, 'ver': claims['ver'], 'iat': now, 'type': 'refresh',
+                                  'jti': uuid4().hex, 'exp': now + refresh_ttl}),
+        'expires_in': access_ttl,
+    }
+
+
+def _decode(token, token_type):
+    try:
+        data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+    # tokens from before there were refresh tokens have no type, they're access tokens
+    if data.get('type', 'access') != token_type:
+        raise InvalidToken(f"not an {token_type} token")
+    return data
+
+
+def _check_denylist(user_id, version, jti):
+    start = statements_so_far()
+    denylist.sync(current_app.config.get('TOKEN_DENYLIST_SYNC', TOKEN_DENYLIST_SYNC))
+    # the reload every few seconds isn't the view's doing, it's left out of its statement budget
+    uncount_since(start)
+    if denylist.revoked(user_id, version, jti):
+        raise InvalidToken("token was revoked")
+
+
+def verify_token(token):
+    """ returns the Principal for an access token, raises InvalidToken if it's bad, expired or revoked """
+    verified = token_cache.get(token)
+    if verified is None:
+        data = _decode(token, 'access')
+        if 'role' in data:
+            principal = Principal(data['id'], data['username'], data['role'] == 'admin')
+        else:
+            # an old token without claims, the db knows who it is (until it expires)
+            user = User.query.filter_by(username=data.get('username')).first()
+            if user is None:
+                raise InvalidToken(f"no user {data.get('username')}")
+            principal = Principal(user.id, user.username, bool(user.isAdmin))
+        verified = (principal, data.get('ver', 0), data.get('jti'))
+        token_cache.set(token, verified, data.get('exp'))
+
+    principal, version, jti = verified
+    _check_denylist(principal.id, version, jti)
+    return principal
+
+
+def verify_refresh_token(token):
+    """ the claims of a refresh token, raises InvalidToken if it's bad, expired, revoked or was used already """
+    data = _decode(token, 'refresh')
+    _check_denylist(data['id'], data['ver'], data['jti'])
+    return data
+
+
+def next_token_version(version):
+    # the current time, so a new user who gets a deleted user's id (sqlite reuses them) starts above its revocation
+    return max((version or 0) + 1, int(time.time()))
+
+
+def _version_revocation(user_id, version):
+    # every token issued before now is expired by expires_at
+    expires_at = int(time.time()) + current_app.config.get('REFRESH_TOKEN_DAYS', REFRESH_TOKEN_DAYS) * 86400
+    return TokenRevocation(user_id=user_id, version=version, expires_at=expires_at)
+
+
+def revoke_user_tokens(user):
+    """ revokes every token the user has (they have to log in again), the caller commits """
+    user.token_version = next_token_version(user.token_version)
+    db.session.add(_version_revocation(user.id, user.token_version))
+
+
+def revoke_refresh_token(claims):
+    """ revokes one refresh token, by its claims. the caller commits, an IntegrityError means it was revoked already """
+    TokenRevocation.query.filter(TokenRevocation.expires_at <= int(time.time())).delete(synchronize_session=False)
+    db.session.add(TokenRevocation(user_id=claims['id'], jti=claims['jti'], expires_at=claims['exp']))
+
 
 def token_required(f):
     @wraps(f)
     def decorator(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization']
+        token = request.headers.get('Authorization')
 
         if not token:
             return jsonify({'message': 'a valid token is missing'})
         try:
-            from .app import app
-            from .models import User
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(username=data['username']).first()
-        except:
+            current_user = verify_token(token)
+        except InvalidToken:
             return jsonify({'message': 'token is invalid'})
 
+        g.principal = current_user  # who's asking, for the db session's replica routing
         return f(current_user, *args, **kwargs)
 
     return decorator
@@ -30,26 +263,53 @@ def token_required(f):
 def admin_required(f):
     @wraps(f)
     def decorator(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization']
+        token = request.headers.get('Authorization')
 
-            
         if not token:
             return jsonify({'msg':'a valid token is missing'})
 
         try:
-            from .app import app
-            from .models import User
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(username=data['username']).first()
-            if not current_user.isAdmin:
-                return jsonify({'message': 'user is not an Admin'}), HTTPStatus.UNAUTHORIZED
-        except Exception as e:
-            print("exception: ", e)
+            current_user = verify_token(token)
+        except InvalidToken as e:
+            current_app.logger.info("invalid token: %s", e)
             return jsonify({'message': 'token provided is invalid'}), HTTPStatus.UNAUTHORIZED
+        if not current_user.isAdmin:
+            return jsonify({'message': 'user is not an Admin'}), HTTPStatus.UNAUTHORIZED
 
+        g.principal = current_user
         return f(current_user, *args, **kwargs)
 
+    return decorator
+
+
+# a user whose admin flag or username changes, or who's deleted, loses their tokens: they'd still say the old thing
+@event.listens_for(Session, 'before_flush')
+def _revoke_changed_users(session, flush_context, instances):
+    for user in list(session.dirty):
+        if isinstance(user, User):
+            attrs = inspect(user).attrs
+            if attrs.isAdmin.history.has_changes() or attrs.username.history.has_changes():
+                user.token_version = next_token_version(user.token_version)
+                session.add(_version_revocation(user.id, user.token_version))
+    for user in list(session.deleted):
+        if isinstance(user, User):
+            session.add(_version_revocation(user.id, next_token_version(user.token_version)))
+
+
+# this worker's own revocations apply as soon as they're committed, the other workers pick them up on their next sync
+@event.listens_for(Session, 'after_flush')
+def _collect_revocations(session, flush_context):
+    revocations = session.info.setdefault('token_revocations', [])
+    revocations.extend((r.user_id, r.version, r.jti, r.expires_at)
+                       for r in session.new if isinstance(r, TokenRevocation))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_revocations(session):
+    for revocation in session.info.pop('token_revocations', ()):
+        denylist.add(*revocation)
+
 
-    return decorator
\ No newline at end of file
+@event.listens_for(Session, 'after_rollback')
+def _discard_revocations(session):
+    session.info.pop('token_revocations', None)
@@ -0,0 +1,4 @@
+"""
+    benchmarks for GeekText. run them from the folder above the project, i.e.
+        python -m GeekText.benchmarks.serializer_bench
+"""
@@ -0,0 +1,231 @@
+"""
+    threaded WSGI (app.run(threaded=True), a thread per connection) vs. ASGI (uvicorn + asgi.py, the hot read
+    routes on the event loop with aiosqlite) under many concurrent clients.
+
+    seeds a throwaway db (seed.py), then for each mode starts the server in its own process and has `--clients`
+    concurrent clients (asyncio + httpx, 1000 by default) send the hot read routes in a loop for `--duration`
+    seconds: GET /books, /books/<isbn>, /authors/<id>/books, /wishlist/<id> and /get-shopping-cart.
+    reports throughput, p50/p95/p99/max latency, how many requests failed (and why), the most requests that were
+    in flight at once, and the server's peak thread count and memory.
+
+    the response cache is off by default (--cache-type null) so every request goes to the db, with the cache on
+    both modes mostly measure the cache. DB_PROFILE defaults to production (a connection pool in both modes).
+
+    needs: pip install httpx (plus requirements.txt)
+    usage: python -m GeekText.benchmarks.asgi_bench [--clients 1000] [--duration 20] [--modes wsgi,asgi]
+               [--output results.json] (plus seed.py's --books, --users, ...)
+"""
+from collections import Counter
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import seed
+from .search_bench import percentile
+
+HOST = '127.0.0.1'
+
+
+def raise_open_files_limit():
+    # a socket per client, on both ends
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def serve(mode, port):
+    """ runs the server of one mode in this process, until it's killed """
+    raise_open_files_limit()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    if mode == 'wsgi':
+        from ..app import app
+        app.run(HOST, port, threaded=True)
+    else:
+        import uvicorn
+        from ..asgi import application
+        uvicorn.run(application, host=HOST, port=port, log_level='warning', backlog=4096)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"the server didn't start listening on {port}")
+
+
+def process_usage(pid):
+    """ (threads, rss in MB) of a process, from /proc. None where there's no /proc """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None
+    return int(fields['Threads']), int(fields['VmRSS'].split()[0]) / 1024
+
+
+def hot_requests(args, users):
+    """ an endless round of the hot read routes, (method, path, json body, token) """
+    for i in itertools.count():
+        user_id, username, token = users[i % len(users)]
+        book = seed.isbn(i * 7919 % args.books)
+        yield from [
+            ('GET', '/books?limit=50', None, token),
+            ('GET', f'/books/{book}', None, token),
+            ('GET', f'/authors/{1 + i * 7919 % args.authors}/books', None, token),
+            ('GET', f'/wishlist/{user_id}', None, token),
+            ('GET', '/get-shopping-cart', {"username": username}, token),
+        ]
+
+
+async def load(args, port, pid, users):
+    import httpx
+
+    requests = hot_requests(args, users)
+    latencies, failures = [], Counter()
+    in_flight = peak_in_flight = 0
+    usage = []
+    deadline = time.perf_counter() + args.duration
+
+    async def client(http):
+        nonlocal in_flight, peak_in_flight
+        while time.perf_counter() < deadline:
+            method, path, body, token = next(requests)
+            in_flight += 1
+            peak_in_flight = max(peak_in_flight, in_flight)
+            start = time.perf_counter()
+            try:
+                resp = await http.request(method, path, json=body, headers={'Authorization': token})
+                if resp.status_code >= 400:
+                    failures[str(resp.status_code)] += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError as e:
+                failures[type(e).__name__] += 1
+            finally:
+                in_flight -= 1
+
+    async def sample():
+        while time.perf_counter() < deadline:
+            current = process_usage(pid)
+            if current:
+                usage.append(current)
+            await asyncio.sleep(0.2)
+
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=f"http://{HOST}:{port}", limits=limits, timeout=args.timeout) as http:
+        start = time.perf_counter()
+        await asyncio.gather(sample(), *(client(http) for _ in range(args.clients)))
+        wall = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "failed": sum(failures.values()),
+        "failures": dict(failures),
+        "throughput_rps": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else None,
+        "peak_in_flight": peak_in_flight,
+        "server_peak_threads": max((threads for threads, _ in usage), default=None),
+        "server_peak_rss_mb": round(max((rss for _, rss in usage), default=0), 1) or None,
+    }
+
+
+def login(port, count):
+    import httpx
+    users = []
+    with httpx.Client(base_url=f"http://{HOST}:{port}") as http:
+        for i in range(2, count + 2):
+            resp = http.post('/get-token', auth=(f"user{i}", seed.PASSWORD))
+            users.append((i, f"user{i}", resp.json()["token"]))
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed.add_arguments(parser)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=20, help="seconds of load per mode")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds before a request counts as failed")
+    parser.add_argument('--logged-in-users', type=int, default=50)
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--cache-type', default='null')
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    raise_open_files_limit()
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.sqlite'),
+               CACHE_TYPE=args.cache_type, CACHE_SQLITE_PATH=os.path.join(workdir, 'cache.sqlite'),
+               QUERY_PLAN_CHECK='0')
+    env.setdefault('DB_PROFILE', 'production')
+    # we're measuring how much the server can take, not how well it turns clients away
+    env.setdefault('RATE_LIMIT_ENABLED', '0')
+    env.setdefault('MAX_CONCURRENT_REQUESTS', '0')
+    env.setdefault('MAX_CONCURRENT_WRITES', '0')
+    os.environ.update(env)
+
+    from ..app import app
+    from ..models import db
+    with app.app_context():
+        db.create_all()
+        print(f"seeded {seed.seed_from_args(args)}")
+
+    results = {}
+    for mode in args.modes.split(','):
+        port = free_port()
+        server = subprocess.Popen([sys.executable, '-m', f"{__package__}.asgi_bench", '--serve', mode,
+                                   '--port', str(port)], env=env)
+        try:
+            wait_for_port(port)
+            users = login(port, min(args.logged_in_users, args.users - 1))
+            print(f"{mode}: {args.clients} clients for {args.duration:g}s ...")
+            results[mode] = asyncio.run(load(args, port, server.pid, users))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"\n  {'':<6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7} "
+          f"{'in flight':>9} {'threads':>8} {'rss MB':>7}")
+    for mode, r in results.items():
+        print(f"  {mode:<6} {r['throughput_rps']:>8} {r['p50_ms']!s:>8} {r['p95_ms']!s:>8} {r['p99_ms']!s:>8} "
+              f"{r['max_ms']!s:>8} {r['failed']:>7} {r['peak_in_flight']:>9} {r['server_peak_threads']!s:>8} "
+              f"{r['server_peak_rss_mb']!s:>7}")
+        if r['failures']:
+            print(f"         failures: {r['failures']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "cache_type": args.cache_type,
+                       "db_profile": env['DB_PROFILE'], "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,460 @@
+"""
+    load test of the api: seeds a throwaway sqlite db with a synthetic catalog (seed.py), then sends every route of
+    the book, author, rating, profile, shopping cart and wishlist blueprints `--requests` times, through
+        test_client   flask's test client, one request at a time (the app's own cost, no http)
+        server        a threaded werkzeug server on localhost, `--concurrency` client threads at once
+    and reports throughput, p50/p95/p99 latency and the SQL statements per request (from the Server-Timing
+    header, see instrumentation.py) per route.
+
+    requests are made from the same seeded parameters every run (request i of a route always asks for the same
+    book/user), so two runs with the same arguments send the same requests. the routes run in the order of
+    SCENARIOS, writes included: DELETE /books deletes the books POST /books made, PUT /delete-book takes out the
+    books PUT /shopping-cart put in, and so on. the response cache is cleared before each driver.
+
+    results are written as json with --output, --save-baseline stores them as the baseline and --baseline compares
+    a run against one: a route whose p50/p95 latency grew (or server throughput dropped) by more than --threshold,
+    or that runs more SQL statements per request, is a regression and the exit code is 1.
+    the server's and the client threads share one python process (and the GIL), so the server numbers are for
+    comparing runs with each other, not for sizing a production deployment.
+
+    usage: python -m GeekText.benchmarks.routes_bench [--requests 200] [--concurrency 8] [--only /books]
+               [--drivers test_client,server] [--output results.json] [--baseline baseline.json] [--save-baseline]
+               (plus seed.py's --books, --users, ... and DB_PROFILE/CACHE_TYPE in the environment)
+"""
+from collections import namedtuple, deque
+from datetime import datetime
+from threading import Thread, Lock
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+from . import seed
+from .search_bench import percentile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# latency changes smaller than this are noise, whatever the threshold says
+MIN_REGRESSION_MS = 0.5
+STATEMENT_TOLERANCE = 0.1
+
+SERVER_TIMING_STATEMENTS = re.compile(r'desc="(\d+) statements"')
+
+# one request: `token` goes in the Authorization header, `json` or `data` is the body
+Call = namedtuple('Call', ['method', 'path', 'json', 'data', 'token', 'headers'],
+                  defaults=(None, None, None, None))
+# `make(ctx, i)` builds the i-th request of the route, or returns None when there's nothing left to send
+Scenario = namedtuple('Scenario', ['name', 'make'])
+
+
+class Context:
+    """ what the scenarios build requests from: the seeded catalog's size, tokens, and what earlier writes made """
+
+    def __init__(self, args, admin_token, user_tokens):
+        self.books = args.books
+        self.authors = args.authors
+        self.admin_token = admin_token
+        self.users = user_tokens            # [(id, username, token)] of the logged in users
+        # isbns/usernames of what the routes create, after the seeded isbns (the db is new every run)
+        self._counter = itertools.count(seed.ISBN_START * 9)
+        self._lock = Lock()
+        self.created_isbns = deque()
+        self.created_authors = deque()
+        # (id, username) of the users POST /create-user made, they don't have a cart/wishlist yet
+        self.without_cart = deque()
+        self.without_wishlist = deque()
+        # refresh tokens from POST /get-token (and /refresh-token), each one works once
+        self.refresh_tokens = deque()
+
+    def unique(self):
+        with self._lock:
+            return str(next(self._counter))
+
+    def user(self, i):
+        return self.users[i % len(self.users)]
+
+    def isbn(self, i):
+        # spread over the catalog, but the same book for the same i
+        return seed.isbn(i * 7919 % self.books)
+
+    def author_id(self, i):
+        return 1 + i * 7919 % self.authors
+
+
+def pop(queue):
+    try:
+        return queue.popleft()
+    except IndexError:
+        return None
+
+
+def basic_auth(username):
+    return {'Authorization': 'Basic ' + base64.b64encode(f"{username}:{seed.PASSWORD}".encode()).decode()}
+
+
+def _create_user(ctx, i):
+    return Call('POST', '/create-user', {"username": f"bench{ctx.unique()}", "password": seed.PASSWORD})
+
+
+def _refresh_token(ctx, i):
+    token = pop(ctx.refresh_tokens)
+    return Call('POST', '/refresh-token', {"refresh_token": token}) if token else None
+
+
+def _create_book(ctx, i):
+    isbn = ctx.unique()
+    ctx.created_isbns.append(isbn)
+    return Call('POST', '/books', {"isbn": isbn, "title": f"new book {i}", "author_id": ctx.author_id(i),
+                                   "genre": "genre1", "price": 20, "date_published": "2022-05-25",
+                                   "publisher": "penguin", "description": "a new book"}, token=ctx.admin_token)
+
+
+def _import_books(ctx, i):
+    rows = [json.dumps({"isbn": ctx.unique(), "title": f"imported {i}", "author_id": ctx.author_id(i),
+                        "price": 15, "date_published": "2020-01-01"}) for _ in range(20)]
+    return Call('POST', '/books/import?format=ndjson', data='\n'.join(rows).encode(), token=ctx.admin_token,
+                headers={'Content-Type': 'application/x-ndjson'})
+
+
+def _delete_book(ctx, i):
+    isbn = pop(ctx.created_isbns)
+    return Call('DELETE', '/books', {"isbn": isbn}, token=ctx.admin_token) if isbn else None
+
+
+def _delete_author(ctx, i):
+    id = pop(ctx.created_authors)
+    return Call('DELETE', '/authors', {"id": id}, token=ctx.admin_token) if id else None
+
+
+def _create_cart(ctx, i):
+    user = pop(ctx.without_cart)
+    return Call('POST', '/shopping-cart', {"username": user[1]}, token=ctx.admin_token) if user else None
+
+
+def _create_wishlist(ctx, i):
+    user = pop(ctx.without_wishlist)
+    return Call('POST', '/add/wishlist', {"user_id": user[0]}, token=ctx.admin_token) if user else None
+
+
+def _batch(ctx, i):
+    _, username, token = ctx.user(i)
+    return Call('POST', '/shopping-cart/batch', {"operations": [
+        {"op": "add", "list": "cart", "isbn": ctx.isbn(i + 1), "quantity": 2},
+        {"op": "add", "list": "wishlist", "isbn": ctx.isbn(i + 2)},
+        {"op": "move", "list": "wishlist", "isbn": ctx.isbn(i + 2)},
+        {"op": "remove", "list": "cart", "isbn": ctx.isbn(i + 1)},
+    ]}, token=token)
+
+
+SCENARIOS = [
+    # profile_management_routes
+    Scenario('POST /create-user', _create_user),
+    Scenario('POST /get-token', lambda ctx, i: Call('POST', '/get-token', headers=basic_auth(ctx.user(i)[1]))),
+    Scenario('POST /refresh-token', _refresh_token),
+    # (no POST /logout, it would revoke the tokens every other route is sent with)
+    Scenario('GET /user', lambda ctx, i: Call('GET', '/user', {"id": ctx.user(i)[0]})),
+    Scenario('GET /credit-cards', lambda ctx, i: Call('GET', '/credit-cards', {"username": ctx.user(i)[1]},
+                                                      token=ctx.user(i)[2])),
+    Scenario('POST /add-cc', lambda ctx, i: Call('POST', '/add-cc', {"username": ctx.user(i)[1],
+                                                                      "credit_card": str(5000000000000000 + i)},
+                                                  token=ctx.user(i)[2])),
+    Scenario('GET /get-cc', lambda ctx, i: Call('GET', '/get-cc', {"username": ctx.user(i)[1]}, token=ctx.user(i)[2])),
+
+    # book_routes
+    Scenario('GET /books', lambda ctx, i: Call('GET', '/books?limit=50', token=ctx.user(i)[2])),
+    Scenario('GET /books?min_rating', lambda ctx, i: Call('GET', f'/books?min_rating={1 + i % 5}', token=ctx.user(i)[2])),
+    Scenario('GET /books/<isbn>', lambda ctx, i: Call('GET', f'/books/{ctx.isbn(i)}', token=ctx.user(i)[2])),
+    Scenario('GET /books/search', lambda ctx, i: Call('GET', f'/books/search?q=genre{i % 20}&limit=20',
+                                                      token=ctx.user(i)[2])),
+    Scenario('GET /books/top-sellers', lambda ctx, i: Call('GET', f'/books/top-sellers?limit={10 + i % 90}',
+                                                           token=ctx.user(i)[2])),
+    Scenario('GET /books/genre/<genre>', lambda ctx, i: Call('GET', f'/books/genre/genre{i % 20}?limit=50',
+                                                             token=ctx.user(i)[2])),
+    Scenario('POST /books/batch', lambda ctx, i: Call('POST', '/books/batch',
+                                                      {"isbns": [ctx.isbn(i * 50 + k) for k in range(50)]},
+                                                      token=ctx.user(i)[2])),
+    Scenario('POST /books', _create_book),
+    Scenario('POST /books/import', _import_books),
+    Scenario('PUT /books', lambda ctx, i: Call('PUT', '/books', {"isbn": ctx.isbn(i), "price": 5 + i % 45},
+                                               token=ctx.admin_token)),
+    Scenario('DELETE /books', _delete_book),
+
+    # author_routes
+    Scenario('GET /authors', lambda ctx, i: Call('GET', '/authors', token=ctx.user(i)[2])),
+    Scenario('GET /authors/<id>', lambda ctx, i: Call('GET', f'/authors/{ctx.author_id(i)}', token=ctx.user(i)[2])),
+    Scenario('GET /authors/<id>/books', lambda ctx, i: Call('GET', f'/authors/{ctx.author_id(i)}/books',
+                                                            token=ctx.user(i)[2])),
+    Scenario('POST /authors', lambda ctx, i: Call('POST', '/authors', {"first_name": f"new{i}", "last_name": "author",
+                                                                       "publisher": "penguin"}, token=ctx.admin_token)),
+    Scenario('PUT /authors', lambda ctx, i: Call('PUT', '/authors', {"id": ctx.author_id(i), "bio": f"bio {i}"},
+                                                 token=ctx.admin_token)),
+    Scenario('DELETE /authors', _delete_author),
+
+    # rating_routes
+    Scenario('POST /books/<isbn>/ratings', lambda ctx, i: Call('POST', f'/books/{ctx.isbn(i)}/ratings',
+                                                               {"rating": 1 + i % 5}, token=ctx.user(i)[2])),
+    Scenario('GET /books/<isbn>/ratings', lambda ctx, i: Call('GET', f'/books/{ctx.isbn(i)}/ratings',
+                                                              token=ctx.user(i)[2])),
+    Scenario('POST /books/<isbn>/comments', lambda ctx, i: Call('POST', f'/books/{ctx.isbn(i)}/comments',
+                                                                {"comment_text": f"comment {i}"}, token=ctx.user(i)[2])),
+    Scenario('GET /books/<isbn>/comments', lambda ctx, i: Call('GET', f'/books/{ctx.isbn(i)}/comments',
+                                                               token=ctx.user(i)[2])),
+
+    # shopping_cart
+    Scenario('POST /shopping-cart', _create_cart),
+    Scenario('PUT /shopping-cart', lambda ctx, i: Call('PUT', '/shopping-cart', {"username": ctx.user(i)[1],
+                                                                                 "isbn": ctx.isbn(i)},
+                                                       token=ctx.user(i)[2])),
+    Scenario('GET /get-shopping-cart', lambda ctx, i: Call('GET', '/get-shopping-cart', {"username": ctx.user(i)[1]})),
+    Scenario('PUT /delete-book', lambda ctx, i: Call('PUT', '/delete-book', {"username": ctx.user(i)[1],
+                                                                             "isbn": ctx.isbn(i)},
+                                                     token=ctx.user(i)[2])),
+    Scenario('POST /shopping-cart/batch', _batch),
+
+    # wishlist_routes
+    Scenario('POST /add/wishlist', _create_wishlist),
+    Scenario('GET /wishlist/<user_id>', lambda ctx, i: Call('GET', f'/wishlist/{ctx.user(i)[0]}', token=ctx.user(i)[2])),
+    Scenario('POST /wishlist/add', lambda ctx, i: Call('POST', '/wishlist/add', {"username": ctx.user(i)[1],
+                                                                                 "isbn": ctx.isbn(i)},
+                                                       token=ctx.user(i)[2])),
+    Scenario('PUT /wishlist/<user_id>/remove/<isbn>',
+             lambda ctx, i: Call('PUT', f'/wishlist/{ctx.user(i)[0]}/remove/{ctx.isbn(i)}', token=ctx.user(i)[2])),
+]
+
+
+def after_response(ctx, name, body):
+    # ids the server made up, that a later route needs
+    try:
+        if name == 'POST /authors':
+            ctx.created_authors.append(json.loads(body)['id'])
+        elif name == 'POST /create-user':
+            user = json.loads(body)['user']
+            ctx.without_cart.append((user['id'], user['username']))
+            ctx.without_wishlist.append((user['id'], user['username']))
+        elif name in ('POST /get-token', 'POST /refresh-token'):
+            ctx.refresh_tokens.append(json.loads(body)['refresh_token'])
+    except (ValueError, KeyError, TypeError):
+        pass
+
+
+def test_client_sender(app):
+    client = app.test_client()
+
+    def send(call):
+        headers = dict(call.headers or {})
+        if call.token:
+            headers['Authorization'] = call.token
+        resp = client.open(call.path, method=call.method, json=call.json, data=call.data, headers=headers)
+        return resp.status_code, resp.headers.get('Server-Timing'), resp.get_data()
+    return send
+
+
+def server_sender(host, port):
+    def send(call):
+        headers = dict(call.headers or {})
+        body = call.data
+        if call.json is not None:
+            body = json.dumps(call.json).encode()
+            headers['Content-Type'] = 'application/json'
+        if call.token:
+            headers['Authorization'] = call.token
+        conn = http.client.HTTPConnection(host, port)
+        try:
+            conn.request(call.method, call.path, body, headers)
+            resp = conn.getresponse()
+            return resp.status, resp.getheader('Server-Timing'), resp.read()
+        finally:
+            conn.close()
+    return send
+
+
+def drive(ctx, scenario, send, requests, concurrency=1):
+    """ sends `requests` requests of the scenario from `concurrency` threads, returns its summary """
+    latencies, statements, errors = [], [], []
+    next_index = itertools.count()
+    lock = Lock()
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_index)
+            if i >= requests:
+                return
+            call = scenario.make(ctx, i)
+            if call is None:
+                return
+            start = time.perf_counter()
+            status, timing, body = send(call)
+            elapsed = time.perf_counter() - start
+            match = SERVER_TIMING_STATEMENTS.search(timing or '')
+            with lock:
+                latencies.append(elapsed)
+                if match:
+                    statements.append(int(match.group(1)))
+                if status >= 400:
+                    errors.append(status)
+            after_response(ctx, scenario.name, body)
+
+    start = time.perf_counter()
+    threads = [Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return summarize(latencies, statements, errors, wall)
+
+
+def summarize(latencies, statements, errors, wall):
+    if not latencies:
+        return {"requests": 0}
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "throughput_rps": round(len(latencies) / wall, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "statements_per_request": round(sum(statements) / len(statements), 2) if statements else None,
+        "max_statements": max(statements, default=None),
+    }
+
+
+def compare(results, baseline, threshold):
+    """ the regressions of `results` against `baseline`, as lines of text """
+    regressions = []
+    for driver, routes in results["results"].items():
+        for name, now in routes.items():
+            before = baseline.get("results", {}).get(driver, {}).get(name)
+            if not before or not before.get("requests") or not now.get("requests"):
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                if now[metric] > before[metric] * (1 + threshold) and now[metric] - before[metric] > MIN_REGRESSION_MS:
+                    regressions.append(f"{driver} {name}: {metric} {before[metric]} -> {now[metric]}")
+            if driver == "server" and now["throughput_rps"] < before["throughput_rps"] / (1 + threshold):
+                regressions.append(f"{driver} {name}: throughput_rps {before['throughput_rps']} -> {now['throughput_rps']}")
+            if (now["statements_per_request"] or 0) > (before["statements_per_request"] or 0) + STATEMENT_TOLERANCE:
+                regressions.append(f"{driver} {name}: statements_per_request "
+                                   f"{before['statements_per_request']} -> {now['statements_per_request']}")
+    return regressions
+
+
+def print_report(driver, routes):
+    print(f"\n{driver}")
+    print(f"  {'route':<42} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'stmts':>6} {'errors':>6}")
+    for name, r in routes.items():
+        if not r["requests"]:
+            print(f"  {name:<42} (nothing to send)")
+            continue
+        print(f"  {name:<42} {r['throughput_rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} "
+              f"{r['statements_per_request'] if r['statements_per_request'] is not None else '-':>6} {r['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed.add_arguments(parser)
+    parser.add_argument('--requests', type=int, default=200, help="requests per route and driver")
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads of the server driver")
+    parser.add_argument('--logged-in-users', type=int, default=20, help="how many users send the requests")
+    parser.add_argument('--drivers', default='test_client,server')
+    parser.add_argument('--only', help="only the routes whose name contains this")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="compare against this json file, if it exists")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    # the app reads its config from the environment when it's imported
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.sqlite')
+    os.environ.setdefault('CACHE_SQLITE_PATH', os.path.join(workdir, 'cache.sqlite'))
+    os.environ.setdefault('QUERY_PLAN_CHECK', '0')
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no line per request
+    from ..app import app
+    from ..cache import cache
+    from ..models import db
+    app.config['TESTING'] = False   # no statement budget, we want to measure the statements
+    # one client sending everything as fast as it can, the rate limiter would turn most of it away
+    app.config['RATE_LIMIT_ENABLED'] = False
+    app.config['MAX_CONCURRENT_REQUESTS'] = app.config['MAX_CONCURRENT_WRITES'] = 0
+    app.config['SERVER_TIMING'] = True
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        seeded = seed.seed_from_args(args)
+        print(f"seeded {seeded} in {time.perf_counter() - start:.1f}s")
+
+    login = app.test_client()
+
+    def token(username):
+        return login.post('/get-token', headers=basic_auth(username)).json['token']
+
+    users = [(i, f"user{i}", token(f"user{i}")) for i in range(2, min(args.users, args.logged_in_users + 1) + 1)]
+    ctx = Context(args, token('user1'), users)
+    scenarios = [s for s in SCENARIOS if not args.only or args.only in s.name]
+
+    results = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "db_profile": app.config['DB_PROFILE'],
+            "cache_type": app.config['CACHE_TYPE'],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seeded": seeded,
+        },
+        "results": {},
+    }
+    for driver in args.drivers.split(','):
+        with app.app_context():
+            cache.clear()
+        if driver == 'test_client':
+            send, concurrency, server = test_client_sender(app), 1, None
+        elif driver == 'server':
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            Thread(target=server.serve_forever, daemon=True).start()
+            send, concurrency = server_sender('127.0.0.1', server.server_port), args.concurrency
+        else:
+            parser.error(f"unknown driver {driver}, use test_client and/or server")
+        routes = results["results"][driver] = {}
+        for scenario in scenarios:
+            routes[scenario.name] = drive(ctx, scenario, send, args.requests, concurrency)
+        if server is not None:
+            server.shutdown()
+        print_report(driver, routes)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved as the baseline in {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("seeded") != seeded or baseline["meta"].get("requests") != args.requests:
+            print("\nwarning: the baseline was made with a different catalog or --requests, numbers won't compare")
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{len(regressions)} regressions against {args.baseline} (threshold {args.threshold:.0%})")
+        for line in regressions:
+            print(f"  {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+    times GET /books/search's query (search.search_statement) on a generated catalog.
+
+    titles/descriptions are drawn from a vocabulary with a skewed (zipf-like) distribution, so the
+    queries below cover rare words, very common words (thousands of matches to rank), prefixes and filters.
+    bm25 has to score every match before the top `limit` can be picked, so latency grows with the number
+    of matches (printed next to each query), not with the size of the catalog.
+    the books are inserted with a Core executemany, so the FTS triggers are what fills books_fts.
+
+    usage: python -m GeekText.benchmarks.search_bench [--books 1000000] [--repeat 50] [--limit 20]
+"""
+from datetime import date
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import select, func
+
+from ..models import db, Book, Author
+from ..search import search_statement
+
+QUERIES = [
+    ('rare word',           "w4999", {}),
+    ('common word',         "w1", {}),
+    ('two words',           "w2 w30", {}),
+    ('prefix',              "w12", {}),
+    ('author name',         "author77", {}),
+    ('common + genre',      "w1", {'genre': 'genre3'}),
+    ('common + price/date', "w1", {'min_price': 10, 'max_price': 20, 'published_after': date(2010, 1, 1)}),
+]
+
+
+def seed(books, vocabulary=5000, authors=1000, batch=50000):
+    db.create_all()
+    db.session.execute(Author.__table__.insert(), [
+        {"id": i, "first_name": f"author{i}", "last_name": f"last{i}"} for i in range(1, authors + 1)])
+
+    rnd = random.Random(42)
+    words = [f"w{i}" for i in range(vocabulary)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(vocabulary)))
+
+    for start in range(0, books, batch):
+        db.session.execute(Book.__table__.insert(), [
+            {"title": ' '.join(rnd.choices(words, cum_weights=cum_weights, k=4)),
+             "description": ' '.join(rnd.choices(words, cum_weights=cum_weights, k=20)),
+             "isbn": str(10000000 + i), "price": 5 + i % 50, "copies_sold": i % 1000,
+             "genre": f"genre{i % 20}", "publisher": f"publisher{i % 100}", "author_id": 1 + i % authors,
+             "date_published": date(1990 + i % 30, 1 + i % 12, 1 + i % 28)}
+            for i in range(start, min(start + batch, books))
+        ])
+        db.session.commit()
+    db.session.execute(db.text("INSERT INTO books_fts(books_fts) VALUES ('optimize')"))
+    db.session.commit()
+
+
+def percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        start = time.perf_counter()
+        seed(args.books)
+        print(f"seeded {args.books} books in {time.perf_counter() - start:.1f}s, "
+              f"{args.repeat} runs per query, limit {args.limit}")
+
+        for name, q, filters in QUERIES:
+            stmt = search_statement(q, args.limit, **filters)
+            everything = search_statement(q, None, **filters).order_by(None).subquery()
+            matches = db.session.execute(select(func.count()).select_from(everything)).scalar()
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows = db.session.execute(stmt).all()
+                times.append(time.perf_counter() - start)
+            print(f"  {name:<20} p50 {percentile(times, 50) * 1000:7.2f} ms  "
+                  f"p95 {percentile(times, 95) * 1000:7.2f} ms  {len(rows)} rows of {matches} matches")
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
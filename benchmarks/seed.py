@@ -0,0 +1,139 @@
+"""
+    fills a database with a synthetic catalog for the benchmarks: authors, books, users (every one of them with
+    a cart, a wishlist and a credit card), cart/wishlist items, ratings and comments. everything is drawn from a
+    seeded random.Random, so the same arguments always give the same rows.
+
+    rows are inserted with Core executemany in batches (no ORM objects), and the books' rating_count/rating_sum
+    are filled in from the ratings, so the data looks like what the routes would have written.
+
+    every user's password is PASSWORD, user1 is an admin, the others are named user2, user3, ...
+    books that are in a cart/wishlist or rated are picked with a skew (a few books are very popular).
+
+    usage: python -m GeekText.benchmarks.seed [--books 10000] [--authors 1000] [--users 200] ...
+        seeds DATABASE_URL (db.sqlite by default). the tables have to exist already (flask db upgrade)
+"""
+from collections import Counter
+from datetime import date, datetime
+import argparse
+import itertools
+import random
+
+from flask import current_app
+
+from ..models import (db, Author, Book, User, CreditCard, ShoppingCart, CartItem, Wishlist, WishlistItem,
+                      Rating, Comment)
+from ..passwords import make_hash, scrypt_params
+
+PASSWORD = 'benchmark'
+ISBN_START = 100000000
+GENRES = [f"genre{i}" for i in range(20)]
+BATCH = 10000
+
+
+def isbn(i):
+    """ the isbn of the i-th seeded book (0 based) """
+    return str(ISBN_START + i)
+
+
+def _insert(model, rows):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH))
+        if not batch:
+            return
+        db.session.execute(model.__table__.insert(), batch)
+
+
+def seed_catalog(authors=1000, books=10000, users=200, cart_items=5, wishlist_items=5, ratings=20, comments=5,
+                 seed=42):
+    """ inserts the catalog into db (inside an app context) and commits. per user counts are the most a user
+        gets, each user gets a random number up to them. returns a dict of how many rows of each went in
+    """
+    rnd = random.Random(seed)
+    # book i is picked with weight 1/(i+1), so the first books are the popular ones
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(books)))
+
+    def popular_books(k):
+        # k different book ids (1 based), skewed towards the popular ones
+        picked = set()
+        while len(picked) < min(k, books):
+            picked.update(rnd.choices(range(1, books + 1), cum_weights=cum_weights, k=k - len(picked)))
+        return sorted(picked)
+
+    now = datetime.utcnow()
+    _insert(Author, ({"id": i, "first_name": f"first{i}", "last_name": f"last{i}", "publisher": f"publisher{i % 100}",
+                      "bio": f"author {i} wrote some books", "version": 1, "updated_at": now}
+                     for i in range(1, authors + 1)))
+
+    ratings_rows, comment_rows, cart_rows, wishlist_rows = [], [], [], []
+    for user_id in range(1, users + 1):
+        for book_id in popular_books(rnd.randint(0, cart_items)):
+            cart_rows.append({"cart_id": user_id, "book_id": book_id, "quantity": rnd.randint(1, 3), "added_at": now})
+        for book_id in popular_books(rnd.randint(0, wishlist_items)):
+            wishlist_rows.append({"wishlist_id": user_id, "book_id": book_id, "quantity": 1, "added_at": now})
+        for book_id in popular_books(rnd.randint(0, ratings)):
+            ratings_rows.append({"book_id": book_id, "user_id": user_id, "rating": rnd.randint(1, 5)})
+        for book_id in popular_books(rnd.randint(0, comments)):
+            comment_rows.append({"book_id": book_id, "user_id": user_id, "comment_text": f"comment by user{user_id}"})
+
+    rating_count = Counter(row["book_id"] for row in ratings_rows)
+    rating_sum = Counter()
+    for row in ratings_rows:
+        rating_sum[row["book_id"]] += row["rating"]
+
+    _insert(Book, ({"id": i + 1, "isbn": isbn(i), "title": f"book {i}", "description": f"a {GENRES[i % 20]} book",
+                    "genre": GENRES[i % 20], "publisher": f"publisher{i % 100}", "price": 5 + rnd.randint(0, 45),
+                    "copies_sold": rnd.randint(0, 100000), "author_id": 1 + rnd.randrange(authors) if authors else None,
+                    "date_published": date(1980 + rnd.randrange(42), rnd.randint(1, 12), rnd.randint(1, 28)),
+                    "rating_count": rating_count[i + 1], "rating_sum": rating_sum[i + 1],
+                    "version": 1, "updated_at": now}
+                   for i in range(books)))
+
+    # hashing is slow on purpose, every user gets the same hash
+    password = make_hash(PASSWORD, *scrypt_params(current_app.config))
+    _insert(User, ({"id": i, "username": f"user{i}", "first_name": f"first{i}", "last_name": f"last{i}",
+                    "isAdmin": i == 1, "homeAddress": f"{i} main street", "password": password}
+                   for i in range(1, users + 1)))
+    _insert(CreditCard, ({"id": i, "user_id": i, "credit_card": str(4000000000000000 + i)} for i in range(1, users + 1)))
+    # user i's cart and wishlist are number i, that's what cart_rows/wishlist_rows assumed
+    _insert(ShoppingCart, ({"id": i, "user_id": i, "version": 1} for i in range(1, users + 1)))
+    _insert(Wishlist, ({"id": i, "user_id": i} for i in range(1, users + 1)))
+    _insert(CartItem, cart_rows)
+    _insert(WishlistItem, wishlist_rows)
+    _insert(Rating, ratings_rows)
+    _insert(Comment, comment_rows)
+    db.session.commit()
+
+    return {"authors": authors, "books": books, "users": users, "cart_items": len(cart_rows),
+            "wishlist_items": len(wishlist_rows), "ratings": len(ratings_rows), "comments": len(comment_rows)}
+
+
+def add_arguments(parser):
+    parser.add_argument('--authors', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--cart-items', type=int, default=5, help="most books in a user's cart")
+    parser.add_argument('--wishlist-items', type=int, default=5, help="most books in a user's wishlist")
+    parser.add_argument('--ratings', type=int, default=20, help="most ratings per user")
+    parser.add_argument('--comments', type=int, default=5, help="most comments per user")
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def seed_from_args(args):
+    return seed_catalog(authors=args.authors, books=args.books, users=args.users, cart_items=args.cart_items,
+                        wishlist_items=args.wishlist_items, ratings=args.ratings, comments=args.comments,
+                        seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    from ..app import app
+    with app.app_context():
+        print(seed_from_args(args))
+
+
+if __name__ == '__main__':
+    main()
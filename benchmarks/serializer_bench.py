@@ -0,0 +1,97 @@
+"""
+    compares the ways we can turn book rows into json:
+        legacy      ORM objects + the old as_dict() (walks __table__.columns per row) + json.dumps
+        marshmallow ORM objects + BookSchema(many=True).dump + json.dumps
+        compiled    Core rows + book_serializer.dump_rows + serializers.dumps (orjson if installed)
+
+    usage: python -m GeekText.benchmarks.serializer_bench [--rows 100000] [--repeat 3]
+"""
+from datetime import date, datetime
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from flask import Flask
+
+from ..models import db, Book, BookSchema, book_serializer
+from ..serializers import dumps, orjson
+
+
+def legacy_as_dict(book):
+    # what Book.as_dict() used to do for every row (plus updated_at, which it never had to handle)
+    def set_value(name):
+        val = getattr(book, name)
+        if type(val) in (date, datetime):
+            return val.isoformat()
+        return val
+    return {c.name: set_value(c.name) for c in book.__table__.columns}
+
+
+def legacy():
+    books = Book.query.all()
+    return json.dumps([legacy_as_dict(book) for book in books]).encode()
+
+
+def marshmallow():
+    books = Book.query.all()
+    return json.dumps(BookSchema(many=True).dump(books)).encode()
+
+
+def compiled():
+    rows = db.session.execute(book_serializer.select())
+    return dumps(book_serializer.dump_rows(rows))
+
+
+def seed(rows):
+    db.create_all()
+    db.session.execute(Book.__table__.insert(), [
+        {"title": f"book {i}", "isbn": str(1000000 + i), "price": 10 + i % 40, "copies_sold": i,
+         "genre": "horror", "publisher": "penguin", "description": "a book about things",
+         "date_published": date(2000 + i % 20, 1 + i % 12, 1 + i % 28)}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+def time_it(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        seed(args.rows)
+        # all three have to produce the same data
+        assert json.loads(legacy()) == json.loads(compiled())
+
+        print(f"{args.rows} rows, best of {args.repeat} (json encoder: {'orjson' if orjson else 'stdlib json'})")
+        results = {name: time_it(fn, args.repeat) for name, fn in
+                   [('legacy', legacy), ('marshmallow', marshmallow), ('compiled', compiled)]}
+        for name, elapsed in results.items():
+            print(f"  {name:<12} {elapsed * 1000:9.1f} ms  {args.rows / elapsed:12,.0f} rows/s  "
+                  f"{results['legacy'] / elapsed:5.1f}x vs legacy")
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
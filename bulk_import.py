@@ -0,0 +1,207 @@
+"""
+    bulk book import, shared by POST /books/import and the `flask import-books` command.
+
+    the input (CSV or NDJSON) is read lazily and handled CHUNK_SIZE rows at a time. for each chunk:
+        - every row is validated with BookSchema (no db access)
+        - duplicate ISBNs and unknown author ids are found with one IN (...) query each
+        - authors given by first_name/last_name are resolved with one query, missing ones are created
+        - the valid rows are inserted with a single executemany and the chunk is committed
+    so a 100k row file costs a few hundred queries instead of several per book, and memory only ever
+    holds one chunk.
+"""
+import codecs
+import csv
+import io
+import json
+import time
+
+import click
+from flask.cli import with_appcontext
+from marshmallow import ValidationError
+from sqlalchemy import tuple_
+
+from .models import db, Book, Author, BookSchema
+from .invalidation import invalidate_new_books
+from .rankings import top_sellers
+from .conditional import bump_collections
+
+# stays under sqlite's limit of 999 bound parameters per IN (...)
+CHUNK_SIZE = 500
+
+# rows with errors reported back in full, past this only the count goes up
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('csv', 'ndjson')
+
+
+def read_csv(stream):
+    """ yields one dict per csv line. empty cells are left out so they get the column default """
+    for row in csv.DictReader(stream):
+        yield {k: v for k, v in row.items() if k and v not in ('', None)}
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_rows(stream, fmt):
+    """ yields book dicts from a text stream in `fmt` ('csv' or 'ndjson') """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    return read_csv(stream) if fmt == 'csv' else read_ndjson(stream)
+
+
+def text_stream(binary):
+    """ wraps a binary stream (an upload, the request body, a file) so it's read as utf-8 text line by line """
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='') if hasattr(binary, 'readable') \
+        else codecs.getreader('utf-8-sig')(binary)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": line, "errors": errors})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round((self.inserted + self.failed) / elapsed, 1) if elapsed else 0,
+        }
+
+
+def _import_chunk(chunk, schema, seen_isbns, report):
+    books = []  # (line, data)
+    for line, raw in chunk:
+        try:
+            data = schema.load(raw)
+        except ValidationError as e:
+            report.error(line, e.messages)
+            continue
+        except Exception as e:
+            report.error(line, {"_schema": [str(e)]})
+            continue
+
+        isbn = data.get('isbn')
+        if isbn is not None and isbn in seen_isbns:
+            report.error(line, {"isbn": [f"Book with ISBN:{isbn} already exists."]})
+            continue
+        seen_isbns.add(isbn)
+        books.append((line, data))
+
+    # isbns already in the db, one query for the whole chunk
+    isbns = [data['isbn'] for _, data in books if data.get('isbn') is not None]
+    existing = {isbn for (isbn,) in db.session.query(Book.isbn).filter(Book.isbn.in_(isbns))} if isbns else set()
+
+    # author ids that don't exist, one query
+    author_ids = {data['author_id'] for _, data in books if data.get('author_id') is not None}
+    known_ids = {id for (id,) in db.session.query(Author.id).filter(Author.id.in_(author_ids))} if author_ids else set()
+
+    # authors given by name, one query, then create whichever are missing
+    # (same as POST /books, a new author gets the publisher of the first of their books)
+    names = {}
+    for _, data in books:
+        if data.get('author_id') is None and data.get('first_name') and data.get('last_name'):
+            names.setdefault((data['first_name'], data['last_name']), data.get('publisher'))
+    by_name = {}
+    if names:
+        for author in Author.query.filter(tuple_(Author.first_name, Author.last_name).in_(list(names))):
+            by_name.setdefault((author.first_name, author.last_name), author.id)
+        missing = [Author(first_name=f, last_name=l, publisher=publisher)
+                   for (f, l), publisher in names.items() if (f, l) not in by_name]
+        if missing:
+            db.session.add_all(missing)
+            db.session.flush()
+            by_name.update({(a.first_name, a.last_name): a.id for a in missing})
+
+    rows = []
+    for line, data in books:
+        if data.get('isbn') in existing:
+            report.error(line, {"isbn": [f"Book with ISBN:{data['isbn']} already exists."]})
+            continue
+        if data.get('author_id') is not None and data['author_id'] not in known_ids:
+            report.error(line, {"author_id": [f"No author with ID: {data['author_id']} in our system"]})
+            continue
+        first_name, last_name = data.pop('first_name', None), data.pop('last_name', None)
+        if data.get('author_id') is None and (first_name, last_name) in by_name:
+            data['author_id'] = by_name[(first_name, last_name)]
+        rows.append(data)
+
+    if rows:
+        # one executemany for the chunk, no Book objects or identity map involved
+        db.session.bulk_insert_mappings(Book, rows)
+        # and no flush events either, so bump the books list version (for ETags) here, in the same transaction
+        bump_collections(db.session.connection(), ['books'])
+    db.session.commit()
+    report.inserted += len(rows)
+
+    # bulk inserts skip the session events, so evict the affected cached pages (and ranking) here
+    if rows:
+        invalidate_new_books({row.get('author_id') for row in rows} - {None},
+                             {row.get('genre') for row in rows} - {None})
+        top_sellers.invalidate()
+
+
+def import_books(rows, chunk_size=CHUNK_SIZE):
+    """ imports an iterable of book dicts. returns an ImportReport """
+    report = ImportReport()
+    schema = BookSchema()
+    seen_isbns = set()
+    numbered = enumerate(rows, start=1)
+
+    while True:
+        try:
+            chunk = next(_chunks(numbered, chunk_size), None)
+        except (ValueError, csv.Error) as e:
+            # the input itself is broken (bad json line, bad csv quoting), stop here
+            report.error(None, {"_input": [str(e)]})
+            break
+        if chunk is None:
+            break
+        try:
+            _import_chunk(chunk, schema, seen_isbns, report)
+        except Exception as e:
+            db.session.rollback()
+            for line, _ in chunk:
+                report.error(line, {"_db": [str(e)]})
+    return report
+
+
+@click.command('import-books')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help="defaults to the file extension")
+@click.option('--chunk-size', type=int, default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_books_command(file, fmt, chunk_size):
+    """ bulk import books from a CSV or NDJSON FILE ('-' for stdin) """
+    fmt = fmt or ('ndjson' if file.name.endswith(('.ndjson', '.jsonl')) else 'csv')
+    report = import_books(read_rows(text_stream(file), fmt), chunk_size).as_dict()
+    for error in report['errors']:
+        click.echo(f"row {error['row']}: {json.dumps(error['errors'])}", err=True)
+    click.echo(f"inserted {report['inserted']} books, {report['failed']} failed, "
+               f"{report['elapsed_seconds']}s ({report['rows_per_second']} rows/s)")
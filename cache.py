@@ -1,4 +1,201 @@
+from functools import wraps
+from hashlib import md5
+from threading import Lock
+import os
+import time
+
+from flask import request, make_response, g, has_app_context
 from flask_caching import Cache
 
 # create cache obj
-cache = Cache() 
\ No newline at end of file
+cache = Cache()
+
+# short names for CACHE_TYPE, anything else is passed to Flask-Caching as is (i.e. RedisCache)
+CACHE_BACKENDS = {
+    'sqlite': f"{__name__.rsplit('.', 1)[0]}.cache_backends.SQLiteCache",
+    'simple': 'SimpleCache',
+    'null':   'NullCache',
+}
+
+# per-route TTLs (in seconds)
+CATALOG_TTL = 300   # books & authors
+USER_TTL    = 60    # wishlists, carts, anything scoped to a single user
+
+# how long past its TTL an entry can still be served while a single request refreshes it
+STALE_TTL   = 60
+
+
+# tag index entries must outlive every entry they point to
+TAG_TTL     = max(CATALOG_TTL, USER_TTL) + STALE_TTL
+TAG_PREFIX  = 'tag:'
+
+
+_stats_lock = Lock()
+_tags_lock = Lock()
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_config_from_env(environ=os.environ):
+    """ builds the Flask-Caching config from CACHE_* environment variables.
+        CACHE_TYPE defaults to the sqlite backend so every worker on the host shares one cache.
+        every other CACHE_* variable is passed through, so pointing at an external store is only config:
+            CACHE_TYPE=RedisCache CACHE_REDIS_URL=redis://cache-host:6379/0
+    """
+    config = {
+        'CACHE_TYPE': 'sqlite',
+        'CACHE_THRESHOLD': 5000,
+        'CACHE_DEFAULT_TIMEOUT': CATALOG_TTL,
+    }
+    for k, v in environ.items():
+        if k.startswith('CACHE_'):
+            config[k] = int(v) if v.isdigit() else v
+    config['CACHE_TYPE'] = CACHE_BACKENDS.get(config['CACHE_TYPE'].lower(), config['CACHE_TYPE'])
+    return config
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def cache_stats():
+    """ returns a snapshot of the response cache counters for this process """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def response_cache_key(principal=None):
+    """ builds the cache key for the current request.
+        the key covers the endpoint, path and (sorted) query string, and the user id for user scoped routes,
+        so one user's cached response can never be served to another.
+    """
+    query = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    key = f"view:{request.endpoint}:{request.path}"
+    if query:
+        key += ':' + md5(query.encode()).hexdigest()
+    if principal is not None:
+        key += f":user:{principal.id}"
+    return key
+
+
+def tag_response(*tags):
+    """ tags the response the current view is building, so invalidate_tags() can evict it later.
+        i.e. a book page is tagged 'book:<id>' and gets evicted when that book changes.
+        only has an effect inside a view decorated with cached_response
+    """
+    if 'cache_tags' not in g:
+        g.cache_tags = set()
+    g.cache_tags.update(tags)
+
+
+def _register_tags(key, tags, timeout):
+    if not tags:
+        return
+    # backends that index tags themselves (SQLiteCache) do it atomically for every process
+    if hasattr(cache.cache, 'add_tags'):
+        cache.cache.add_tags(key, tags)
+        return
+    with _tags_lock:
+        for tag in tags:
+            keys = cache.get(TAG_PREFIX + tag) or set()
+            keys.add(key)
+            cache.set(TAG_PREFIX + tag, keys, timeout=max(timeout, TAG_TTL))
+
+
+def invalidate_tags(*tags):
+    """ evicts every cached response tagged with any of `tags` """
+    if not tags or not has_app_context():
+        return
+    if hasattr(cache.cache, 'invalidate_tags'):
+        _count("evictions", cache.cache.invalidate_tags(set(tags)))
+        return
+    with _tags_lock:
+        for tag in set(tags):
+            keys = cache.get(TAG_PREFIX + tag)
+            # not delete_many(), it stops at the first key that already expired
+            for key in keys or ():
+                if cache.delete(key):
+                    _count("evictions")
+            cache.delete(TAG_PREFIX + tag)
+
+
+def get_items(keys):
+    """ looks up many cached items (not responses, i.e. single books) with one round trip to the cache.
+        returns {key: value} for the keys that were found
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    found = {key: value for key, value in zip(keys, cache.get_many(*keys)) if value is not None}
+    _count("hits", len(found))
+    _count("misses", len(keys) - len(found))
+    return found
+
+
+def set_items(items, timeout=CATALOG_TTL):
+    """ caches {key: (value, tags)}. every key is registered under its tags, so invalidate_tags evicts it """
+    if not items:
+        return
+    cache.set_many({key: value for key, (value, _) in items.items()}, timeout=timeout)
+    for key, (_, tags) in items.items():
+        _register_tags(key, tags, timeout)
+
+
+def _to_response(entry, state):
+    resp = make_response(entry['body'], entry['status'])
+    resp.mimetype = entry['mimetype']
+    resp.headers['X-Cache'] = state
+    return resp
+
+
+def cached_response(timeout=CATALOG_TTL, stale=STALE_TTL, per_user=False, unless=None):
+    """ caches successful responses of a GET route.
+
+        must go BELOW @token_required so the token is always checked before a cached body is served,
+        and so per_user routes can add the authenticated user to the key.
+        once an entry is older than `timeout` it's served for up to `stale` more seconds while the first
+        request to see it re-runs the view, instead of every request hitting the db at once.
+        `unless` is an optional callable, if it returns True the response isn't cached (i.e. streamed responses)
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if unless is not None and unless():
+                return f(*args, **kwargs)
+
+            principal = args[0] if per_user and args else None
+            key = response_cache_key(principal)
+            entry = cache.get(key)
+
+            if entry is not None:
+                if time.time() < entry['expires']:
+                    _count("hits")
+                    return _to_response(entry, 'HIT')
+                # stale. only the request that gets the refresh lock re-runs the view
+                if not cache.add(key + ':refreshing', 1, timeout=stale or 1):
+                    _count("stale_hits")
+                    return _to_response(entry, 'STALE')
+                _count("evictions")
+
+            _count("misses")
+            g.cache_tags = set()
+            resp = make_response(f(*args, **kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                entry = {
+                    'body': resp.get_data(),
+                    'status': resp.status_code,
+                    'mimetype': resp.mimetype,
+                    'expires': time.time() + timeout,
+                }
+                cache.set(key, entry, timeout=timeout + stale)
+                _register_tags(key, g.cache_tags, timeout + stale)
+            cache.delete(key + ':refreshing')
+            resp.headers['X-Cache'] = 'MISS'
+            return resp
+
+        return decorated
+
+    return decorator
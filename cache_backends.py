@@ -0,0 +1,295 @@
+"""
+    cache backends that aren't shipped with Flask-Caching.
+
+    SQLiteCache keeps entries in a local sqlite file, so every gunicorn worker on the same host shares
+    one cache (and one set of invalidations) instead of each worker filling its own dict.
+    set CACHE_TYPE=sqlite to use it (it's the default, see cache.cache_config_from_env)
+"""
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from flask_caching.backends.base import BaseCache
+
+from .database import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+def _off_the_loop(method):
+    # every call is a sqlite query on a file other processes write to, see database.run_blocking
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return run_blocking(method, self, *args, **kwargs)
+    return wrapper
+
+
+class SQLiteCache(BaseCache):
+    """ cache stored in a sqlite file shared by every process on the host.
+
+        :param path: the sqlite file to store entries in
+        :param threshold: max number of entries. once it's passed, expired entries and then the least
+                          recently used ones are evicted
+        :param default_timeout: timeout used when set() isn't given one. 0 means never expire
+        :param prune_interval: check the threshold every `prune_interval` writes instead of on every write
+
+        it also supports tags natively (add_tags/invalidate_tags) so a tag index update is a single
+        insert instead of a read-modify-write of a shared set that other processes could clobber,
+        and shared token buckets for the rate limiter (sync_buckets), so every worker draws from the same buckets.
+    """
+
+    def __init__(self, path, threshold=5000, default_timeout=300, prune_interval=100):
+        super(SQLiteCache, self).__init__(default_timeout)
+        self.path = path
+        self._threshold = threshold
+        self._prune_interval = prune_interval
+        self._writes = 0
+        self._local = threading.local()
+        self._create_tables()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        path = config.get("CACHE_SQLITE_PATH") or os.path.join(app.root_path, "cache.sqlite")
+        args.insert(0, path)
+        kwargs.update(dict(threshold=config["CACHE_THRESHOLD"]))
+        return cls(*args, **kwargs)
+
+    @property
+    def _conn(self):
+        # sqlite connections can't be shared across threads or a fork, so keep one per thread per process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so statements inside are atomic across processes
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _create_tables(self):
+        with self._transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                key TEXT PRIMARY KEY,
+                                value BLOB NOT NULL,
+                                expires REAL NOT NULL,
+                                accessed REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache_tags (
+                                tag TEXT NOT NULL,
+                                key TEXT NOT NULL,
+                                PRIMARY KEY (tag, key)) WITHOUT ROWID""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS rate_limits (
+                                key TEXT PRIMARY KEY,
+                                tokens REAL NOT NULL,
+                                updated REAL NOT NULL) WITHOUT ROWID""")
+
+    def _normalize_timeout(self, timeout):
+        timeout = BaseCache._normalize_timeout(self, timeout)
+        if timeout > 0:
+            timeout = time.time() + timeout
+        return timeout
+
+    @_off_the_loop
+    def get(self, key):
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT value, accessed FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        # only touch the LRU clock once a second per entry, so hot reads don't turn into writes
+        if now - row[1] > 1:
+            self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        try:
+            return pickle.loads(row[0])
+        except (pickle.PickleError, EOFError):
+            logger.exception("could not unpickle cache entry %s", key)
+            return None
+
+    @_off_the_loop
+    def get_many(self, *keys):
+        # one query per 500 keys instead of one per key
+        now = time.time()
+        found, touched = {}, []
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            for key, value, accessed in self._conn.execute(
+                f"SELECT key, value, accessed FROM cache WHERE key IN ({marks}) AND (expires = 0 OR expires > ?)",
+                (*chunk, now),
+            ):
+                found[key] = value
+                if now - accessed > 1:
+                    touched.append((now, key))
+        if touched:
+            self._conn.executemany("UPDATE cache SET accessed = ? WHERE key = ?", touched)
+        values = []
+        for key in keys:
+            try:
+                values.append(pickle.loads(found[key]) if key in found else None)
+            except (pickle.PickleError, EOFError):
+                logger.exception("could not unpickle cache entry %s", key)
+                values.append(None)
+        return values
+
+    @_off_the_loop
+    def has(self, key):
+        row = self._conn.execute(
+            "SELECT 1 FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    @_off_the_loop
+    def set(self, key, value, timeout=None):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._normalize_timeout(timeout), time.time()),
+        )
+        self._wrote()
+        return True
+
+    @_off_the_loop
+    def set_many(self, mapping, timeout=None):
+        expires, now = self._normalize_timeout(timeout), time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                ((key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires, now) for key, value in mapping.items()),
+            )
+        self._wrote()
+        return True
+
+    @_off_the_loop
+    def add(self, key, value, timeout=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires != 0 AND expires <= ?", (key, now))
+            added = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._normalize_timeout(timeout), now),
+            ).rowcount
+        self._wrote()
+        return added == 1
+
+    @_off_the_loop
+    def delete(self, key):
+        return self._conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount == 1
+
+    @_off_the_loop
+    def delete_many(self, *keys):
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM cache WHERE key = ?", ((key,) for key in keys))
+        return True
+
+    @_off_the_loop
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache")
+            conn.execute("DELETE FROM cache_tags")
+            conn.execute("DELETE FROM rate_limits")
+        return True
+
+    @_off_the_loop
+    def inc(self, key, delta=1):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT value, expires FROM cache WHERE key = ? AND (expires = 0 OR expires > ?)", (key, now)
+            ).fetchone()
+            value = (pickle.loads(row[0]) if row else 0) + delta
+            expires = row[1] if row else 0
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires, now),
+            )
+        self._wrote()
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    @_off_the_loop
+    def add_tags(self, key, tags):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)", ((tag, key) for tag in tags)
+            )
+
+    @_off_the_loop
+    def invalidate_tags(self, tags):
+        """ deletes every entry tagged with any of `tags`. returns how many entries were evicted """
+        tags = list(tags)
+        evicted = 0
+        with self._transaction() as conn:
+            # stay well under sqlite's limit on bound parameters
+            for i in range(0, len(tags), 500):
+                chunk = tags[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                evicted += conn.execute(
+                    f"DELETE FROM cache WHERE key IN (SELECT key FROM cache_tags WHERE tag IN ({marks}))", chunk
+                ).rowcount
+                conn.execute(f"DELETE FROM cache_tags WHERE tag IN ({marks})", chunk)
+        return evicted
+
+    @_off_the_loop
+    def sync_buckets(self, buckets):
+        """ the rate limiter's reconciliation (see ratelimit.py): `buckets` is [(key, refill per second, capacity,
+            tokens taken since the last sync)] from one worker. takes them from the shared buckets (refilled up to
+            now, never below 0) and returns {key: tokens left} for the worker to carry on from.
+            a bucket nobody used yet is full
+        """
+        now = time.time()
+        levels = {}
+        with self._transaction() as conn:
+            for i in range(0, len(buckets), 500):
+                chunk = buckets[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                state = {key: (tokens, updated) for key, tokens, updated in conn.execute(
+                    f"SELECT key, tokens, updated FROM rate_limits WHERE key IN ({marks})", [b[0] for b in chunk])}
+                for key, rate, capacity, taken in chunk:
+                    tokens, updated = state.get(key, (capacity, now))
+                    levels[key] = max(0.0, min(capacity, tokens + max(0.0, now - updated) * rate) - taken)
+            conn.executemany("INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                             ((key, level, now) for key, level in levels.items()))
+        return levels
+
+    @_off_the_loop
+    def prune_buckets(self, idle):
+        """ deletes the buckets nobody took from in `idle` seconds (they're full again, same as no row) """
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM rate_limits WHERE updated < ?", (time.time() - idle,)).rowcount
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % self._prune_interval == 0:
+            self._prune()
+
+    def _prune(self):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE expires != 0 AND expires <= ?", (now,))
+            count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self._threshold:
+                # least recently used first
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                    (count - self._threshold,),
+                )
+            conn.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache)")
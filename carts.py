@@ -0,0 +1,158 @@
+"""
+    set-based cart and wishlist writes.
+
+    each change is one INSERT .. ON CONFLICT or DELETE statement, instead of loading the collection,
+    changing it in python and flushing it back. none of them commit: the views run them inside @atomic
+    (transactions.py), and a view changing a cart calls touch_cart() first, so two requests changing the
+    same cart at once can't both go through. the loser gets a StaleDataError and @atomic runs it again.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, literal
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.orm.exc import StaleDataError
+
+from .models import db, ShoppingCart, CartItem, Wishlist, WishlistItem
+from .invalidation import evict_on_commit
+
+
+def _insert(model):
+    """ an INSERT with on_conflict_do_update/do_nothing, for whichever db we're on """
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def cart_for(user_id, create=True):
+    """ the user's cart as an (id, version) row. creates it if they don't have one and `create` is set,
+        otherwise returns None
+    """
+    stmt = select(ShoppingCart.id, ShoppingCart.version).where(ShoppingCart.user_id == user_id)
+    cart = db.session.execute(stmt).first()
+    if cart is None and create:
+        # two first adds at once both get here, the unique index on user_id makes the second insert a no-op
+        db.session.execute(_insert(ShoppingCart).values(user_id=user_id, version=1)
+                           .on_conflict_do_nothing(index_elements=['user_id']))
+        cart = db.session.execute(stmt).one()
+    return cart
+
+
+def wishlist_for(user_id, create=True):
+    """ the user's wishlist as an (id,) row, same as cart_for """
+    stmt = select(Wishlist.id).where(Wishlist.user_id == user_id)
+    wishlist = db.session.execute(stmt).first()
+    if wishlist is None and create:
+        db.session.execute(_insert(Wishlist).values(user_id=user_id)
+                           .on_conflict_do_nothing(index_elements=['user_id']))
+        wishlist = db.session.execute(stmt).one()
+    return wishlist
+
+
+def touch_cart(cart):
+    """ bumps the cart's version, as long as it's still the version `cart` was read at.
+        raises StaleDataError if another request changed the cart in between
+    """
+    updated = db.session.execute(
+        update(ShoppingCart)
+        .where(ShoppingCart.id == cart.id, ShoppingCart.version == cart.version)
+        .values(version=ShoppingCart.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if updated != 1:
+        raise StaleDataError(f"shopping cart {cart.id} was changed by another request")
+    evict_on_commit(db.session, f"cart:{cart.id}")
+
+
+def add_to_cart(cart_id, book_id, quantity=1):
+    """ adds a book to the cart, or adds `quantity` to it if it's already in there """
+    stmt = _insert(CartItem).values(cart_id=cart_id, book_id=book_id, quantity=quantity)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['cart_id', 'book_id'],
+        set_={'quantity': CartItem.__table__.c.quantity + stmt.excluded.quantity},
+    ))
+
+
+def remove_from_cart(cart_id, book_id):
+    """ takes a book out of the cart. returns whether it was in there """
+    return db.session.execute(
+        delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.book_id == book_id)
+    ).rowcount > 0
+
+
+def add_to_wishlist(wishlist_id, book_id):
+    """ adds a book to the wishlist (books are only in a wishlist once). returns whether it was added """
+    added = db.session.execute(
+        _insert(WishlistItem).values(wishlist_id=wishlist_id, book_id=book_id)
+        .on_conflict_do_nothing(index_elements=['wishlist_id', 'book_id'])
+    ).rowcount > 0
+    if added:
+        evict_on_commit(db.session, f"wishlist:{wishlist_id}")
+    return added
+
+
+def remove_from_wishlist(wishlist_id, book_id):
+    """ takes a book out of the wishlist. returns whether it was in there """
+    removed = db.session.execute(
+        delete(WishlistItem).where(WishlistItem.wishlist_id == wishlist_id, WishlistItem.book_id == book_id)
+    ).rowcount > 0
+    if removed:
+        evict_on_commit(db.session, f"wishlist:{wishlist_id}")
+    return removed
+
+
+def clear_cart(cart_id):
+    """ empties the cart. returns how many books were taken out """
+    return db.session.execute(delete(CartItem).where(CartItem.cart_id == cart_id)).rowcount
+
+
+def clear_wishlist(wishlist_id):
+    """ empties the wishlist. returns how many books were taken out """
+    removed = db.session.execute(delete(WishlistItem).where(WishlistItem.wishlist_id == wishlist_id)).rowcount
+    if removed:
+        evict_on_commit(db.session, f"wishlist:{wishlist_id}")
+    return removed
+
+
+def move_to_cart(wishlist_id, cart_id, book_ids=None):
+    """ moves books from the wishlist to the cart (all of them if book_ids is None), one INSERT .. SELECT
+        and one DELETE however many books there are. a book already in the cart gets its quantity bumped.
+        returns how many books were moved
+    """
+    in_wishlist = [WishlistItem.wishlist_id == wishlist_id]
+    if book_ids is not None:
+        in_wishlist.append(WishlistItem.book_id.in_(book_ids))
+
+    stmt = _insert(CartItem).from_select(
+        ['cart_id', 'book_id', 'quantity', 'added_at'],
+        select(literal(cart_id), WishlistItem.book_id, literal(1), literal(datetime.utcnow()))
+        .where(*in_wishlist).order_by(WishlistItem.added_at),
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['cart_id', 'book_id'],
+        set_={'quantity': CartItem.__table__.c.quantity + stmt.excluded.quantity},
+    ))
+    moved = db.session.execute(delete(WishlistItem).where(*in_wishlist)).rowcount
+    if moved:
+        evict_on_commit(db.session, f"wishlist:{wishlist_id}")
+    return moved
+
+
+def move_to_wishlist(cart_id, wishlist_id, book_ids=None):
+    """ moves books from the cart to the wishlist (all of them if book_ids is None), the other way
+        around from move_to_cart. returns how many books were moved
+    """
+    in_cart = [CartItem.cart_id == cart_id]
+    if book_ids is not None:
+        in_cart.append(CartItem.book_id.in_(book_ids))
+
+    db.session.execute(
+        _insert(WishlistItem).from_select(
+            ['wishlist_id', 'book_id', 'quantity', 'added_at'],
+            select(literal(wishlist_id), CartItem.book_id, literal(1), literal(datetime.utcnow()))
+            .where(*in_cart).order_by(CartItem.added_at),
+        ).on_conflict_do_nothing(index_elements=['wishlist_id', 'book_id'])
+    )
+    moved = db.session.execute(delete(CartItem).where(*in_cart)).rowcount
+    if moved:
+        evict_on_commit(db.session, f"wishlist:{wishlist_id}")
+    return moved
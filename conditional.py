@@ -0,0 +1,142 @@
+"""
+    conditional GET (ETag / Last-Modified) for the catalog.
+
+    a response's ETag is a hash of the version(s) of what it shows: Book.version / Author.version for a
+    single book or author (version_id_col, so the ORM bumps it on every UPDATE), and a CollectionVersion
+    counter for lists, which every flush that writes a book (or rating) / author bumps in the same
+    transaction. a client sending back an ETag that still matches gets a 304 before the view runs, so
+    nothing is loaded, serialized or sent.
+"""
+from datetime import datetime, timezone
+from functools import wraps
+from hashlib import md5
+
+from flask import request, make_response
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+
+from .models import db, Book, Author, Rating, CollectionVersion
+
+# which collections a write to each model changes
+_COLLECTIONS = {
+    Book: 'books',
+    Rating: 'books',   # books carry rating_count/rating_sum
+    Author: 'authors',
+}
+
+
+def bump_collections(connection, names):
+    """ bumps the version of each collection in `names`, on `connection` (i.e. in the caller's transaction) """
+    now = datetime.utcnow()
+    for name in names:
+        updated = connection.execute(
+            update(CollectionVersion.__table__)
+            .where(CollectionVersion.name == name)
+            .values(version=CollectionVersion.version + 1, updated_at=now)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(CollectionVersion.__table__).values(name=name, version=1, updated_at=now))
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_changed_collections(session, flush_context):
+    names = set()
+    for obj in session.new:
+        names.add(_COLLECTIONS.get(type(obj)))
+    for obj in session.deleted:
+        names.add(_COLLECTIONS.get(type(obj)))
+    for obj in session.dirty:
+        if type(obj) in _COLLECTIONS and session.is_modified(obj, include_collections=False):
+            names.add(_COLLECTIONS[type(obj)])
+    names.discard(None)
+    if names:
+        bump_collections(session.connection(), sorted(names))
+
+
+def collection_version(*names):
+    """ (version, last_modified) of the collections `names`, in one query """
+    rows = db.session.execute(
+        select(CollectionVersion.name, CollectionVersion.version, CollectionVersion.updated_at)
+        .where(CollectionVersion.name.in_(names))
+    ).all()
+    versions = {name: (version, updated_at) for name, version, updated_at in rows}
+    version = ','.join(f"{name}={versions.get(name, (0,))[0]}" for name in names)
+    modified = [updated_at for _, updated_at in versions.values() if updated_at is not None]
+    return version, max(modified, default=None)
+
+
+def row_version(model, id):
+    """ (version, last_modified) of one Book/Author, or None if there is no such row """
+    row = db.session.execute(select(model.version, model.updated_at).where(model.id == id)).first()
+    if row is None:
+        return None
+    return f"{model.__tablename__}:{id}={row.version}", row.updated_at
+
+
+def combine(*states):
+    """ the (version, last_modified) of a response made from several resources """
+    if any(state is None for state in states):
+        return None
+    modified = [last_modified for _, last_modified in states if last_modified is not None]
+    return ';'.join(version for version, _ in states), max(modified, default=None)
+
+
+def make_etag(version):
+    # same version, different page/representation -> different ETag
+    raw = f"{request.endpoint}:{request.full_path}:{request.headers.get('Accept', '')}:{version}"
+    return md5(raw.encode()).hexdigest()
+
+
+def _http_date(last_modified):
+    return last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def not_modified(etag, last_modified=None):
+    """ a 304 response if the client already has this version (If-None-Match, or If-Modified-Since when
+        there is no If-None-Match), otherwise None
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = (last_modified is not None and request.if_modified_since is not None
+                 and _http_date(last_modified) <= request.if_modified_since)
+    if not fresh:
+        return None
+    resp = make_response('', 304)
+    return with_validators(resp, etag, last_modified)
+
+
+def with_validators(resp, etag, last_modified=None):
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = _http_date(last_modified)
+    return resp
+
+
+def conditional(version_of):
+    """ answers conditional GETs for a view.
+        version_of(**view_kwargs) returns the (version, last_modified) of what the view would return,
+        or None (i.e. no such row) to just run the view.
+        goes below @token_required and above @cached_response, so a 304 skips the cache lookup as well
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            state = version_of(**kwargs)
+            if state is None:
+                return f(*args, **kwargs)
+
+            version, last_modified = state
+            etag = make_etag(version)
+            resp = not_modified(etag, last_modified)
+            if resp is not None:
+                return resp
+
+            resp = make_response(f(*args, **kwargs))
+            if resp.status_code == 200:
+                with_validators(resp, etag, last_modified)
+            return resp
+
+        return decorated
+
+    return decorator
@@ -0,0 +1,361 @@
+"""
+    database engine profiles.
+
+    DATABASE_URL picks the database (sqlite:///db.sqlite by default, a postgresql:// url works too) and
+    DB_PROFILE how the engine is tuned for it:
+        dev         no connection pool (a connection per request, so db.sqlite can be deleted while the server
+                    runs), WAL and a busy timeout so a write doesn't fail with `database is locked` right away
+        production  a pool of connections kept open, plus a bigger page cache, mmap'ed reads, temp tables in
+                    memory and more prepared statements kept per connection
+
+    on sqlite the profile's PRAGMAs run on every new connection (the journal mode sticks to the file, the rest
+    are per connection). WAL lets readers keep reading while a writer commits, and busy_timeout makes a writer
+    wait for the lock instead of erroring.
+
+    single settings can be overridden from the environment, i.e. DB_POOL_SIZE=20 or SQLITE_PRAGMA_MMAP_SIZE=0
+
+    read replicas: DATABASE_REPLICA_URLS is a comma separated list of databases that GET/HEAD requests read
+    from (round robin), everything else goes to DATABASE_URL. sqlite replicas are always opened read only
+    (mode=ro), so `DATABASE_REPLICA_URLS=sqlite:///db.sqlite` gives GETs their own read-only connections to
+    the same file. a user whose write request committed reads from the primary for DB_STICKY_SECONDS after,
+    so they see their own write even if a replica is behind. so do the requests without a token from the ip the
+    write came from (behind a proxy that's every anonymous client at once, which only costs replica reads).
+"""
+from contextvars import ContextVar
+from functools import partial
+from itertools import count
+import asyncio
+from threading import Lock
+import os
+
+from flask import request, g, current_app, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import await_only
+
+from .cache import cache
+
+DEFAULT_DATABASE_URL = 'sqlite:///db.sqlite'
+DEFAULT_PROFILE = 'dev'
+
+PROFILES = {
+    'dev': {
+        'sqlite': {
+            'engine_options': {},
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+            },
+        },
+        'postgresql': {
+            'engine_options': {'pool_size': 5, 'max_overflow': 5, 'pool_pre_ping': True},
+        },
+    },
+    'production': {
+        'sqlite': {
+            'engine_options': {
+                'poolclass': QueuePool,
+                'pool_size': 8,
+                'max_overflow': 8,
+                'pool_timeout': 10,
+                # pooled connections are handed from thread to thread; sqlite3 statement cache per connection
+                'connect_args': {'check_same_thread': False, 'cached_statements': 512},
+                'query_cache_size': 1200,
+            },
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+                'cache_size': -65536,       # KiB, so 64MB per connection
+                'mmap_size': 268435456,     # 256MB of the file read through mmap instead of read()
+                'temp_store': 'MEMORY',
+            },
+        },
+        'postgresql': {
+            'engine_options': {
+                'pool_size': 20,
+                'max_overflow': 10,
+                'pool_timeout': 10,
+                'pool_recycle': 1800,
+                'pool_pre_ping': True,
+                'query_cache_size': 1200,
+            },
+        },
+    },
+}
+
+# environment variables that override one engine option
+ENGINE_OPTION_VARIABLES = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle',
+}
+PRAGMA_PREFIX = 'SQLITE_PRAGMA_'
+
+# requests whose reads can go to a replica
+READ_METHODS = ('GET', 'HEAD')
+DEFAULT_STICKY_SECONDS = 5
+STICKY_PREFIX = 'db:sticky:'
+
+# while set, db.session (and Model.query) is this session instead of the scoped one. asgi.py sets it to the
+# sync side of an AsyncSession, so the views' queries go through the async driver
+session_override = ContextVar('session_override', default=None)
+
+
+def run_blocking(fn, *args, **kwargs):
+    """ fn(*args, **kwargs). on a request asgi.py runs on the event loop, fn runs on a worker thread while the
+        loop goes on with the other requests, so a blocking call (i.e. the sqlite cache file waiting for its
+        write lock) doesn't stall all of them
+    """
+    if session_override.get() is None:
+        return fn(*args, **kwargs)
+    return await_only(asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs)))
+
+
+def database_config_from_env(environ=os.environ):
+    """ builds the SQLALCHEMY_* config (plus SQLITE_PRAGMAS) from DATABASE_URL, DB_PROFILE and the overrides """
+    url = environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    if url.startswith('postgres://'):
+        # what heroku & co. hand out, sqlalchemy only knows postgresql://
+        url = 'postgresql://' + url[len('postgres://'):]
+
+    profile_name = environ.get('DB_PROFILE', DEFAULT_PROFILE).lower()
+    if profile_name not in PROFILES:
+        raise ValueError(f"DB_PROFILE must be one of: {', '.join(PROFILES)}")
+    backend = 'sqlite' if url.startswith('sqlite') else 'postgresql'
+    profile = PROFILES[profile_name][backend]
+
+    options = dict(profile['engine_options'])
+    pragmas = dict(profile.get('pragmas', {}))
+    for variable, option in ENGINE_OPTION_VARIABLES.items():
+        if variable in environ:
+            options[option] = int(environ[variable])
+    for k, v in environ.items():
+        if k.startswith(PRAGMA_PREFIX):
+            pragmas[k[len(PRAGMA_PREFIX):].lower()] = int(v) if v.lstrip('-').isdigit() else v
+    if backend == 'sqlite' and options.get('pool_size') and 'poolclass' not in options:
+        # sqlalchemy doesn't pool sqlite file connections by default
+        options['poolclass'] = QueuePool
+        options['connect_args'] = dict(options.get('connect_args', {}), check_same_thread=False)
+
+    replicas = [replica.strip() for replica in environ.get('DATABASE_REPLICA_URLS', '').split(',') if replica.strip()]
+
+    return {
+        'DB_PROFILE': profile_name,
+        'SQLALCHEMY_DATABASE_URI': url,
+        'SQLALCHEMY_ENGINE_OPTIONS': options,
+        'SQLITE_PRAGMAS': pragmas if backend == 'sqlite' else {},
+        'SQLALCHEMY_REPLICA_URLS': replicas,
+        'DB_STICKY_SECONDS': int(environ.get('DB_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)),
+    }
+
+
+def read_only_url(url, root_path):
+    """ a sqlite url opened read only (relative paths are relative to the app, like flask_sqlalchemy does) """
+    url = make_url(url)
+    if not url.drivername.startswith('sqlite'):
+        return url
+    path = url.database[len('file:'):] if url.database.startswith('file:') else url.database
+    if not os.path.isabs(path):
+        path = os.path.join(root_path, path)
+    return url.set(database=f"file:{path}", query=dict(url.query, mode='ro', uri='true'))
+
+
+_stats_lock = Lock()
+_stats = {"connects": 0, "checkouts": 0, "invalidated": 0, "replica_statements": 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def sticky_keys():
+    """ the cache keys that send the current client's reads to the primary after a write: its user's, and its
+        ip's for the reads that come without a token (i.e. GET /get-shopping-cart)
+    """
+    keys = []
+    principal = g.get('principal')
+    if principal is not None:
+        keys.append(f"{STICKY_PREFIX}{principal.id}")
+    if request.remote_addr:
+        keys.append(f"{STICKY_PREFIX}ip:{request.remote_addr}")
+    return keys
+
+
+def reads_from_replica():
+    """ whether the current request's reads can go to a replica: it's a GET/HEAD, it hasn't written anything
+        itself, and its user (its ip, without a token) hasn't committed a write in the last DB_STICKY_SECONDS
+    """
+    if not has_request_context() or request.method not in READ_METHODS or g.get('db_wrote'):
+        return False
+    keys = sticky_keys()
+    if not keys:
+        return True
+    # the user's key if there's a token, otherwise the ip's
+    key = keys[0]
+    # looked up once per request, again if the token's user turns up after a read keyed on the ip
+    if g.get('db_sticky_key') != key:
+        g.db_sticky_key, g.db_sticky = key, bool(cache.get(key))
+    return not g.db_sticky
+
+
+class RoutingSession(SignallingSession):
+    """ flask_sqlalchemy's session, sending the reads of GET requests to the replicas (when there are any).
+        flushes always go to the primary
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and reads_from_replica():
+            replica = self.db.replica_engine(self.app)
+            if replica is not None:
+                _count("replica_statements")
+                return replica
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_written(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _stick_to_primary(session):
+    # the client's next reads go to the primary until the replicas have surely caught up with this commit
+    if not has_request_context() or request.method in READ_METHODS:
+        return
+    if current_app.config.get('SQLALCHEMY_REPLICA_URLS'):
+        for key in sticky_keys():
+            cache.set(key, 1, timeout=current_app.config['DB_STICKY_SECONDS'])
+
+
+class OverridableRegistry:
+    """ the scoped_session's registry, unless session_override is set. has/set/clear only ever see the
+        scoped sessions: an overriding session belongs to whoever set it, db.session.remove() doesn't close it
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __call__(self):
+        session = session_override.get()
+        return session if session is not None else self.registry()
+
+    def has(self):
+        return self.registry.has()
+
+    def set(self, obj):
+        self.registry.set(obj)
+
+    def clear(self):
+        self.registry.clear()
+
+
+def instrument_engine(engine, pragmas=None):
+    """ runs the sqlite PRAGMAs on every new connection of the engine and counts connects/checkouts """
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        _count("connects")
+        if pragmas:
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        _count("checkouts")
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        _count("invalidated")
+
+    return engine
+
+
+def engine_pragmas(app, url):
+    """ the PRAGMAs for a new engine on `url` (none if it isn't sqlite) """
+    url = make_url(url)
+    if not url.drivername.startswith('sqlite'):
+        return None
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if url.query.get('mode') == 'ro':
+        # a read-only connection can't change the journal mode (WAL is kept in the file anyway)
+        pragmas = {name: value for name, value in pragmas.items() if name != 'journal_mode'}
+    return pragmas
+
+
+class Database(SQLAlchemy):
+    """ flask_sqlalchemy's SQLAlchemy, plus the profile's PRAGMAs and the pool counters on every engine it makes,
+        and the replica engines RoutingSession reads from
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._replicas_lock = Lock()
+        self._next_replica = count()
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_scoped_session(self, options=None):
+        scoped = super().create_scoped_session(options)
+        scoped.registry = OverridableRegistry(scoped.registry)
+        return scoped
+
+    def replica_engines(self, app):
+        """ the app's replica engines, created the first time they're needed """
+        engines = app.extensions.get('db_replicas')
+        if engines is None:
+            with self._replicas_lock:
+                engines = app.extensions.get('db_replicas')
+                if engines is None:
+                    options = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+                    engines = [self.create_engine(read_only_url(url, app.root_path), dict(options))
+                               for url in app.config.get('SQLALCHEMY_REPLICA_URLS', ())]
+                    app.extensions['db_replicas'] = engines
+        return engines
+
+    def replica_engine(self, app):
+        """ the next replica, round robin. None if there are none """
+        engines = self.replica_engines(app)
+        if not engines:
+            return None
+        return engines[next(self._next_replica) % len(engines)]
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        return instrument_engine(engine, engine_pragmas(self.get_app(), engine.url))
+
+
+def pool_state(engine):
+    """ the state of one engine's pool """
+    pool = engine.pool
+    state = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        state.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow())
+    return state
+
+
+def pool_stats(engine, replicas=()):
+    """ a snapshot of the engines' pools and this process' connection counters (all engines together) """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(pool_state(engine))
+    # connections opened per checkout, 1.0 means nothing is reused
+    stats["connects_per_checkout"] = round(stats["connects"] / stats["checkouts"], 4) if stats["checkouts"] else 0.0
+    stats["replicas"] = [dict(pool_state(replica), url=replica.url.render_as_string(hide_password=True))
+                         for replica in replicas]
+    return stats
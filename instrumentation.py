@@ -0,0 +1,182 @@
+"""
+    per-request SQL instrumentation.
+
+    every statement sent to the db during a request is counted and timed on `g` (before/after_cursor_execute).
+    each response gets a Server-Timing header with the request's db time, statement count and total time,
+    so the browser dev tools show them, and the numbers are added up per endpoint for GET /metrics:
+    requests, statements, db time, the slowest statement seen and histograms of request and db time.
+
+    when the app is in testing mode a request that runs more than SQL_STATEMENT_LIMIT statements fails with
+    TooManyQueries, so an N+1 (one lazy load per row of a list) gets caught by whoever runs the tests instead
+    of in production. a route that legitimately needs more can raise its own budget with @max_statements(n).
+    statements the view isn't answerable for (the token denylist's periodic reload, an attempt that @atomic
+    rolled back and retried) are left out of the budget with uncount_since, they still show everywhere else.
+"""
+from bisect import bisect_left
+from threading import Lock
+import time
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_STATEMENT_LIMIT = 10
+
+# histogram bucket upper bounds, in milliseconds (the last bucket is everything above)
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# slowest statements are kept up to this many characters
+MAX_STATEMENT_LENGTH = 500
+
+
+class TooManyQueries(Exception):
+    pass
+
+
+def max_statements(limit):
+    """ overrides SQL_STATEMENT_LIMIT for one view """
+    def decorator(f):
+        f.max_statements = limit
+        return f
+    return decorator
+
+
+def statements_so_far():
+    """ how many statements the current request has run """
+    return g.get('sql_statements', 0) if has_request_context() else 0
+
+
+def uncount_since(start):
+    """ the statements run since `start` (what statements_so_far() said) don't count against the view's budget """
+    if has_request_context():
+        g.sql_uncounted = g.get('sql_uncounted', 0) + statements_so_far() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        if context is not None:
+            context._instrumentation_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_instrumentation_started', None)
+    if started is None or not has_request_context():
+        return
+    elapsed = time.perf_counter() - started
+    g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+    if elapsed > g.get('sql_slowest', (0.0, None))[0]:
+        g.sql_slowest = (elapsed, statement)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def observe(self, ms):
+        self.counts[bisect_left(self.buckets, ms)] += 1
+
+    def as_list(self):
+        # a list, not a dict: jsonify sorts keys, which would shuffle the buckets
+        labels = [f"<={bound}ms" for bound in self.buckets] + [f">{self.buckets[-1]}ms"]
+        return [{"bucket": label, "count": n} for label, n in zip(labels, self.counts)]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.total_seconds = 0.0
+        self.slowest = (0.0, None)
+        self.request_ms = Histogram()
+        self.db_ms = Histogram()
+
+    def record(self, statements, db_seconds, total_seconds, slowest):
+        self.requests += 1
+        self.statements += statements
+        self.db_seconds += db_seconds
+        self.total_seconds += total_seconds
+        if slowest[0] > self.slowest[0]:
+            self.slowest = (slowest[0], slowest[1][:MAX_STATEMENT_LENGTH])
+        self.request_ms.observe(total_seconds * 1000)
+        self.db_ms.observe(db_seconds * 1000)
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "statements": self.statements,
+            "statements_per_request": round(self.statements / self.requests, 2),
+            "db_ms_total": round(self.db_seconds * 1000, 3),
+            "db_ms_mean": round(self.db_seconds * 1000 / self.requests, 3),
+            "request_ms_mean": round(self.total_seconds * 1000 / self.requests, 3),
+            "slowest_statement": {"ms": round(self.slowest[0] * 1000, 3), "sql": self.slowest[1]},
+            "request_ms_histogram": self.request_ms.as_list(),
+            "db_ms_histogram": self.db_ms.as_list(),
+        }
+
+
+_metrics_lock = Lock()
+_endpoints = {}
+
+
+def record_request(endpoint, statements, db_seconds, total_seconds, slowest):
+    with _metrics_lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = EndpointStats()
+        stats.record(statements, db_seconds, total_seconds, slowest)
+
+
+def metrics():
+    """ a snapshot of the per-endpoint request/SQL stats of this process """
+    with _metrics_lock:
+        return {endpoint: stats.as_dict() for endpoint, stats in sorted(_endpoints.items())}
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _endpoints.clear()
+
+
+def server_timing(statements, db_seconds, total_seconds):
+    return (f'db;dur={db_seconds * 1000:.2f};desc="{statements} statements", '
+            f'app;dur={total_seconds * 1000:.2f}')
+
+
+def init_app(app):
+    app.config.setdefault('SQL_STATEMENT_LIMIT', DEFAULT_STATEMENT_LIMIT)
+    app.config.setdefault('SERVER_TIMING', True)
+
+    @app.before_request
+    def reset_statement_count():
+        # anything that ran before this (i.e. before_first_request checks) isn't the view's fault
+        g.sql_statements = 0
+        g.sql_uncounted = 0
+        g.sql_seconds = 0.0
+        g.sql_slowest = (0.0, None)
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def check_statement_count(response):
+        if not app.testing:
+            return response
+        view = app.view_functions.get(request.endpoint)
+        limit = getattr(view, 'max_statements', app.config['SQL_STATEMENT_LIMIT'])
+        count = g.get('sql_statements', 0) - g.get('sql_uncounted', 0)
+        if limit and count > limit:
+            raise TooManyQueries(f"{request.method} {request.path} ran {count} SQL statements (limit is {limit})")
+        return response
+
+    @app.after_request
+    def record_timing(response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        statements, db_seconds = g.get('sql_statements', 0), g.get('sql_seconds', 0.0)
+        record_request(request.endpoint or '<unmatched>', statements, db_seconds, total, g.get('sql_slowest', (0.0, None)))
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(statements, db_seconds, total)
+        return response
@@ -0,0 +1,143 @@
+"""
+    write-through invalidation for the response cache.
+
+    every flush records the cache tags touched by the Book/Author/wishlist/cart rows it wrote, and once the
+    transaction commits only the responses carrying those tags are evicted. a rollback throws the
+    pending tags away, so nothing is evicted for writes that never happened.
+
+    tags used by the cached views:
+        book:<id>           any response that includes that book
+        author:<id>         author details and the author's book list
+        author-books:<id>   only the author's book list
+        authors:list        GET /authors
+        books:tail          the last page of GET /books (new books land there when paging by id)
+        books:order:isbn    GET /books pages ordered by isbn (new books/isbns can land on any of them)
+        books:search        GET /books/search results (any book or author name change can change them)
+        books:top-sellers   GET /books/top-sellers (new books and copies_sold changes can reorder it)
+        genre:<genre>       GET /books/genre/<genre> pages (books added to the genre can land on any of them)
+        books:rated         GET /books?min_rating= pages (any rating can move a book in or out of them)
+        ratings:<book id>   a book's ratings
+        comments:<book id>  a book's comments
+        wishlist:<id>       a wishlist view
+        cart:<id>           a shopping cart view
+"""
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .cache import invalidate_tags
+from .models import Book, Author, Wishlist, ShoppingCart, WishlistItem, CartItem, Rating, Comment
+
+PENDING_TAGS = 'pending_cache_tags'
+
+
+def _values(obj, attr):
+    """ the current value of a column plus any value it had before this flush """
+    history = inspect(obj).attrs[attr].history
+    values = set(history.deleted or ())
+    values.add(getattr(obj, attr))
+    values.discard(None)
+    return values
+
+
+def book_tags(book, created=False):
+    tags = {f"book:{book.id}", "books:search"}
+    tags.update(f"author-books:{id}" for id in _values(book, 'author_id'))
+    attrs = inspect(book).attrs
+    if created:
+        tags.update(("books:tail", "books:order:isbn", "books:top-sellers"))
+    else:
+        if attrs.isbn.history.has_changes():
+            tags.add("books:order:isbn")
+        if attrs.copies_sold.history.has_changes():
+            tags.add("books:top-sellers")
+    if created or attrs.genre.history.has_changes():
+        tags.update(f"genre:{genre}" for genre in _values(book, 'genre'))
+    return tags
+
+
+def author_tags(author, created=False):
+    tags = {f"author:{author.id}", "authors:list"}
+    if not created:
+        tags.add("books:search")
+    return tags
+
+
+# views already carry book:<id> for every book they show, so a wishlist/cart only
+# needs evicting when books are added to it or removed from it
+def wishlist_tags(wishlist, created=False):
+    return {f"wishlist:{wishlist.id}"}
+
+
+def cart_tags(cart, created=False):
+    return {f"cart:{cart.id}"}
+
+
+def wishlist_item_tags(item, created=False):
+    return {f"wishlist:{item.wishlist_id}"}
+
+
+def cart_item_tags(item, created=False):
+    return {f"cart:{item.cart_id}"}
+
+
+# add_rating updates the book's rating_count/rating_sum with a Core UPDATE the session doesn't track,
+# so the rating itself evicts the book
+def rating_tags(rating, created=False):
+    return {f"book:{rating.book_id}", f"ratings:{rating.book_id}", "books:rated"}
+
+
+def comment_tags(comment, created=False):
+    return {f"comments:{comment.book_id}"}
+
+
+_TAGGERS = {
+    Book: book_tags,
+    Author: author_tags,
+    Wishlist: wishlist_tags,
+    ShoppingCart: cart_tags,
+    WishlistItem: wishlist_item_tags,
+    CartItem: cart_item_tags,
+    Rating: rating_tags,
+    Comment: comment_tags,
+}
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_tags(session, flush_context):
+    pending = session.info.setdefault(PENDING_TAGS, set())
+    for obj in session.new:
+        if type(obj) in _TAGGERS:
+            pending.update(_TAGGERS[type(obj)](obj, created=True))
+    for obj in session.dirty:
+        # collections only matter for books appended to/removed from Wishlist.books and ShoppingCart.books
+        collections = type(obj) in (Wishlist, ShoppingCart)
+        if type(obj) in _TAGGERS and session.is_modified(obj, include_collections=collections):
+            pending.update(_TAGGERS[type(obj)](obj))
+    for obj in session.deleted:
+        if type(obj) in _TAGGERS:
+            pending.update(_TAGGERS[type(obj)](obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def evict_tags(session):
+    invalidate_tags(*session.info.pop(PENDING_TAGS, ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_tags(session):
+    session.info.pop(PENDING_TAGS, None)
+
+
+def invalidate_new_books(author_ids, genres=()):
+    """ evicts what a bulk insert of new books makes stale. bulk_insert_mappings/Core inserts don't go
+        through the unit of work, so collect_tags never sees them and callers have to do this themselves
+    """
+    invalidate_tags("books:tail", "books:order:isbn", "books:search", "books:top-sellers",
+                    *(f"author-books:{id}" for id in author_ids), *(f"genre:{genre}" for genre in genres))
+
+
+def evict_on_commit(session, *tags):
+    """ evicts `tags` once the session's transaction commits (nothing if it rolls back), for writes made
+        with Core statements that collect_tags can't see
+    """
+    session.info.setdefault(PENDING_TAGS, set()).update(tags)
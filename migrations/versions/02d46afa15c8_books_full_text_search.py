@@ -0,0 +1,54 @@
+"""books full text search
+
+Revision ID: 02d46afa15c8
+Revises: b644475c5e83
+Create Date: 2026-10-18 13:22:36.119128
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '02d46afa15c8'
+down_revision = 'b644475c5e83'
+branch_labels = None
+depends_on = None
+
+
+# a copy of search.FTS_DDL as it was when this revision was written (FTS5 tables and triggers aren't
+# something autogenerate knows about)
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, description, genre, publisher, author, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+
+    "INSERT INTO books_fts(books_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 2.0, 2.0, 5.0)')",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN INSERT INTO books_fts(rowid, title, description, genre, publisher, author) VALUES (new.id, new.title, new.description, new.genre, new.publisher, (SELECT trim(coalesce(authors.first_name, '') || ' ' || coalesce(authors.last_name, '')) FROM authors WHERE authors.id = new.author_id)); END",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, description, genre, publisher, author_id ON books BEGIN UPDATE books_fts SET title = new.title, description = new.description, genre = new.genre, publisher = new.publisher, author = (SELECT trim(coalesce(authors.first_name, '') || ' ' || coalesce(authors.last_name, '')) FROM authors WHERE authors.id = new.author_id) WHERE rowid = new.id; END",
+
+    'CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN DELETE FROM books_fts WHERE rowid = old.id; END',
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_author_update AFTER UPDATE OF first_name, last_name ON authors BEGIN UPDATE books_fts SET author = trim(coalesce(new.first_name, '') || ' ' || coalesce(new.last_name, '')) WHERE rowid IN (SELECT id FROM books WHERE author_id = new.id); END",
+
+    'CREATE TRIGGER IF NOT EXISTS books_fts_author_delete AFTER DELETE ON authors BEGIN UPDATE books_fts SET author = NULL WHERE rowid IN (SELECT id FROM books WHERE author_id = old.id); END',
+]
+
+FTS_BACKFILL = "INSERT INTO books_fts(rowid, title, description, genre, publisher, author) SELECT books.id, books.title, books.description, books.genre, books.publisher, trim(coalesce(authors.first_name, '') || ' ' || coalesce(authors.last_name, '')) FROM books LEFT JOIN authors ON authors.id = books.author_id"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for statement in FTS_DDL:
+        op.execute(statement)
+    op.execute(FTS_BACKFILL)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('books_fts_insert', 'books_fts_update', 'books_fts_delete',
+                    'books_fts_author_update', 'books_fts_author_delete'):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS books_fts")
@@ -0,0 +1,35 @@
+"""unique rating per user and book
+
+Revision ID: 8d2e61b0f4a7
+Revises: 3f75334b2728
+Create Date: 2026-10-18 17:21:05.734120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e61b0f4a7'
+down_revision = '3f75334b2728'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # two first ratings at once could both insert before: keep each user's latest one and recount the books
+    op.execute(
+        "DELETE FROM ratings WHERE id NOT IN (SELECT max(id) FROM ratings GROUP BY book_id, user_id)"
+    )
+    op.execute(
+        "UPDATE books SET "
+        "rating_count = (SELECT count(rating) FROM ratings WHERE ratings.book_id = books.id), "
+        "rating_sum = (SELECT coalesce(sum(rating), 0) FROM ratings WHERE ratings.book_id = books.id)"
+    )
+    op.drop_index('ix_ratings_book_id_user_id', table_name='ratings')
+    op.create_index('ix_ratings_book_id_user_id', 'ratings', ['book_id', 'user_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_ratings_book_id_user_id', table_name='ratings')
+    op.create_index('ix_ratings_book_id_user_id', 'ratings', ['book_id', 'user_id'], unique=False)
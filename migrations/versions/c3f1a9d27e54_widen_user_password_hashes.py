@@ -0,0 +1,33 @@
+"""widen users.password for scrypt hashes
+
+Revision ID: c3f1a9d27e54
+Revises: 75744ff62e97
+Create Date: 2026-10-18 16:02:11.418530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d27e54'
+down_revision = '75744ff62e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # "scrypt:N:r:p$salt$hash" is ~160 characters (sqlite doesn't care, postgresql does)
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=50),
+               type_=sa.String(length=255),
+               existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=50),
+               existing_nullable=True)
@@ -2,23 +2,30 @@ from collections import UserList
 from csv import unregister_dialect
 from dataclasses import fields
 from flask_sqlalchemy import SQLAlchemy
-from datetime import  date
+from datetime import  date, datetime
+import time
 from flask_marshmallow import Marshmallow
 from marshmallow import ValidationError, validates, RAISE, fields, pprint
 from pyparsing import dblSlashComment
 from sqlalchemy import PrimaryKeyConstraint, false
+from .serializers import RowSerializer
+from .database import Database
 
 
 
-db = SQLAlchemy()
+db = Database()  # flask_sqlalchemy + the DB_PROFILE engine tuning, see database.py
 ma = Marshmallow()
 
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        # GET /books/genre/<genre> pages through one genre in id order
+        db.Index('ix_books_genre_id', 'genre', 'id'),
+    )
     
     id              = db.Column(db.Integer,     primary_key=True, unique=True)
-    author_id       = db.Column(db.Integer,     db.ForeignKey('authors.id'), nullable=True)
+    author_id       = db.Column(db.Integer,     db.ForeignKey('authors.id'), nullable=True, index=True)
     price           = db.Column(db.Integer,     default=25)
     copies_sold     = db.Column(db.Integer,     default=0)
     date_published  = db.Column(db.Date(),      nullable=True)
@@ -27,38 +34,58 @@ class Book(db.Model):
     description     = db.Column(db.String(250), nullable=True)
     title           = db.Column(db.String(100), nullable=True)
     publisher       = db.Column(db.String(100), nullable=True)
-    wishlists       = db.Column(db.Integer,     db.ForeignKey('wishlists.id'), nullable=True)
-    shoppingCarts   = db.Column(db.Integer,     db.ForeignKey('shoppingCarts.id'), nullable=True)
-    ratings         = db.relationship('Rating', backref='book')
-    comments        = db.relationship('Comment', backref='book')
-
-    # helper function to format date for as_dict function
-    def set_value(self, name):
-        val = getattr(self, name)
-        if type(val) is date:
-            return val.isoformat()
-        return val
+    # running totals of ratings.rating for this book, kept by add_rating so the average needs no AVG() query
+    rating_count    = db.Column(db.Integer,     nullable=False, default=0, server_default='0')
+    rating_sum      = db.Column(db.Integer,     nullable=False, default=0, server_default='0')
+    # bumped by every UPDATE (version_id_col), used for ETags. updated_at is for Last-Modified
+    version         = db.Column(db.Integer,     nullable=False, default=1, server_default='1')
+    updated_at      = db.Column(db.DateTime,    nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # a book's ratings and comments go with it (book_id can't be NULL)
+    ratings         = db.relationship('Rating', backref='book', cascade='all, delete-orphan')
+    comments        = db.relationship('Comment', backref='book', cascade='all, delete-orphan')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def as_dict(self):
-        return {c.name: self.set_value(c.name) for c in self.__table__.columns if c.name not in ['wishlists', 'shoppingCarts']}
+        return book_serializer.dump(self)
+
+    @staticmethod
+    def average_rating(rating_count, rating_sum):
+        return round(rating_sum / rating_count, 2) if rating_count else None
 
     def __repr__(self) -> str:
-        return f"{self.title} by {str.title(self.author.last_name)}, {str.title(self.author.first_name)} (ISBN: {self.isbn})"
+        # only use the author if it's already loaded, printing a list of books shouldn't run a query per book
+        author = self.__dict__.get('author')
+        if author is None:
+            return f"{self.title} by author #{self.author_id} (ISBN: {self.isbn})"
+        return f"{self.title} by {str.title(author.last_name or '')}, {str.title(author.first_name or '')} (ISBN: {self.isbn})"
     
+# the top sellers ranking (copies_sold desc, ties by id) is read straight off this index, no sort
+db.Index('ix_books_copies_sold_id', Book.copies_sold.desc(), Book.id)
+
+
 class Author(db.Model):
     __tablename__ = 'authors'
+    __table_args__ = (
+        # update_author/delete_author look authors up by full name
+        db.Index('ix_authors_first_name_last_name', 'first_name', 'last_name'),
+    )
     
     id              = db.Column(db.Integer, primary_key=True, unique=True)
     first_name      = db.Column(db.String(50), nullable=True)
     last_name       = db.Column(db.String(50), nullable=True)
     publisher       = db.Column(db.String(50), nullable=True)
     bio             = db.Column(db.String(500), nullable=True)
+    version         = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at      = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
     books           = db.relationship('Book', backref='author')
+
+    __mapper_args__ = {'version_id_col': version}
     
 
     
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return author_serializer.dump(self)
     
     def __repr__(self):
         return f"{self.first_name} {self.last_name}. Bio: {self.bio}"
@@ -68,12 +95,26 @@ class Wishlist(db.Model):
     __tablename__ = 'wishlists'
 
     id                  = db.Column(db.Integer, primary_key=True, unique=True)
-    user_id             = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True)
-    books               = db.relationship('Book', backref='wishlist')
+    # one wishlist per user, like shoppingCarts.user_id
+    user_id             = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True, index=True, unique=True)
+    books               = db.relationship('Book', secondary='wishlist_items', backref='wishlists', order_by='WishlistItem.added_at')
     
     
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return wishlist_serializer.dump(self)
+
+    # books in the wishlist as dicts, oldest first. one query, no Book objects created
+    def books_as_dicts(self):
+        return Wishlist.wishlist_books(self.id)
+
+    # same as books_as_dicts, for a wishlist that's only known by its id
+    @staticmethod
+    def wishlist_books(wishlist_id):
+        stmt = (book_serializer.select()
+                .join(WishlistItem, WishlistItem.book_id == Book.id)
+                .where(WishlistItem.wishlist_id == wishlist_id)
+                .order_by(WishlistItem.added_at))
+        return book_serializer.dump_rows(db.session.execute(stmt))
     
     def __repr__(self) -> str:
             return f"id: {self.id}, user_id: {self.user_id}"
@@ -82,20 +123,75 @@ class ShoppingCart(db.Model):
     __tablename__ = 'shoppingCarts'
     
     id                  = db.Column(db.Integer, primary_key=True, unique=True)
-    user_id             = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True)
-    books               = db.relationship('Book', backref='shoppingcart')
+    # one cart per user: carts.py creates it with INSERT .. ON CONFLICT DO NOTHING, which needs the unique index
+    user_id             = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True, index=True, unique=True)
+    # bumped by every change to the cart's items (carts.touch_cart), so two requests changing the same
+    # cart at once can't both win: the second one gets a StaleDataError and is retried
+    version             = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    books               = db.relationship('Book', secondary='cart_items', backref='shoppingCarts', order_by='CartItem.added_at')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return shopping_cart_serializer.dump(self)
+
+    # adds a book to the cart, or bumps its quantity if it's already in there
+    def add_book(self, book, quantity=1):
+        item = CartItem.query.get((self.id, book.id)) if self.id else None
+        if item is None:
+            db.session.add(CartItem(cart=self, book=book, quantity=quantity))
+        else:
+            item.quantity += quantity
+
+    # books in the cart as dicts, with how many of each. one query, no Book objects created
+    def books_as_dicts(self):
+        return ShoppingCart.cart_books(self.id)
+
+    # same as books_as_dicts, for a cart that's only known by its id
+    @staticmethod
+    def cart_books(cart_id):
+        stmt = (book_serializer.select().add_columns(CartItem.quantity)
+                .join(CartItem, CartItem.book_id == Book.id)
+                .where(CartItem.cart_id == cart_id)
+                .order_by(CartItem.added_at))
+        return [dict(book_serializer.dump_row(row), quantity=row.quantity) for row in db.session.execute(stmt)]
     
     def __repr__(self) -> str:
         return f"id: {self.id}, user_id: {self.user_id}"
     
+class WishlistItem(db.Model):
+    __tablename__ = 'wishlist_items'
+
+    # primary key starts with wishlist_id, so reading a wishlist is a range scan of its own rows
+    wishlist_id         = db.Column(db.Integer, db.ForeignKey('wishlists.id'), primary_key=True)
+    book_id             = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True, index=True)
+    quantity            = db.Column(db.Integer, nullable=False, default=1)
+    added_at            = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def as_dict(self):
+        return wishlist_item_serializer.dump(self)
+
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+
+    cart_id             = db.Column(db.Integer, db.ForeignKey('shoppingCarts.id'), primary_key=True)
+    book_id             = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True, index=True)
+    quantity            = db.Column(db.Integer, nullable=False, default=1)
+    added_at            = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # ShoppingCart.books writes these rows, these two are only for reading/creating items directly
+    cart                = db.relationship('ShoppingCart', overlaps='books,shoppingCarts')
+    book                = db.relationship('Book', overlaps='books,shoppingCarts')
+
+    def as_dict(self):
+        return cart_item_serializer.dump(self)
+
+
 class User(db.Model):
     __tablename__ = 'users'
     
     id                  = db.Column(db.Integer, primary_key=True, unique=True)
-    username            = db.Column(db.String(50), nullable=True)
+    username            = db.Column(db.String(50), nullable=True, unique=True, index=True)
     first_name          = db.Column(db.String(50), nullable=True)
     last_name           = db.Column(db.String(50), nullable=True)
     isAdmin             = db.Column(db.Boolean, default=False)
@@ -105,14 +201,17 @@ class User(db.Model):
     ratings             = db.relationship('Rating', backref='user')
     # emailAddress        = db.Column(db.String(50), nullable=True)
     homeAddress         = db.Column(db.String(100), nullable=True)
-    password            = db.Column(db.String(50), nullable=True)
+    password            = db.Column(db.String(255), nullable=True)
+    # in every token the user gets, bumped (see auth.py) to revoke all of them. starts at the time the user
+    # was created, like auth.next_token_version
+    token_version       = db.Column(db.Integer, nullable=False, default=lambda: int(time.time()), server_default='0')
     credit_card          = db.relationship('CreditCard', backref='user')
 
 
 
 
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return user_serializer.dump(self)
     
 
     def __repr__(self):
@@ -123,36 +222,94 @@ class CreditCard(db.Model):
     __tablename__ = 'creditCards'
     
     id                 = db.Column(db.Integer, primary_key=True, unique=True)
-    user_id            = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True)
+    user_id            = db.Column(db.Integer,db.ForeignKey('users.id'), nullable=True, index=True)
     credit_card         = db.Column(db.String(50), nullable=True) 
 
 class Rating(db.Model):
     __tablename__ ='ratings'
+    __table_args__ = (
+        # a book's ratings, and "has this user rated this book". unique: one rating per user and book
+        db.Index('ix_ratings_book_id_user_id', 'book_id', 'user_id', unique=True),
+    )
     
     id              = db.Column(db.Integer, primary_key=True, unique=True)
     book_id         = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
-    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     rating          = db.Column(db.Integer)
     
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return rating_serializer.dump(self)
     
 class Comment(db.Model):
     __tablename__ = 'comments'
     
     id              = db.Column(db.Integer, primary_key=True, unique=True)
-    book_id         = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
-    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    book_id         = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
+    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     comment_text    = db.Column(db.String(200))
     
     def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return comment_serializer.dump(self)
 
 
     def __repr__(self):
         return f"id:{self.id}, book_id:{self.book_id}, user_id:{self.user_id}, comment_text:{self.comment_text}"
 
 
+class CollectionVersion(db.Model):
+    """ a version counter per list resource ('books', 'authors'), bumped by conditional.py whenever
+        anything in the list changes. list ETags are made from it
+    """
+    __tablename__ = 'collection_versions'
+
+    name            = db.Column(db.String(50), primary_key=True)
+    version         = db.Column(db.Integer, nullable=False, default=0)
+    updated_at      = db.Column(db.DateTime, nullable=True)
+
+
+class IdempotencyKey(db.Model):
+    """ the stored response of a write sent with an Idempotency-Key header (see transactions.py),
+        written in the same transaction as the write itself
+    """
+    __tablename__ = 'idempotency_keys'
+
+    user_id         = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    key             = db.Column(db.String(100), primary_key=True)
+    # hash of the method, path and body the key was first used with
+    fingerprint     = db.Column(db.String(64), nullable=False)
+    status_code     = db.Column(db.Integer, nullable=False)
+    mimetype        = db.Column(db.String(100), nullable=True)
+    body            = db.Column(db.Text, nullable=True)
+    created_at      = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TokenRevocation(db.Model):
+    """ the token denylist (see auth.py): a user's tokens older than `version`, or the one token `jti`.
+        every worker reloads all the rows that haven't expired every TOKEN_DENYLIST_SYNC seconds. rows are
+        deleted once every token they revoke has expired, so the table stays small
+    """
+    __tablename__ = 'token_revocations'
+
+    id              = db.Column(db.Integer, primary_key=True)
+    user_id         = db.Column(db.Integer, nullable=False)
+    version         = db.Column(db.Integer, nullable=True)
+    # unique: two requests refreshing with the same token can't both get new ones
+    jti             = db.Column(db.String(32), nullable=True, unique=True)
+    expires_at      = db.Column(db.Integer, nullable=False, index=True)
+
+
+# column plans for as_dict(), built once instead of walking __table__.columns for every row
+book_serializer             = RowSerializer(Book)
+author_serializer           = RowSerializer(Author)
+wishlist_serializer         = RowSerializer(Wishlist)
+shopping_cart_serializer    = RowSerializer(ShoppingCart)
+wishlist_item_serializer    = RowSerializer(WishlistItem)
+cart_item_serializer        = RowSerializer(CartItem)
+user_serializer             = RowSerializer(User)
+rating_serializer           = RowSerializer(Rating)
+comment_serializer          = RowSerializer(Comment)
+
+
 """
     the class below are Marshmallow schema classes for the sqlalchemy classes above.
     i use them for validation but can also be used for (de)serializing the ORM objects
@@ -165,6 +322,8 @@ class BookSchema(ma.SQLAlchemyAutoSchema):
         include_fk = True
         dateformat = '%Y-%m-%d'
         unknown = RAISE
+        # only ever changed by rating a book / by the db
+        dump_only = ('rating_count', 'rating_sum', 'version', 'updated_at')
     
     @validates('isbn')
     def validate_isbn(self, val):
@@ -183,6 +342,7 @@ class AuthorSchema(ma.SQLAlchemyAutoSchema):
         model = Author
         include_relationships = True
         include_fk = True
+        dump_only = ('version', 'updated_at')
 
     books = fields.Nested(BookSchema, many=True)
 
@@ -0,0 +1,117 @@
+"""
+    helpers for keyset (cursor) pagination and NDJSON streaming.
+
+    keyset pagination filters on the last value seen (`WHERE id > :after ORDER BY id LIMIT :limit`)
+    instead of using OFFSET, so every page is an index range scan no matter how deep into
+    the table the client is. cursors are opaque to clients: they are urlsafe base64 of a small
+    json object holding the sort key and the last value of the previous page.
+"""
+import base64
+import json
+
+from flask import Response, stream_with_context
+
+from .serializers import dumps
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# number of rows fetched from the db cursor (and written to the client) at a time when streaming
+STREAM_BATCH_SIZE = 1000
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def encode_cursor(sort_key, value):
+    raw = json.dumps({"k": sort_key, "v": value}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ returns (sort_key, value) for a cursor made by encode_cursor. raises ValueError if it's malformed """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return data['k'], data['v']
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _valid_cursor_value(value, python_type):
+    if type(value) is bool or not isinstance(value, python_type):
+        return False
+    # sqlite integers are 64 bit, a bigger one can't even be bound to the query
+    return python_type is not int or -2 ** 63 <= value < 2 ** 63
+
+
+def parse_page_args(args, sort_columns, default_sort='id'):
+    """ reads `limit`, `order_by` and `after` from the request args.
+        sort_columns maps the allowed `order_by` values to the (unique) column to paginate on.
+        returns (limit, sort_key, after_value). raises ValueError on bad input
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError(f"limit must be an integer, got: {args.get('limit')}")
+    if limit < 1:
+        raise ValueError("limit must be greater than 0")
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    sort_key = args.get('order_by', default_sort)
+    if sort_key not in sort_columns:
+        raise ValueError(f"order_by must be one of: {', '.join(sort_columns)}")
+
+    after = None
+    if args.get('after'):
+        cursor_key, after = decode_cursor(args['after'])
+        # a cursor is only valid for the ordering it was created with
+        if cursor_key != sort_key:
+            raise ValueError(f"cursor was created for order_by={cursor_key}, not order_by={sort_key}")
+        # and the value has to be something the column can be compared to (a cursor can be made up by hand)
+        column = sort_columns[sort_key]
+        if column is not None and not _valid_cursor_value(after, column.type.python_type):
+            raise ValueError(f"Invalid cursor: {args['after']}")
+
+    return limit, sort_key, after
+
+
+def keyset_page(query, column, sort_key, limit, after=None, session=None):
+    """ returns (rows, next_cursor) for one page of `query` ordered by `column`.
+        `query` is an ORM query, or a Core select() run with `session` (rows come back as tuples, not objects).
+        next_cursor is None when there are no more rows.
+    """
+    query = query.filter(column.isnot(None)).order_by(column)
+    if after is not None:
+        query = query.filter(column > after)
+
+    # fetch one extra row to know if there is a next page without a COUNT query
+    query = query.limit(limit + 1)
+    rows = session.execute(query).all() if session is not None else query.all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(sort_key, getattr(rows[-1], column.key))
+
+
+def wants_stream(req):
+    """ True if the client opted in to NDJSON streaming (?stream=true or Accept: application/x-ndjson) """
+    if req.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return req.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(session, statement, serialize, batch_size=STREAM_BATCH_SIZE):
+    """ streams the rows of a Core `statement` as newline delimited json.
+        rows are pulled from the db cursor `batch_size` at a time and never turned into ORM objects,
+        so memory stays flat regardless of how many rows the statement returns.
+    """
+    def generate():
+        result = session.execute(statement.execution_options(stream_results=True))
+        try:
+            for rows in result.partitions(batch_size):
+                yield b''.join(dumps(serialize(row)) + b'\n' for row in rows)
+        finally:
+            result.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,179 @@
+"""
+    password hashing, off the request thread.
+
+    passwords are hashed with scrypt (memory-hard: every hash needs 128 * N * r bytes of memory, 32MB with the
+    defaults, so guessing them on a GPU is expensive too). the cost is tuned with PASSWORD_SCRYPT_N/_R/_P, and the
+    hashes are stored as "scrypt:N:r:p$salt$hash", the same format werkzeug >= 3 writes, so check_password_hash
+    can read them after an upgrade.
+
+    hashing takes ~100ms of cpu on purpose, on the request thread that's 100ms of a worker thread (and of the GIL)
+    per login. so hashes run on a pool of PASSWORD_WORKERS processes (default: one per cpu) and at most
+    PASSWORD_QUEUE_DEPTH more wait for a free one. past that, or after waiting PASSWORD_TIMEOUT seconds,
+    the request fails right away with a 503 and a Retry-After header instead of piling up more work than the
+    cpus can do. PASSWORD_WORKERS=0 hashes on the request thread (no pool).
+
+    old hashes (werkzeug's sha256$ / pbkdf2) still verify, and get rehashed with the current settings on the next
+    successful login, same as hashes made with a lower cost than the current one.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+import hashlib
+import hmac
+import multiprocessing
+import os
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import gen_salt, check_password_hash
+
+METHOD = 'scrypt'
+SALT_LENGTH = 16
+DEFAULTS = {
+    'PASSWORD_SCRYPT_N': 2 ** 15,
+    'PASSWORD_SCRYPT_R': 8,
+    'PASSWORD_SCRYPT_P': 1,
+    'PASSWORD_WORKERS': os.cpu_count() or 1,
+    'PASSWORD_QUEUE_DEPTH': 16,
+    'PASSWORD_TIMEOUT': 10,
+    'PASSWORD_RETRY_AFTER': 1,
+}
+
+
+class PasswordPoolBusy(ServiceUnavailable):
+    description = "too many logins at once, try again in a moment"
+
+
+def password_config_from_env(environ=os.environ):
+    """ the PASSWORD_* config, DEFAULTS overridden by the environment """
+    return {k: int(environ.get(k, v)) for k, v in DEFAULTS.items()}
+
+
+def scrypt_params(config):
+    return config['PASSWORD_SCRYPT_N'], config['PASSWORD_SCRYPT_R'], config['PASSWORD_SCRYPT_P']
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem: hashlib's default (32MB) is exactly what N=2**15, r=8 needs, leave some room
+    return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=132 * n * r * p).hex()
+
+
+def make_hash(password, n, r, p):
+    salt = gen_salt(SALT_LENGTH)
+    return f"{METHOD}:{n}:{r}:{p}${salt}${_scrypt(password, salt, n, r, p)}"
+
+
+def check_hash(password, stored, n, r, p):
+    """ (matches, new hash or None). the new hash is there when `stored` matches but wasn't made with n, r, p """
+    if not stored:
+        return False, None
+    method, _, rest = stored.partition('$')
+    if method.startswith(METHOD + ':'):
+        try:
+            stored_n, stored_r, stored_p = (int(x) for x in method.split(':')[1:])
+            salt, hashed = rest.split('$', 1)
+        except ValueError:
+            return False, None
+        if not hmac.compare_digest(_scrypt(password, salt, stored_n, stored_r, stored_p), hashed):
+            return False, None
+        if (stored_n, stored_r, stored_p) == (n, r, p):
+            return True, None
+    elif not check_password_hash(stored, password):
+        return False, None
+    return True, make_hash(password, n, r, p)
+
+
+class PasswordPool:
+    """ the worker processes, created on the first hash (so each server worker process gets its own) """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = Lock()
+        self._stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0, "timeouts": 0}
+
+    def init_app(self, app):
+        for k, v in password_config_from_env().items():
+            app.config.setdefault(k, v)
+        app.extensions['passwords'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _get_executor(self, config):
+        with self._lock:
+            if self._executor is None:
+                workers = config['PASSWORD_WORKERS']
+                # spawn: forking a process that's running server threads (and db connections) isn't safe
+                self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._slots = BoundedSemaphore(workers + config['PASSWORD_QUEUE_DEPTH'])
+            return self._executor, self._slots
+
+    def run(self, fn, *args):
+        """ runs fn(*args) on a worker process, or raises PasswordPoolBusy if it can't be done soon enough """
+        config = current_app.config
+        if not config['PASSWORD_WORKERS']:
+            return fn(*args)
+        executor, slots = self._get_executor(config)
+        if not slots.acquire(blocking=False):
+            self._count('rejected')
+            raise PasswordPoolBusy(retry_after=config['PASSWORD_RETRY_AFTER'])
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # the slot is taken until the hash is done, even if this request stops waiting for it
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=config['PASSWORD_TIMEOUT'])
+        except TimeoutError:
+            self._count('timeouts')
+            raise PasswordPoolBusy(retry_after=config['PASSWORD_RETRY_AFTER'])
+        except BrokenProcessPool:
+            # a worker died (i.e. killed for memory), start a new pool on the next hash
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise PasswordPoolBusy(retry_after=config['PASSWORD_RETRY_AFTER'])
+
+    def hash(self, password):
+        hashed = self.run(make_hash, password, *scrypt_params(current_app.config))
+        self._count('hashed')
+        return hashed
+
+    def verify(self, password, stored):
+        """ (matches, new hash or None), see check_hash """
+        matches, new_hash = self.run(check_hash, password, stored, *scrypt_params(current_app.config))
+        self._count('verified')
+        if new_hash:
+            self._count('rehashed')
+        return matches, new_hash
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        config = current_app.config
+        stats["workers"] = config['PASSWORD_WORKERS']
+        stats["queue_depth"] = config['PASSWORD_QUEUE_DEPTH']
+        stats["method"] = "{}:{}:{}:{}".format(METHOD, *scrypt_params(config))
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+passwords = PasswordPool()
+
+
+def hash_password(password):
+    return passwords.hash(password)
+
+
+def verify_password(password, stored):
+    return passwords.verify(password, stored)
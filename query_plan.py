@@ -0,0 +1,70 @@
+"""
+    startup check that asks sqlite how it plans to run the queries the route modules depend on,
+    and logs every one that would scan a whole table instead of using an index.
+
+    when you add a route that filters on a new column, add its query to HOT_QUERIES.
+"""
+import logging
+
+from .models import db, Book, Author, User, Wishlist, ShoppingCart, CreditCard, Rating, Comment, WishlistItem, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+# name -> function returning the query (the same filters the routes use, with placeholder values)
+HOT_QUERIES = {
+    'book by isbn':                 lambda: Book.query.filter_by(isbn='0'),
+    'top sellers':                  lambda: Book.query.with_entities(Book.id, Book.copies_sold)
+                                               .order_by(Book.copies_sold.desc(), Book.id).limit(200),
+    'books page by genre':          lambda: Book.query.filter(Book.genre == 'a', Book.id > 0).order_by(Book.id).limit(50),
+    'books page by id':             lambda: Book.query.filter(Book.id > 0).order_by(Book.id).limit(50),
+    'books page by isbn':           lambda: Book.query.filter(Book.isbn > '0').order_by(Book.isbn).limit(50),
+    'books by author':              lambda: Book.query.filter_by(author_id=0),
+    'author by id':                 lambda: Author.query.filter_by(id=0),
+    'author by name':               lambda: Author.query.filter_by(first_name='a', last_name='b'),
+    'user by username':             lambda: User.query.filter_by(username='a'),
+    'user by id':                   lambda: User.query.filter_by(id=0),
+    'wishlist by user':             lambda: Wishlist.query.filter_by(user_id=0),
+    'shopping cart by user':        lambda: ShoppingCart.query.filter_by(user_id=0),
+    'wishlist books':               lambda: Book.query.join(WishlistItem).filter(WishlistItem.wishlist_id == 0),
+    'shopping cart books':          lambda: Book.query.join(CartItem).filter(CartItem.cart_id == 0),
+    'wishlists holding a book':     lambda: WishlistItem.query.filter_by(book_id=0),
+    'carts holding a book':         lambda: CartItem.query.filter_by(book_id=0),
+    'credit cards by user':         lambda: CreditCard.query.filter_by(user_id=0),
+    'ratings by book':              lambda: Rating.query.filter_by(book_id=0),
+    'ratings by user':              lambda: Rating.query.filter_by(user_id=0),
+    'comments by book':             lambda: Comment.query.filter_by(book_id=0),
+    'comments page by book':        lambda: Comment.query.filter(Comment.book_id == 0, Comment.id > 0)
+                                               .order_by(Comment.id).limit(50),
+    'rating by book and user':      lambda: Rating.query.filter_by(book_id=0, user_id=0),
+}
+
+
+def full_scans(query):
+    """ returns the lines of the query plan that scan a table without an index """
+    statement = query.statement if hasattr(query, 'statement') else query
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+    # rows are (id, parent, notused, detail). "SCAN books" is a full scan, "SCAN books USING INDEX ..." isn't
+    return [row[-1] for row in plan if row[-1].startswith('SCAN ') and ' USING ' not in row[-1]]
+
+
+def check_query_plans(queries=HOT_QUERIES):
+    """ logs a warning for every hot query that does a full table scan. returns {name: [scans]} """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+
+    problems = {}
+    for name, make_query in queries.items():
+        try:
+            scans = full_scans(make_query())
+        except Exception as e:
+            # i.e. the tables don't exist yet because `flask db upgrade` hasn't been run
+            logger.warning("could not check query plan for %r: %s", name, e)
+            continue
+        if scans:
+            problems[name] = scans
+            logger.warning("query %r does a full table scan: %s", name, '; '.join(scans))
+    return problems
@@ -0,0 +1,149 @@
+"""
+    in process top sellers ranking, kept up to date as books are written instead of sorting the catalog.
+
+    TopSellers holds the ids of the TOP_SELLERS_SIZE best selling books (best first). it's filled with one
+    scan of the (copies_sold desc, id) index, and after that every commit that creates/deletes a book or
+    changes its copies_sold moves just those books in the list. the list is always an exact prefix of
+    the real ranking: a book that drops below the last entry is removed (we can't know what's between),
+    so the list only shrinks, and it gets refilled from the index when it's shorter than what a request
+    asks for.
+
+    with several workers each has its own list. every change bumps a generation counter in the shared
+    cache, and a worker that sees a generation it didn't apply itself refills its list on the next read.
+"""
+import bisect
+import random
+import threading
+
+from flask import has_app_context
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .cache import cache
+from .models import db, Book
+
+# GET /books/top-sellers serves at most this many books
+MAX_TOP_SELLERS = 100
+
+# the list keeps twice that, so a few books dropping out of it don't force a refill
+TOP_SELLERS_SIZE = 2 * MAX_TOP_SELLERS
+
+GENERATION_KEY = 'top-sellers:generation'
+
+PENDING_CHANGES = 'pending_top_sellers'
+
+
+class TopSellers:
+    def __init__(self, size=TOP_SELLERS_SIZE):
+        self.size = size
+        self.keys = []          # (-copies_sold, id), sorted, so the best seller is first
+        self.copies = {}        # id -> copies_sold of the books in keys
+        self.whole_catalog = False  # the last refill returned every book there is
+        self.generation = None  # shared generation this list is up to date with (None = needs a refill)
+        self.lock = threading.Lock()
+
+    def _refill(self, generation):
+        rows = db.session.execute(
+            select(Book.id, Book.copies_sold)
+            .where(Book.copies_sold.isnot(None))
+            .order_by(Book.copies_sold.desc(), Book.id)
+            .limit(self.size)
+        ).all()
+        self.keys = [(-copies, id) for id, copies in rows]
+        self.copies = {id: copies for id, copies in rows}
+        self.whole_catalog = len(rows) < self.size
+        self.generation = generation
+
+    def top(self, limit):
+        """ ids of the `limit` best selling books, best first """
+        generation = _shared_generation()
+        with self.lock:
+            if generation != self.generation or (len(self.keys) < limit and not self.whole_catalog):
+                self._refill(generation)
+            return [id for _, id in self.keys[:limit]]
+
+    def _move(self, id, copies):
+        if id in self.copies:
+            self.keys.remove((-self.copies.pop(id), id))
+        if copies is None:
+            return
+        key = (-copies, id)
+        # only insert if it's certainly inside the ranking we hold
+        if self.whole_catalog or (self.keys and key < self.keys[-1]):
+            bisect.insort(self.keys, key)
+            self.copies[id] = copies
+            if len(self.keys) > self.size:
+                _, dropped = self.keys.pop()
+                del self.copies[dropped]
+                self.whole_catalog = False
+
+    def apply(self, changes):
+        """ applies committed {book id: copies_sold (None if deleted)} changes """
+        generation = _bump_generation()
+        with self.lock:
+            if generation is None or self.generation is None or generation != self.generation + 1:
+                # somebody else changed the ranking since we last looked, refill on the next read
+                self.generation = None
+                return
+            for id, copies in changes.items():
+                self._move(id, copies)
+            self.generation = generation
+
+    def invalidate(self):
+        """ for writes that don't go through the session (bulk inserts): refill on the next read, everywhere """
+        _bump_generation()
+        with self.lock:
+            self.generation = None
+
+
+def _seed_generation():
+    # start from a random number, so a counter that got evicted can't come back with a value a worker
+    # has already seen (a no-op if it's there)
+    cache.add(GENERATION_KEY, random.getrandbits(48), timeout=0)
+
+
+def _shared_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        _seed_generation()
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _bump_generation():
+    """ the new generation, or None if the counter couldn't be bumped (the caller has to refill then) """
+    try:
+        # inc on a missing key starts at 1, a value another worker may have seen before the counter was evicted
+        _seed_generation()
+        return cache.cache.inc(GENERATION_KEY)
+    except Exception:
+        return None
+
+
+top_sellers = TopSellers()
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changes(session, flush_context):
+    changes = session.info.setdefault(PENDING_CHANGES, {})
+    for obj in session.new:
+        if type(obj) is Book:
+            changes[obj.id] = obj.copies_sold
+    for obj in session.dirty:
+        if type(obj) is Book and inspect(obj).attrs.copies_sold.history.has_changes():
+            changes[obj.id] = obj.copies_sold
+    for obj in session.deleted:
+        if type(obj) is Book:
+            changes[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_changes(session):
+    changes = session.info.pop(PENDING_CHANGES, None)
+    if changes and has_app_context():
+        top_sellers.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
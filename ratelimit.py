@@ -0,0 +1,301 @@
+"""
+    rate limiting and admission control.
+
+    every request takes a token from two buckets of its route class (see route_class): one for the client's ip
+    and one for who's asking (the token's user, or the username being logged in / signed up as from that ip).
+    a bucket holds `burst` tokens and gets `rate` back every second, so a client can go `rate` requests a second
+    for good and `burst` at once. an empty bucket means a 429 with a Retry-After header. the ip buckets are
+    RATE_LIMIT_IP_MULTIPLIER times bigger, there can be many users behind one ip.
+    the budgets are (rate, burst) per class in RATE_LIMITS, RATE_LIMIT_<CLASS>=rate,burst in the environment
+    overrides one, RATE_LIMIT_ENABLED=0 turns the buckets off.
+
+    each worker takes tokens from its own buckets in memory, a request never waits on anything shared. when the
+    cache backend has shared buckets (SQLiteCache.sync_buckets), a thread in each worker hands what it took to
+    them every RATE_LIMIT_SYNC seconds (1) and carries on from the shared levels, so the limits hold across every
+    worker on the host, give or take what the workers let through between two syncs. with any other backend
+    each worker only has its own buckets.
+
+    on top of that each worker admits at most MAX_CONCURRENT_REQUESTS requests at once, and at most
+    MAX_CONCURRENT_WRITES that aren't GETs (sqlite has one writer, more just queue on its lock and make
+    every read behind them slower). the rest are turned away with a 503 and a Retry-After right away,
+    instead of waiting in line until the db is too slow for all of them. 0 turns a limit off.
+
+    GET /metrics shows how many requests each class let through, limited and shed.
+"""
+from collections import OrderedDict, defaultdict
+from threading import Lock, Thread
+import logging
+import math
+import os
+import time
+
+from flask import request, jsonify, g
+from http import HTTPStatus
+
+from .auth import verify_token, InvalidToken
+from .cache import cache
+
+# (refill per second, burst) per route class
+RATE_LIMITS = {
+    'catalog':  (20, 40),    # book/author/rating reads
+    'cart':     (5, 20),     # cart and wishlist writes
+    'auth':     (1, 5),      # logging in, signing up, refreshing (password hashing is expensive)
+    'bulk':     (0.5, 3),    # POST /books/import and /books/batch
+    'default':  (10, 20),    # everything else
+}
+RATE_LIMIT_IP_MULTIPLIER = 4
+# seconds between each worker's syncs of its buckets with the shared ones
+RATE_LIMIT_SYNC = 1
+MAX_CONCURRENT_REQUESTS = 64
+MAX_CONCURRENT_WRITES = 8
+# what a shed request is told to wait, in seconds
+SHED_RETRY_AFTER = 1
+
+AUTH_ENDPOINTS = {
+    'profile_management_routes.login',
+    'profile_management_routes.refresh_token',
+    'profile_management_routes.add_user',
+    'profile_management_routes.logout',
+}
+BULK_ENDPOINTS = {
+    'book_routes.import_books_route',
+    'book_routes.books_batch',
+}
+CATALOG_BLUEPRINTS = {'book_routes', 'author_routes', 'rating_routes'}
+CART_BLUEPRINTS = {'shopping_cart_routes', 'wishlist_routes'}
+
+# buckets kept per worker
+LOCAL_BUCKETS = 100000
+# shared buckets nobody took from in this long are full again, the sync thread deletes them
+BUCKET_IDLE = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def rate_limit_config_from_env(environ=os.environ):
+    """ the RATE_LIMIT_* and MAX_CONCURRENT_* config, the defaults above overridden by the environment """
+    limits = dict(RATE_LIMITS)
+    for name in RATE_LIMITS:
+        value = environ.get(f"RATE_LIMIT_{name.upper()}")
+        if value:
+            rate, burst = (float(x) for x in value.split(','))
+            if rate <= 0 or burst < 1:
+                raise ValueError(f"RATE_LIMIT_{name.upper()} must be rate,burst with rate > 0 and burst >= 1")
+            limits[name] = (rate, burst)
+    return {
+        'RATE_LIMIT_ENABLED': environ.get('RATE_LIMIT_ENABLED', '1') == '1',
+        'RATE_LIMITS': limits,
+        'RATE_LIMIT_IP_MULTIPLIER': float(environ.get('RATE_LIMIT_IP_MULTIPLIER', RATE_LIMIT_IP_MULTIPLIER)),
+        'MAX_CONCURRENT_REQUESTS': int(environ.get('MAX_CONCURRENT_REQUESTS', MAX_CONCURRENT_REQUESTS)),
+        'MAX_CONCURRENT_WRITES': int(environ.get('MAX_CONCURRENT_WRITES', MAX_CONCURRENT_WRITES)),
+        'RATE_LIMIT_SYNC': float(environ.get('RATE_LIMIT_SYNC', RATE_LIMIT_SYNC)),
+    }
+
+
+def route_class(endpoint, method):
+    if endpoint in AUTH_ENDPOINTS:
+        return 'auth'
+    if endpoint in BULK_ENDPOINTS:
+        return 'bulk'
+    blueprint = endpoint.rsplit('.', 1)[0] if endpoint and '.' in endpoint else None
+    if blueprint in CATALOG_BLUEPRINTS and method in ('GET', 'HEAD'):
+        return 'catalog'
+    if blueprint in CART_BLUEPRINTS and method not in ('GET', 'HEAD'):
+        return 'cart'
+    return 'default'
+
+
+def client_identity(route):
+    """ who the per-principal bucket belongs to, None when the request doesn't say """
+    if route == 'auth':
+        # logging in: the username being tried from this ip. not the username alone, or anyone could lock a user
+        # out of their account by guessing their password a few times (the ip bucket still limits each ip)
+        username = None
+        if request.authorization and request.authorization.username:
+            username = request.authorization.username
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, dict) and isinstance(data.get('username'), str):
+                username = data['username']
+        if username is not None:
+            return f"name:{username}:ip:{request.remote_addr}"
+    token = request.headers.get('Authorization')
+    if token and not token.startswith('Basic '):
+        try:
+            return f"user:{verify_token(token).id}"
+        except InvalidToken:
+            pass
+    return None
+
+
+class LocalBuckets:
+    """ this worker's token buckets. the least recently used ones are dropped past `maxsize`.
+        each bucket remembers how many tokens it gave out since the last sync, for the shared buckets
+    """
+
+    def __init__(self, maxsize=LOCAL_BUCKETS):
+        self.maxsize = maxsize
+        # key -> [tokens, updated, rate, capacity, taken since the last sync]
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take_tokens(self, buckets, cost=1):
+        """ takes `cost` tokens from every bucket in `buckets` [(key, refill per second, capacity)], or from
+            none of them if one is short. a bucket nobody used yet is full.
+            returns (allowed, seconds until it would be allowed)
+        """
+        now = time.time()
+        with self._lock:
+            states = []
+            for key, rate, capacity in buckets:
+                state = self._buckets.get(key)
+                if state is None:
+                    state = self._buckets[key] = [capacity, now, rate, capacity, 0]
+                state[0] = min(capacity, state[0] + max(0.0, now - state[1]) * rate)
+                state[1], state[2], state[3] = now, rate, capacity
+                self._buckets.move_to_end(key)
+                states.append(state)
+            wait = max(((cost - state[0]) / state[2] for state in states if state[0] < cost), default=0.0)
+            if not wait:
+                for state in states:
+                    state[0] -= cost
+                    state[4] += cost
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return not wait, wait
+
+    def taken(self):
+        """ [(key, rate, capacity, tokens taken)] of the buckets used since the last call, and starts over """
+        with self._lock:
+            taken = [(key, state[2], state[3], state[4]) for key, state in self._buckets.items() if state[4]]
+            for key, _, _, _ in taken:
+                self._buckets[key][4] = 0
+        return taken
+
+    def update(self, levels):
+        """ carries on from the shared buckets' levels (what sync_buckets returned), minus what was taken since """
+        now = time.time()
+        with self._lock:
+            for key, level in levels.items():
+                state = self._buckets.get(key)
+                if state is not None:
+                    state[0], state[1] = level - state[4], now
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class Limiter:
+    def __init__(self):
+        self.buckets = LocalBuckets()
+        self._lock = Lock()
+        self._in_flight = 0
+        self._writes_in_flight = 0
+        self._peak_in_flight = 0
+        self._stats = defaultdict(lambda: {"allowed": 0, "limited": 0, "shed": 0})
+        self._sync_pid = None
+
+    def init_app(self, app):
+        for k, v in rate_limit_config_from_env().items():
+            app.config.setdefault(k, v)
+
+        # after instrumentation's before_request, so turned away requests still get timed
+        @app.before_request
+        def admit():
+            return self.admit(app.config)
+
+        @app.teardown_request
+        def release(exc=None):
+            self.release()
+
+    def _count(self, route, name):
+        with self._lock:
+            self._stats[route][name] += 1
+
+    def _start_sync(self, config):
+        """ starts this process's sync thread, if the cache backend has shared buckets (once per process,
+            a forked worker doesn't get its parent's threads)
+        """
+        backend = cache.cache
+        if self._sync_pid == os.getpid() or not hasattr(backend, 'sync_buckets'):
+            return
+        with self._lock:
+            if self._sync_pid == os.getpid():
+                return
+            self._sync_pid = os.getpid()
+        Thread(target=self._sync_forever, args=(backend, config['RATE_LIMIT_SYNC']), daemon=True,
+               name='rate-limit-sync').start()
+
+    def _sync_forever(self, backend, every):
+        last_prune = time.time()
+        while True:
+            time.sleep(every)
+            try:
+                self.sync(backend)
+                if time.time() - last_prune > BUCKET_IDLE:
+                    backend.prune_buckets(BUCKET_IDLE)
+                    last_prune = time.time()
+            except Exception:
+                logger.exception("could not sync the rate limit buckets")
+
+    def sync(self, backend):
+        """ pushes what this worker took to the shared buckets and carries on from their levels """
+        taken = self.buckets.taken()
+        if taken:
+            self.buckets.update(backend.sync_buckets(taken))
+
+    def admit(self, config):
+        """ None if the request can go on, or the 429/503 response """
+        route = route_class(request.endpoint, request.method)
+        writes = request.method not in ('GET', 'HEAD', 'OPTIONS')
+
+        if config['RATE_LIMIT_ENABLED']:
+            rate, burst = config['RATE_LIMITS'][route]
+            multiplier = config['RATE_LIMIT_IP_MULTIPLIER']
+            buckets = [(f"rl:{route}:ip:{request.remote_addr}", rate * multiplier, burst * multiplier)]
+            identity = client_identity(route)
+            if identity:
+                buckets.append((f"rl:{route}:{identity}", rate, burst))
+            self._start_sync(config)
+            allowed, wait = self.buckets.take_tokens(buckets)
+            if not allowed:
+                self._count(route, 'limited')
+                return jsonify({'message': 'too many requests, slow down'}), HTTPStatus.TOO_MANY_REQUESTS, \
+                    {'Retry-After': str(math.ceil(wait))}
+
+        max_requests, max_writes = config['MAX_CONCURRENT_REQUESTS'], config['MAX_CONCURRENT_WRITES']
+        with self._lock:
+            shed = ((max_requests and self._in_flight >= max_requests) or
+                    (writes and max_writes and self._writes_in_flight >= max_writes))
+            if not shed:
+                self._in_flight += 1
+                self._writes_in_flight += writes
+                self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+                self._stats[route]["allowed"] += 1
+        if shed:
+            self._count(route, 'shed')
+            return jsonify({'message': 'the server is busy, try again in a moment'}), \
+                HTTPStatus.SERVICE_UNAVAILABLE, {'Retry-After': str(SHED_RETRY_AFTER)}
+        g.admitted_write = writes
+        return None
+
+    def release(self):
+        if 'admitted_write' not in g:
+            return
+        writes = g.pop('admitted_write')
+        with self._lock:
+            self._in_flight -= 1
+            self._writes_in_flight -= writes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "writes_in_flight": self._writes_in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "routes": {route: dict(counts) for route, counts in self._stats.items()},
+            }
+
+
+limiter = Limiter()
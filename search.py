@@ -0,0 +1,157 @@
+"""
+    full text search over the catalog, backed by an sqlite FTS5 table.
+
+    books_fts holds one row per book (rowid = books.id) with the searchable text: title, description, genre,
+    publisher and the author's name. triggers on books and authors keep it in sync, so it stays right for
+    every way rows get written (ORM, bulk_insert_mappings, raw sql). the DDL is run by db.create_all() through
+    the after_create hook below, and by the migration that added it.
+
+    results are ranked with bm25, weighted so a hit in the title or author counts more than one in the
+    description. on databases other than sqlite search falls back to LIKE (unranked, slow on big catalogs).
+"""
+import re
+
+from sqlalchemy import DDL, event, literal_column, or_, table, column
+
+from .models import db, Book, Author, book_serializer
+
+# bm25 weight of each column, in the order they're declared in the table
+RANK = "bm25(10.0, 1.0, 2.0, 2.0, 5.0)"  # title, description, genre, publisher, author
+
+_AUTHOR_NAME = "trim(coalesce({0}.first_name, '') || ' ' || coalesce({0}.last_name, ''))"
+
+FTS_DDL = [
+    # prefix='2 3' keeps extra index entries for 2 and 3 char prefixes so "gab*" doesn't scan the whole vocabulary
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, description, genre, publisher, author, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+
+    f"INSERT INTO books_fts(books_fts, rank) VALUES ('rank', '{RANK}')",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, description, genre, publisher, author) "
+    "VALUES (new.id, new.title, new.description, new.genre, new.publisher, "
+    f"(SELECT {_AUTHOR_NAME.format('authors')} FROM authors WHERE authors.id = new.author_id)); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, description, genre, publisher, author_id "
+    "ON books BEGIN "
+    "UPDATE books_fts SET title = new.title, description = new.description, genre = new.genre, "
+    "publisher = new.publisher, "
+    f"author = (SELECT {_AUTHOR_NAME.format('authors')} FROM authors WHERE authors.id = new.author_id) "
+    "WHERE rowid = new.id; "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "DELETE FROM books_fts WHERE rowid = old.id; "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_author_update AFTER UPDATE OF first_name, last_name ON authors BEGIN "
+    f"UPDATE books_fts SET author = {_AUTHOR_NAME.format('new')} "
+    "WHERE rowid IN (SELECT id FROM books WHERE author_id = new.id); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS books_fts_author_delete AFTER DELETE ON authors BEGIN "
+    "UPDATE books_fts SET author = NULL WHERE rowid IN (SELECT id FROM books WHERE author_id = old.id); "
+    "END",
+]
+
+# fills books_fts from existing rows (the migration runs this once)
+FTS_BACKFILL = (
+    "INSERT INTO books_fts(rowid, title, description, genre, publisher, author) "
+    "SELECT books.id, books.title, books.description, books.genre, books.publisher, "
+    f"{_AUTHOR_NAME.format('authors')} FROM books LEFT JOIN authors ON authors.id = books.author_id"
+)
+
+# the triggers go when books/authors are dropped, the table doesn't
+FTS_DROP = "DROP TABLE IF EXISTS books_fts"
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_fts(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in FTS_DDL:
+            DDL(statement).execute(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_fts(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        DDL(FTS_DROP).execute(connection)
+
+
+books_fts = table('books_fts', column('rowid'), column('rank'))
+
+# a word, optionally followed by * to match it as a prefix
+_TERM = re.compile(r'(\w+)(\*?)')
+
+# the last word typed is only treated as a prefix from this many chars on. "a*" or "th*" match most of the
+# catalog, and bm25 has to score every match, so they'd be the slowest searches we have
+MIN_PREFIX = 3
+
+
+def match_expression(q):
+    """ turns what the user typed into an FTS5 query. every word has to match (AND), words are quoted so
+        FTS5 operators/syntax in the input are just text, and the last word (or any word ending in *)
+        is matched as a prefix (if it's at least MIN_PREFIX chars), so results show up while the user is
+        still typing.
+        returns None if q has no words
+    """
+    terms = _TERM.findall(q)
+    if not terms:
+        return None
+    parts = []
+    for i, (word, star) in enumerate(terms):
+        prefix = star or (i == len(terms) - 1 and len(word) >= MIN_PREFIX)
+        parts.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(parts)
+
+
+def _filters(genre=None, min_price=None, max_price=None, published_after=None, published_before=None):
+    clauses = []
+    if genre is not None:
+        clauses.append(Book.genre == genre)
+    if min_price is not None:
+        clauses.append(Book.price >= min_price)
+    if max_price is not None:
+        clauses.append(Book.price <= max_price)
+    if published_after is not None:
+        clauses.append(Book.date_published >= published_after)
+    if published_before is not None:
+        clauses.append(Book.date_published <= published_before)
+    return clauses
+
+
+def search_statement(q, limit, offset=0, **filters):
+    """ a Core select of the books matching `q` (best match first) and `filters`, in book_serializer's
+        column order. returns None if there is nothing to search for
+    """
+    expression = match_expression(q)
+    if expression is None:
+        return None
+
+    if db.engine.dialect.name == 'sqlite':
+        stmt = (book_serializer.select()
+                .select_from(books_fts)
+                .join(Book.__table__, Book.id == books_fts.c.rowid)
+                .where(literal_column('books_fts').op('MATCH')(expression))
+                # rank is the bm25() configured above
+                .order_by(books_fts.c.rank, Book.id))
+    else:
+        stmt = (book_serializer.select()
+                .outerjoin(Author.__table__, Author.id == Book.author_id)
+                .order_by(Book.id))
+        for word, _ in _TERM.findall(q):
+            pattern = f"%{word}%"
+            stmt = stmt.where(or_(Book.title.ilike(pattern), Book.description.ilike(pattern),
+                                  Book.genre.ilike(pattern), Book.publisher.ilike(pattern),
+                                  Author.first_name.ilike(pattern), Author.last_name.ilike(pattern)))
+
+    return stmt.where(*_filters(**filters)).limit(limit).offset(offset)
+
+
+def include_name(name, type_, parent_names):
+    """ for alembic autogenerate: books_fts (and the shadow tables fts5 creates for it) aren't models,
+        so leave them out instead of generating a drop_table for them
+    """
+    return not (type_ == 'table' and name.startswith('books_fts'))
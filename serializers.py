@@ -0,0 +1,76 @@
+"""
+    fast row serialization.
+
+    a RowSerializer works out once (at import time) which columns a model has and which of them need
+    converting (dates -> iso strings), instead of walking __table__.columns and type checking every value
+    for every row like as_dict() used to. it can dump ORM objects, but it's fastest on plain rows from a
+    Core select (`serializer.select()`), since then no ORM objects get built at all.
+
+    dumps() uses orjson when it's installed and falls back to the stdlib json module.
+"""
+from datetime import date, datetime
+from operator import attrgetter
+import json
+
+from flask import Response
+from sqlalchemy import select
+
+try:
+    import orjson
+except ImportError:  # optional, `pip install orjson` for the faster encoder
+    orjson = None
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+# python types that json can't encode as is, and how to convert them
+_CONVERTERS = {date: _isoformat, datetime: _isoformat}
+
+
+class RowSerializer:
+    """ dumps rows of one model to dicts, using a column plan built once """
+
+    def __init__(self, model, exclude=()):
+        self.model = model
+        self.columns = tuple(c for c in model.__table__.columns if c.name not in exclude)
+        self.names = tuple(c.name for c in self.columns)
+        self._get_values = attrgetter(*(model.__mapper__.get_property_by_column(c).key for c in self.columns))
+        self.converters = tuple(
+            (c.name, _CONVERTERS[c.type.python_type]) for c in self.columns
+            if c.type.python_type in _CONVERTERS
+        )
+
+    def select(self):
+        """ a Core select of the serialized columns, in the order dump_row expects them """
+        return select(*self.columns)
+
+    def dump_row(self, row):
+        """ dumps a tuple/Row of values in column order. extra trailing values are ignored """
+        data = dict(zip(self.names, row))
+        for name, convert in self.converters:
+            value = data[name]
+            if value is not None:
+                data[name] = convert(value)
+        return data
+
+    def dump_rows(self, rows):
+        return [self.dump_row(row) for row in rows]
+
+    def dump(self, obj):
+        """ dumps an ORM instance """
+        values = self._get_values(obj)
+        return self.dump_row(values if len(self.columns) > 1 else (values,))
+
+
+def dumps(obj):
+    """ encodes obj as json bytes """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def json_response(obj, status=200):
+    """ like jsonify(obj), but with the fast encoder """
+    return Response(dumps(obj), status=status, mimetype='application/json')
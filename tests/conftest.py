@@ -0,0 +1,84 @@
+import base64
+import datetime
+import os
+import tempfile
+
+import pytest
+
+# the app reads its config from the environment when it's imported, so this goes first
+_tmp = tempfile.mkdtemp(prefix='geektext-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'db.sqlite')
+os.environ['CACHE_SQLITE_PATH'] = os.path.join(_tmp, 'cache.sqlite')
+# hash on the request thread, and cheaply
+os.environ['PASSWORD_WORKERS'] = '0'
+os.environ['PASSWORD_SCRYPT_N'] = '1024'
+# turned back on by the tests that check them
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['MAX_CONCURRENT_REQUESTS'] = '0'
+
+from ..app import app as flask_app
+from ..auth import token_cache, denylist
+from ..cache import cache
+from ..models import db, Author, Book
+from ..ratelimit import limiter
+from ..rankings import top_sellers
+
+PASSWORD = 'pw'
+
+
+@pytest.fixture
+def app():
+    # testing mode also turns on the N+1 guard (see instrumentation.py)
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    cache.clear()
+    token_cache.clear()
+    denylist.clear()
+    limiter.buckets.clear()
+    top_sellers.invalidate()
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def books(app):
+    """ an author and 60 books (isbns 1000 to 1059), returns the author's id """
+    with app.app_context():
+        author = Author(first_name='gabriel', last_name='marquez', publisher='penguin')
+        db.session.add(author)
+        db.session.flush()
+        for i in range(60):
+            db.session.add(Book(title=f'book {i}', isbn=f'{1000 + i}', author_id=author.id,
+                                genre='horror' if i % 2 else 'drama', date_published=datetime.date(2020, 1, 1),
+                                copies_sold=i, price=10 + i % 30, publisher='penguin', description='about things'))
+        db.session.commit()
+        return author.id
+
+
+def basic_auth(username, password=PASSWORD):
+    return {'Authorization': 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()}
+
+
+def login(client, username, is_admin=False):
+    """ creates the user and returns what POST /get-token gave them """
+    resp = client.post('/create-user', json={'username': username, 'password': PASSWORD, 'isAdmin': is_admin})
+    assert resp.status_code < 400, resp.get_data()
+    resp = client.post('/get-token', headers=basic_auth(username))
+    assert resp.status_code == 200, resp.get_data()
+    return resp.json
+
+
+@pytest.fixture
+def admin(client):
+    return {'Authorization': login(client, 'admin', is_admin=True)['token']}
+
+
+@pytest.fixture
+def bob(client):
+    return {'Authorization': login(client, 'bob')['token']}
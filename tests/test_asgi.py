@@ -0,0 +1,100 @@
+""" asgi.application gives the same responses as the WSGI app, hot routes on the event loop """
+import asyncio
+import threading
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+pytest.importorskip('aiosqlite')
+
+from sqlalchemy.util import greenlet_spawn
+
+from ..asgi import AsyncApp, wsgi_environ
+from ..database import session_override, run_blocking
+
+
+def asgi_get(app, requests, track=None):
+    """ runs the GETs (path, headers) on a fresh AsyncApp, concurrently, and returns the responses """
+    asgi = AsyncApp(app)
+    if track is not None:
+        runs_async = asgi.runs_async
+
+        def tracked(scope):
+            if runs_async(scope):
+                track.append(scope['path'])
+                return True
+            return False
+        asgi.runs_async = tracked
+
+    async def go():
+        transport = httpx.ASGITransport(app=asgi)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as http:
+                return await asyncio.gather(*(http.get(path, headers=headers) for path, headers in requests))
+        finally:
+            if asgi.engine is not None:
+                await asgi.engine.dispose()
+            asgi.executor.shutdown()
+    return asyncio.run(go())
+
+
+def test_hot_routes_match_the_wsgi_app(app, client, books, bob):
+    paths = ['/books?limit=5', '/books/1001', f'/authors/{books}/books']
+    # the ETag depends on the Accept header, which httpx always sends
+    headers = {**bob, 'Accept': '*/*'}
+    ran_async = []
+    responses = asgi_get(app, [(path, headers) for path in paths], track=ran_async)
+    assert sorted(ran_async) == sorted(path.split('?')[0] for path in paths)
+    for path, resp in zip(paths, responses):
+        expected = client.get(path, headers=headers)
+        assert resp.status_code == expected.status_code == 200
+        assert resp.json() == expected.json
+        assert resp.headers['ETag'] == expected.headers['ETag']
+        assert 'Server-Timing' in resp.headers
+    assert session_override.get() is None
+
+
+def test_the_response_cache_is_shared(app, client, books, bob):
+    # the first GET fills the cache on the async side, the test client's is a hit
+    resp, = asgi_get(app, [('/books/1002', bob)])
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert client.get('/books/1002', headers=bob).headers['X-Cache'] == 'HIT'
+
+
+def test_other_routes_run_on_the_thread_pool(app, client, books, bob, admin):
+    ran_async = []
+    resp, missing, unauthorized = asgi_get(app, [('/authors', bob), ('/nope', bob), ('/books/1001', {})],
+                                           track=ran_async)
+    assert ran_async == ['/books/1001']
+    assert resp.status_code == 200
+    assert resp.json() == client.get('/authors', headers=bob).json
+    assert missing.status_code == 404
+    assert unauthorized.json() == client.get('/books/1001').json == {'message': 'a valid token is missing'}
+
+
+def test_wsgi_environ():
+    environ = wsgi_environ({'method': 'GET', 'path': '/books', 'query_string': b'limit=5', 'http_version': '1.1',
+                            'client': ('10.0.0.1', 1234), 'server': ('api', 8000),
+                            'headers': [(b'content-type', b'text/csv'), (b'accept', b'a'), (b'accept', b'b'),
+                                        (b'content-length', b'10')]})
+    assert environ['QUERY_STRING'] == 'limit=5'
+    assert environ['CONTENT_TYPE'] == 'text/csv'
+    assert environ['HTTP_ACCEPT'] == 'a,b'
+    assert environ['CONTENT_LENGTH'] == '0'
+    assert (environ['REMOTE_ADDR'], environ['SERVER_NAME'], environ['SERVER_PORT']) == ('10.0.0.1', 'api', '8000')
+
+
+def test_blocking_calls_leave_the_loop_only_for_async_requests():
+    assert run_blocking(threading.get_ident) == threading.get_ident()
+
+    def on_the_loop():
+        token = session_override.set(object())
+        try:
+            return run_blocking(threading.get_ident)
+        finally:
+            session_override.reset(token)
+
+    async def go():
+        return threading.get_ident(), await greenlet_spawn(on_the_loop)
+    loop_thread, ran_on = asyncio.run(go())
+    assert ran_on != loop_thread
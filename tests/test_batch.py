@@ -0,0 +1,77 @@
+""" POST /books/batch and the per-book items it shares with GET /books/<isbn> """
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..api import book_routes
+
+
+def batch(client, headers, body):
+    resp = client.post('/books/batch', json=body, headers=headers)
+    assert resp.status_code == 200, resp.get_data()
+    return resp
+
+
+def book_selects(client, headers, body):
+    """ the response, and the queries for books it ran """
+    ran = []
+    def count(conn, cursor, statement, *args):
+        if statement.startswith('SELECT books.id'):
+            ran.append(statement)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        resp = batch(client, headers, body)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    return resp, ran
+
+
+def test_books_come_back_in_request_order(client, books, bob):
+    resp = batch(client, bob, {'isbns': ['1005', '9999', '1001', '1005']})
+    assert [book['isbn'] for book in resp.json['books']] == ['1005', '1001']
+    assert resp.json['missing'] == ['9999']
+    assert resp.json['books'][0] == client.get('/books/1005', headers=bob).json
+
+    resp = batch(client, bob, {'ids': [3, 1000, 2]})
+    assert [book['id'] for book in resp.json['books']] == [3, 2]
+    assert resp.json['missing'] == [1000]
+
+
+def test_cached_books_arent_loaded_again(client, books, bob):
+    client.get('/books/1001', headers=bob)
+    resp, ran = book_selects(client, bob, {'isbns': ['1001', '1002']})
+    assert resp.headers['X-Cache-Hits'] == '1/2'
+    assert len(ran) == 1
+
+    # the batch cached both books under their ids too
+    resp, ran = book_selects(client, bob, {'ids': [2, 3]})
+    assert resp.headers['X-Cache-Hits'] == '2/2'
+    assert ran == []
+
+
+def test_changed_books_are_loaded_again(client, books, admin):
+    batch(client, admin, {'isbns': ['1001']})
+    assert client.put('/books', json={'isbn': '1001', 'price': 99}, headers=admin).status_code == 202
+    resp = batch(client, admin, {'isbns': ['1001']})
+    assert resp.headers['X-Cache-Hits'] == '0/1'
+    assert resp.json['books'][0]['price'] == 99
+
+
+def test_misses_are_loaded_in_chunks(client, books, bob, monkeypatch):
+    monkeypatch.setattr(book_routes, 'BATCH_CHUNK_SIZE', 25)
+    resp, ran = book_selects(client, bob, {'ids': list(range(1, 61))})
+    assert len(resp.json['books']) == 60
+    assert len(ran) == 3
+
+
+def test_the_default_chunk_fits_sqlites_parameter_limit(client, books, bob):
+    ids = list(range(1, book_routes.MAX_BATCH_SIZE + 1))
+    resp, ran = book_selects(client, bob, {'ids': ids})
+    assert len(resp.json['books']) == 60 and len(resp.json['missing']) == book_routes.MAX_BATCH_SIZE - 60
+    assert len(ran) == book_routes.MAX_BATCH_SIZE // book_routes.BATCH_CHUNK_SIZE
+
+
+def test_bad_bodies_are_400(client, books, bob):
+    too_many = [str(i) for i in range(book_routes.MAX_BATCH_SIZE + 1)]
+    for body in ({}, {'isbns': ['1'], 'ids': [1]}, {'isbns': '1001'}, {'ids': ['1']}, {'isbns': [1001]},
+                 {'isbns': too_many}):
+        assert client.post('/books/batch', json=body, headers=bob).status_code == 400, body
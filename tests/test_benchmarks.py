@@ -0,0 +1,119 @@
+""" benchmarks/seed.py and the load test's baseline comparison """
+import json
+import sys
+
+import pytest
+from sqlalchemy import func
+
+from ..benchmarks import routes_bench, seed
+from ..benchmarks.routes_bench import compare, summarize, MIN_REGRESSION_MS
+from ..cache import cache
+from ..models import db, Book, Rating, User
+from .conftest import basic_auth
+
+SMALL = dict(authors=5, books=50, users=6, cart_items=3, wishlist_items=3, ratings=5, comments=2)
+
+
+def dump(model):
+    # the password hash is salted, updated_at and token_version are the time of the run
+    columns = [c for c in model.__table__.columns if c.name not in ('updated_at', 'password', 'token_version')]
+    return db.session.query(*columns).order_by(*model.__table__.primary_key).all()
+
+
+def reseed(app, **kwargs):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        counts = seed.seed_catalog(**dict(SMALL, **kwargs))
+        return counts, {model: dump(model) for model in (Book, Rating, User)}
+
+
+def test_seeding_is_deterministic(app):
+    first = reseed(app)
+    assert reseed(app) == first
+    assert reseed(app, seed=7)[1] != first[1]
+
+
+def test_seeded_rating_totals_match_the_ratings(app, client):
+    counts, _ = reseed(app)
+    with app.app_context():
+        assert Rating.query.count() == counts['ratings'] > 0
+        totals = dict(db.session.query(Rating.book_id, func.sum(Rating.rating)).group_by(Rating.book_id).all())
+        for book in Book.query:
+            assert book.rating_sum == totals.get(book.id, 0)
+    # seeded users log in with seed.PASSWORD
+    assert client.post('/get-token', headers=basic_auth('user2', seed.PASSWORD)).status_code == 200
+
+
+def results(driver, **routes):
+    return {"results": {driver: routes}}
+
+
+def route(p50=1.0, p95=2.0, rps=100.0, statements=3.0):
+    return {"requests": 10, "p50_ms": p50, "p95_ms": p95, "throughput_rps": rps, "statements_per_request": statements}
+
+
+def test_compare():
+    baseline = results('server', a=route(), b=route(), gone=route())
+    assert compare(results('server', a=route(), b=route(), new=route()), baseline, 0.2) == []
+
+    slower = compare(results('server', a=route(p50=10.0), b=route(p95=2.1)), baseline, 0.2)
+    # b grew by less than MIN_REGRESSION_MS, that's noise
+    assert slower == ["server a: p50_ms 1.0 -> 10.0"]
+    assert compare(results('server', a=route(rps=50.0)), baseline, 0.2) == ["server a: throughput_rps 100.0 -> 50.0"]
+    # throughput is only compared for the server driver
+    assert compare(results('test_client', a=route(rps=50.0)), results('test_client', a=route()), 0.2) == []
+    assert compare(results('server', a=route(statements=4.0)), baseline, 10) == \
+        ["server a: statements_per_request 3.0 -> 4.0"]
+
+
+def test_summarize():
+    summary = summarize([0.001 * i for i in range(1, 101)], [2, 4], [500], wall=2.0)
+    assert summary['requests'] == 100 and summary['errors'] == 1 and summary['error_statuses'] == [500]
+    assert summary['throughput_rps'] == 50.0
+    assert summary['p50_ms'] == 51.0 and summary['p99_ms'] == 100.0
+    assert summary['statements_per_request'] == 3 and summary['max_statements'] == 4
+    assert summarize([], [], [], wall=1.0) == {"requests": 0}
+
+
+@pytest.fixture
+def run_bench(app, tmp_path, monkeypatch):
+    """ runs routes_bench.main() against a small catalog in the test db, returns its results """
+    # main() changes these, put them back afterwards
+    for name in ('DATABASE_URL', 'QUERY_PLAN_CHECK'):
+        monkeypatch.setenv(name, routes_bench.os.environ.get(name, '0'))
+    monkeypatch.setitem(app.config, 'SERVER_TIMING', True)
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    baseline, output = tmp_path / 'baseline.json', tmp_path / 'results.json'
+
+    def run(*args):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        cache.clear()
+        small = [f"--{name.replace('_', '-')}={value}" for name, value in SMALL.items()]
+        monkeypatch.setattr(sys, 'argv', ['routes_bench', '--drivers=test_client', '--requests=2',
+                                          f'--baseline={baseline}', f'--output={output}', *small, *args])
+        routes_bench.main()
+        return json.loads(output.read_text())
+    run.baseline = baseline
+    return run
+
+
+def test_every_route_runs_and_is_compared_to_the_baseline(run_bench):
+    first = run_bench('--save-baseline')
+    routes = first['results']['test_client']
+    assert set(routes) == {scenario.name for scenario in routes_bench.SCENARIOS}
+    for name, summary in routes.items():
+        assert all(status < 500 for status in summary.get('error_statuses', [])), name
+    assert routes['GET /books']['statements_per_request'] > 0
+
+    # same catalog, same requests, same statements: no regressions, whatever the timings did
+    run_bench('--threshold=1000')
+
+    baseline = json.loads(run_bench.baseline.read_text())
+    baseline['results']['test_client']['GET /books']['statements_per_request'] -= 1
+    run_bench.baseline.write_text(json.dumps(baseline))
+    with pytest.raises(SystemExit) as exit:
+        run_bench('--threshold=1000')
+    assert exit.value.code == 1
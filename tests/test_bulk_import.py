@@ -0,0 +1,103 @@
+""" POST /books/import and `flask import-books` """
+import io
+import json
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..bulk_import import import_books_command
+from ..models import Author, Book
+
+CSV = (
+    "isbn,title,author_id,genre,price,date_published,publisher\n"
+    "2000,one,1,fiction,25,2022-05-22,penguin\n"
+    "2001,two,1,fiction,10,2022-05-23,penguin\n"
+)
+
+
+def count_books(app):
+    with app.app_context():
+        return Book.query.count()
+
+
+def test_csv_upload(app, client, books, admin):
+    resp = client.post('/books/import', headers=admin,
+                       data={'file': (io.BytesIO(CSV.encode()), 'books.csv')}, content_type='multipart/form-data')
+    assert resp.status_code == 201, resp.get_data()
+    assert resp.json['inserted'] == 2 and resp.json['failed'] == 0
+    assert count_books(app) == 62
+    with app.app_context():
+        book = Book.query.filter_by(isbn='2000').one()
+        assert (book.title, book.author_id, book.date_published.isoformat()) == ('one', 1, '2022-05-22')
+
+
+def test_ndjson_body_with_bad_rows(app, client, books, admin):
+    rows = [
+        {'isbn': '2000', 'title': 'ok', 'author_id': 1, 'price': 5},
+        {'isbn': '1001', 'title': 'isbn taken', 'author_id': 1},
+        {'isbn': '2000', 'title': 'isbn repeated in the file', 'author_id': 1},
+        {'isbn': '2001', 'title': 'no such author', 'author_id': 99},
+        {'isbn': '2002', 'title': 'unknown field', 'colour': 'red'},
+        {'isbn': '2003', 'title': 'new author', 'first_name': 'ursula', 'last_name': 'le guin', 'publisher': 'ace'},
+        {'isbn': '2004', 'title': 'same new author', 'first_name': 'ursula', 'last_name': 'le guin'},
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows)
+    resp = client.post('/books/import', headers=admin, data=body, content_type='application/x-ndjson')
+    assert resp.status_code == 201, resp.get_data()
+    assert resp.json['inserted'] == 3
+    assert sorted(error['row'] for error in resp.json['errors']) == [2, 3, 4, 5]
+
+    with app.app_context():
+        ursula = Author.query.filter_by(last_name='le guin').one()
+        assert ursula.publisher == 'ace'
+        assert sorted(book.isbn for book in Book.query.filter_by(author_id=ursula.id)) == ['2003', '2004']
+
+
+def test_a_broken_file_stops_the_import(client, books, admin):
+    body = json.dumps({'isbn': '2000', 'title': 'ok', 'author_id': 1}) + '\n{not json\n'
+    # the chunk before the broken line still goes in
+    resp = client.post('/books/import?format=ndjson&chunk_size=1', headers=admin, data=body)
+    assert resp.json['inserted'] == 1
+    assert resp.json['errors'][-1]['row'] is None
+
+
+def test_bad_requests(client, books, admin, bob):
+    assert client.post('/books/import', headers=bob, data=CSV, content_type='text/csv').status_code == 401
+    assert client.post('/books/import?format=xml', headers=admin, data=CSV).status_code == 400
+    assert client.post('/books/import?chunk_size=0', headers=admin, data=CSV).status_code == 400
+    # nothing inserted
+    resp = client.post('/books/import', headers=admin, data="isbn,title\n1001,taken\n", content_type='text/csv')
+    assert resp.status_code == 400 and resp.json['failed'] == 1
+
+
+def test_one_insert_per_chunk(app, client, books, admin):
+    inserts = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO books'):
+            inserts.append(len(parameters) if executemany else 1)
+    body = 'isbn,title,author_id\n' + ''.join(f'{3000 + i},book,1\n' for i in range(25))
+
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        resp = client.post('/books/import?chunk_size=10', headers=admin, data=body, content_type='text/csv')
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    assert resp.json['inserted'] == 25
+    assert inserts == [10, 10, 5]
+
+
+def test_import_evicts_the_author_books_page(client, books, admin, bob):
+    assert client.get('/authors/1/books', headers=bob).json['books_by_author']['total'] == 60
+    client.post('/books/import', headers=admin, data=CSV, content_type='text/csv')
+    assert client.get('/authors/1/books', headers=bob).json['books_by_author']['total'] == 62
+
+
+def test_cli(app, books, tmp_path):
+    path = tmp_path / 'books.csv'
+    path.write_text(CSV + "2002,three,99,fiction,1,2022-01-01,penguin\n")
+
+    result = app.test_cli_runner().invoke(import_books_command, [str(path), '--chunk-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'inserted 2 books, 1 failed' in result.output
+    assert 'row 3:' in result.output
+    assert count_books(app) == 62
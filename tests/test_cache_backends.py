@@ -0,0 +1,151 @@
+""" SQLiteCache, the cache every worker on the host shares """
+from types import SimpleNamespace
+
+import pytest
+
+from .. import cache_backends
+from ..cache import cache, cache_config_from_env
+from ..cache_backends import SQLiteCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_backends, 'time', SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite')
+
+
+def test_get_set_delete(path):
+    backend = SQLiteCache(path)
+    assert backend.get('a') is None
+    assert backend.set('a', {'body': b'x', 'n': 1})
+    assert backend.get('a') == {'body': b'x', 'n': 1}
+    assert backend.has('a')
+    assert backend.delete('a')
+    assert not backend.delete('a')
+    assert backend.get('a') is None
+
+
+def test_entries_expire(path, clock):
+    backend = SQLiteCache(path)
+    backend.set('a', 1, timeout=10)
+    backend.set('forever', 1, timeout=0)
+    clock.now += 11
+    assert backend.get('a') is None and not backend.has('a')
+    assert backend.get('forever') == 1
+
+
+def test_get_many_and_set_many(path, clock):
+    backend = SQLiteCache(path)
+    assert backend.set_many({'a': 1, 'b': [2]}, timeout=10)
+    backend.set('c', 3, timeout=1)
+    clock.now += 2
+    assert backend.get_many('b', 'missing', 'a', 'c') == [[2], None, 1, None]
+    # more keys than fit in one query
+    backend.set_many({f'k{i}': i for i in range(1200)})
+    assert backend.get_many(*(f'k{i}' for i in range(1200))) == list(range(1200))
+
+
+def test_add_only_adds_once(path, clock):
+    backend = SQLiteCache(path)
+    assert backend.add('lock', 1, timeout=5)
+    assert not backend.add('lock', 2, timeout=5)
+    assert backend.get('lock') == 1
+    # an expired entry doesn't count
+    clock.now += 6
+    assert backend.add('lock', 3, timeout=5)
+    assert backend.get('lock') == 3
+
+
+def test_workers_share_entries_counters_and_tags(path):
+    # two instances on one file, like two worker processes
+    one, two = SQLiteCache(path), SQLiteCache(path)
+    one.set('a', 1)
+    assert two.get('a') == 1
+
+    assert [one.inc('n'), two.inc('n'), one.inc('n', 5), two.dec('n')] == [1, 2, 7, 6]
+
+    one.set('page:1', 'p1')
+    one.set('page:2', 'p2')
+    one.add_tags('page:1', ['book:1', 'books:tail'])
+    one.add_tags('page:2', ['book:2'])
+    assert two.invalidate_tags(['book:1']) == 1
+    assert one.get('page:1') is None
+    assert one.get('page:2') == 'p2'
+
+
+def test_least_recently_used_entries_are_pruned(path, clock):
+    backend = SQLiteCache(path, threshold=3, prune_interval=1)
+    for key in 'abc':
+        clock.now += 2
+        backend.set(key, key)
+    # reading 'a' makes 'b' the least recently used
+    clock.now += 2
+    assert backend.get('a') == 'a'
+    clock.now += 2
+    backend.set('d', 'd')
+    assert [backend.get(key) for key in 'abcd'] == ['a', None, 'c', 'd']
+
+
+def test_pruning_drops_expired_entries_first(path, clock):
+    backend = SQLiteCache(path, threshold=3, prune_interval=1)
+    backend.set('old', 1, timeout=1)
+    backend.add_tags('old', ['book:1'])
+    clock.now += 2
+    backend.set('new', 1)
+    assert backend._conn.execute("SELECT key FROM cache").fetchall() == [('new',)]
+    assert backend._conn.execute("SELECT COUNT(*) FROM cache_tags").fetchone()[0] == 0
+
+
+def test_shared_token_buckets(path, clock):
+    one, other = SQLiteCache(path), SQLiteCache(path)
+    # a new bucket starts full
+    assert one.sync_buckets([('a', 1, 10, 4)]) == {'a': 6}
+    assert other.sync_buckets([('a', 1, 10, 4), ('b', 1, 10, 1)]) == {'a': 2, 'b': 9}
+    # refilled at `rate` up to `capacity`, never below 0
+    clock.now += 3
+    assert one.sync_buckets([('a', 1, 10, 10)]) == {'a': 0}
+    clock.now += 100
+    assert other.sync_buckets([('a', 1, 10, 0)]) == {'a': 10}
+
+    assert one.prune_buckets(50) == 1  # b
+    assert other.sync_buckets([('b', 1, 10, 0)]) == {'b': 10}
+
+
+def test_clear(path):
+    backend = SQLiteCache(path)
+    backend.set('a', 1)
+    backend.add_tags('a', ['t'])
+    assert backend.clear()
+    assert backend.get('a') is None
+    assert backend.invalidate_tags(['t']) == 0
+
+
+def test_config_from_env():
+    config = cache_config_from_env({})
+    assert config['CACHE_TYPE'].endswith('cache_backends.SQLiteCache')
+    assert config['CACHE_THRESHOLD'] == 5000
+
+    config = cache_config_from_env({'CACHE_TYPE': 'simple', 'CACHE_THRESHOLD': '10', 'OTHER': 'x'})
+    assert (config['CACHE_TYPE'], config['CACHE_THRESHOLD']) == ('SimpleCache', 10)
+    assert 'OTHER' not in config
+
+    config = cache_config_from_env({'CACHE_TYPE': 'RedisCache', 'CACHE_REDIS_URL': 'redis://cache-host:6379/0'})
+    assert (config['CACHE_TYPE'], config['CACHE_REDIS_URL']) == ('RedisCache', 'redis://cache-host:6379/0')
+
+
+def test_the_app_uses_it(app):
+    assert isinstance(cache.cache, SQLiteCache)
@@ -0,0 +1,87 @@
+""" cached responses are evicted by tag when what they show changes, and only then """
+from ..models import db, Book
+
+
+def get(client, headers, path):
+    resp = client.get(path, headers=headers)
+    assert resp.status_code == 200, resp.get_data()
+    return resp
+
+
+def test_updating_a_book_evicts_it(client, books, admin, bob):
+    assert get(client, bob, '/books/1001').headers['X-Cache'] == 'MISS'
+    assert get(client, bob, '/books/1001').headers['X-Cache'] == 'HIT'
+
+    assert client.put('/books', json={'isbn': '1001', 'price': 99}, headers=admin).status_code == 202
+
+    resp = get(client, bob, '/books/1001')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['price'] == 99
+
+
+def test_updating_a_book_keeps_pages_without_it(client, books, admin, bob):
+    get(client, bob, '/books?limit=10')
+    get(client, bob, '/authors')
+    # book 1059 (id 60) isn't on the first page
+    assert client.put('/books', json={'isbn': '1059', 'price': 99}, headers=admin).status_code == 202
+    assert get(client, bob, '/books?limit=10').headers['X-Cache'] == 'HIT'
+    assert get(client, bob, '/authors').headers['X-Cache'] == 'HIT'
+
+    assert client.put('/books', json={'isbn': '1005', 'price': 99}, headers=admin).status_code == 202
+    resp = get(client, bob, '/books?limit=10')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['books_list'][5]['price'] == 99
+
+
+def test_new_book_shows_up_in_the_authors_list(client, books, admin, bob):
+    assert len(get(client, bob, '/authors/1/books').json['books_by_author']['gabriel marquez']) == 60
+
+    resp = client.post('/books', headers=admin, json={
+        'isbn': '2000', 'title': 'new book', 'author_id': books, 'date_published': '2022-05-22',
+        'description': 'a book about things', 'genre': 'horror', 'price': 25, 'publisher': 'penguin'})
+    assert resp.status_code < 300, resp.get_data()
+
+    resp = get(client, bob, '/authors/1/books')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert len(resp.json['books_by_author']['gabriel marquez']) == 61
+
+
+def test_deleting_a_book_evicts_it(client, books, admin, bob):
+    get(client, bob, '/books/1001')
+    assert client.delete('/books', json={'isbn': '1001'}, headers=admin).status_code == 200
+    assert client.get('/books/1001', headers=bob).status_code == 404
+
+
+def test_cart_writes_evict_the_cart(client, books, bob):
+    assert client.post('/add/wishlist', json={'user_id': 1}, headers=bob).status_code == 200
+    assert get(client, bob, '/wishlist/1').json['message']["bob's Wishlist "] == []
+
+    assert client.post('/wishlist/add', json={'username': 'bob', 'isbn': '1003'}, headers=bob).status_code == 200
+
+    resp = get(client, bob, '/wishlist/1')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert [book['isbn'] for book in resp.json['message']["bob's Wishlist "]] == ['1003']
+
+
+def test_updating_an_author_evicts_the_author_views(client, books, admin, bob):
+    get(client, bob, '/authors')
+    get(client, bob, '/authors/1')
+    get(client, bob, '/books/1001')
+
+    assert client.put('/authors', json={'id': 1, 'bio': 'wrote books'}, headers=admin).status_code == 200
+
+    assert get(client, bob, '/authors').headers['X-Cache'] == 'MISS'
+    resp = get(client, bob, '/authors/1')
+    assert resp.headers['X-Cache'] == 'MISS'
+    assert resp.json['author']['bio'] == 'wrote books'
+    assert get(client, bob, '/books/1001').headers['X-Cache'] == 'HIT'
+
+
+def test_rolled_back_writes_evict_nothing(app, client, books, bob):
+    get(client, bob, '/books/1001')
+    with app.app_context():
+        book = Book.query.filter_by(isbn='1001').one()
+        book.price = 99
+        db.session.flush()
+        db.session.rollback()
+    assert get(client, bob, '/books/1001').headers['X-Cache'] == 'HIT'
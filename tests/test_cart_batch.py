@@ -0,0 +1,86 @@
+""" POST /shopping-cart/batch: many cart and wishlist changes in one transaction """
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def batch(client, headers, *operations):
+    return client.post('/shopping-cart/batch', json={'operations': list(operations)}, headers=headers)
+
+
+def contents(resp):
+    return ({book['isbn']: book['quantity'] for book in resp.json['shopping_cart']},
+            [book['isbn'] for book in resp.json['wishlist']])
+
+
+def test_operations_apply_in_order(client, books, bob):
+    resp = batch(client, bob,
+                 {'op': 'add', 'list': 'wishlist', 'isbn': '1001'},
+                 {'op': 'add', 'list': 'wishlist', 'isbn': '1002'},
+                 {'op': 'add', 'list': 'wishlist', 'isbn': '1002'},
+                 {'op': 'add', 'list': 'cart', 'isbn': '1003', 'quantity': 2},
+                 {'op': 'move', 'list': 'wishlist', 'isbn': '1001'})
+    assert resp.status_code == 200, resp.get_data()
+    assert contents(resp) == ({'1003': 2, '1001': 1}, ['1002'])
+    assert [result['changed'] for result in resp.json['results']] == [1, 1, 0, 1, 1]
+
+    resp = batch(client, bob, {'op': 'move', 'list': 'cart'}, {'op': 'remove', 'list': 'wishlist', 'isbn': '1003'})
+    assert contents(resp) == ({}, ['1002', '1001'])
+    resp = batch(client, bob, {'op': 'move', 'list': 'wishlist'})
+    assert contents(resp) == ({'1002': 1, '1001': 1}, [])
+    resp = batch(client, bob, {'op': 'clear', 'list': 'cart'}, {'op': 'clear', 'list': 'wishlist'})
+    assert contents(resp) == ({}, [])
+    assert [result['changed'] for result in resp.json['results']] == [2, 0]
+
+
+def test_moving_a_whole_list_is_two_statements(client, books, bob):
+    batch(client, bob, *({'op': 'add', 'list': 'wishlist', 'isbn': f'{1000 + i}'} for i in range(30)))
+
+    moves = []
+    def count(conn, cursor, statement, *args):
+        if statement.startswith(('INSERT INTO cart_items', 'DELETE FROM wishlist_items')):
+            moves.append(statement)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        resp = batch(client, bob, {'op': 'move', 'list': 'wishlist'})
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    assert len(resp.json['shopping_cart']) == 30
+    assert len(moves) == 2
+
+
+def test_removing_from_lists_that_dont_exist_changes_nothing(client, books, bob):
+    resp = batch(client, bob, {'op': 'remove', 'list': 'cart', 'isbn': '1001'}, {'op': 'clear', 'list': 'wishlist'})
+    assert resp.status_code == 200
+    assert contents(resp) == ({}, [])
+    # and didn't create them
+    assert client.get('/get-shopping-cart', json={'username': 'bob'}).json['message']['Error'].endswith('has no shopping cart')
+
+
+def test_a_bad_batch_changes_nothing(client, books, bob):
+    batch(client, bob, {'op': 'add', 'list': 'cart', 'isbn': '1001'})
+    for operations in (
+        [{'op': 'add', 'list': 'cart', 'isbn': '1002'}, {'op': 'add', 'list': 'cart', 'isbn': '9999'}],
+        [{'op': 'add', 'list': 'cart', 'isbn': '1002'}, {'op': 'fly', 'list': 'cart'}],
+        [{'op': 'add', 'list': 'cart', 'isbn': '1002', 'quantity': 0}],
+        [{'op': 'add', 'list': 'wishlist', 'isbn': '1002', 'quantity': 2}],
+        [{'op': 'clear', 'list': 'cart', 'isbn': '1002'}],
+        [{'op': 'remove', 'list': 'cart'}],
+        [{'op': 'add', 'list': 'basket', 'isbn': '1002'}],
+        ['add'],
+        [],
+        [{'op': 'clear', 'list': 'cart'}] * 101,
+    ):
+        resp = batch(client, bob, *operations)
+        assert resp.status_code in (400, 404), operations
+    resp = client.get('/get-shopping-cart', json={'username': 'bob'})
+    assert [book['isbn'] for book in resp.json['shopping_cart']] == ['1001']
+
+
+def test_delete_book(client, books, bob):
+    batch(client, bob, {'op': 'add', 'list': 'cart', 'isbn': '1001'}, {'op': 'add', 'list': 'cart', 'isbn': '1002'})
+    resp = client.put('/delete-book', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    assert resp.status_code == 200
+    assert client.put('/delete-book', json={'username': 'bob', 'isbn': '1001'}, headers=bob).json == \
+        {'Error': 'Book with isbn provided is not in shopping cart'}
+    resp = client.get('/get-shopping-cart', json={'username': 'bob'})
+    assert [book['isbn'] for book in resp.json['shopping_cart']] == ['1002']
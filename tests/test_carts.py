@@ -0,0 +1,72 @@
+""" carts and wishlists keep their books in association tables, so a book can be in any number of them """
+from ..models import User
+from .conftest import login
+
+
+def user_id(app, username):
+    with app.app_context():
+        return User.query.filter_by(username=username).one().id
+
+
+def cart(client, username):
+    return client.get('/get-shopping-cart', json={'username': username}).json['shopping_cart']
+
+
+def test_a_book_can_be_in_several_carts(client, books, bob):
+    alice = {'Authorization': login(client, 'alice')['token']}
+    assert client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob).status_code == 200
+    assert client.put('/shopping-cart', json={'username': 'alice', 'isbn': '1001'}, headers=alice).status_code == 200
+
+    assert [book['isbn'] for book in cart(client, 'bob')] == ['1001']
+    assert [book['isbn'] for book in cart(client, 'alice')] == ['1001']
+
+
+def test_adding_a_book_twice_bumps_its_quantity(client, books, bob):
+    for _ in range(2):
+        client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1002'}, headers=bob)
+
+    assert {book['isbn']: book['quantity'] for book in cart(client, 'bob')} == {'1001': 2, '1002': 1}
+
+
+def test_a_book_can_be_in_several_wishlists_once(app, client, books, bob):
+    alice = {'Authorization': login(client, 'alice')['token']}
+    for username, headers in (('bob', bob), ('alice', alice)):
+        client.post('/add/wishlist', json={'user_id': user_id(app, username)}, headers=headers)
+        for _ in range(2):
+            resp = client.post('/wishlist/add', json={'username': username, 'isbn': '1001'}, headers=headers)
+        assert [book['isbn'] for book in resp.json['wishlist']] == ['1001']
+
+
+def test_removing_from_the_wishlist_moves_the_book_to_the_cart(app, client, books, bob):
+    bob_id = user_id(app, 'bob')
+    client.post('/add/wishlist', json={'user_id': bob_id}, headers=bob)
+    client.post('/wishlist/add', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+
+    resp = client.put(f'/wishlist/{bob_id}/remove/1001', headers=bob)
+    assert resp.status_code == 200
+    assert resp.json["bob's Wishlist"] == []
+    assert {book['isbn']: book['quantity'] for book in cart(client, 'bob')} == {'1001': 2}
+
+    assert client.put(f'/wishlist/{bob_id}/remove/1001', headers=bob).status_code == 404
+
+
+def test_cart_writes_evict_the_cached_cart(client, books, bob):
+    client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    assert len(cart(client, 'bob')) == 1
+    client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1002'}, headers=bob)
+    assert len(cart(client, 'bob')) == 2
+    client.put('/delete-book', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    assert [book['isbn'] for book in cart(client, 'bob')] == ['1002']
+
+
+def test_a_wishlist_created_after_a_miss_shows_up(app, client, books, bob):
+    bob_id = user_id(app, 'bob')
+    assert client.get(f'/wishlist/{bob_id}', headers=bob).status_code == 404
+
+    client.post('/add/wishlist', json={'user_id': bob_id}, headers=bob)
+    client.post('/wishlist/add', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+    resp = client.get(f'/wishlist/{bob_id}', headers=bob)
+    assert resp.status_code == 200
+    assert [book['isbn'] for book in resp.json['message']["bob's Wishlist "]] == ['1001']
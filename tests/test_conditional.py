@@ -0,0 +1,64 @@
+""" ETag / Last-Modified validators and the 304s they get """
+import pytest
+
+
+@pytest.mark.parametrize('path', ['/books/1001', '/books?limit=10', '/authors', '/authors/1', '/authors/1/books'])
+def test_unchanged_is_304(client, books, bob, path):
+    first = client.get(path, headers=bob)
+    assert first.status_code == 200
+    etag, last_modified = first.headers['ETag'], first.headers['Last-Modified']
+
+    resp = client.get(path, headers=dict(bob, **{'If-None-Match': etag}))
+    assert resp.status_code == 304
+    assert resp.get_data() == b''
+    assert resp.headers['ETag'] == etag
+
+    assert client.get(path, headers=dict(bob, **{'If-Modified-Since': last_modified})).status_code == 304
+    assert client.get(path, headers=dict(bob, **{'If-None-Match': '"something else"'})).status_code == 200
+
+
+def test_changed_is_200_with_a_new_etag(client, books, admin, bob):
+    etag = client.get('/books/1001', headers=bob).headers['ETag']
+
+    assert client.put('/books', json={'isbn': '1001', 'price': 99}, headers=admin).status_code == 202
+
+    resp = client.get('/books/1001', headers=dict(bob, **{'If-None-Match': etag}))
+    assert resp.status_code == 200
+    assert resp.json['price'] == 99
+    assert resp.headers['ETag'] != etag
+    assert client.get('/books/1001', headers=dict(bob, **{'If-None-Match': resp.headers['ETag']})).status_code == 304
+
+
+def test_a_new_book_changes_the_list_etag(client, books, admin, bob):
+    etag = client.get('/authors/1/books', headers=bob).headers['ETag']
+
+    resp = client.post('/books', headers=admin, json={
+        'isbn': '2000', 'title': 'new book', 'author_id': books, 'date_published': '2022-05-22',
+        'description': 'a book about things', 'genre': 'horror', 'price': 25, 'publisher': 'penguin'})
+    assert resp.status_code < 300, resp.get_data()
+
+    assert client.get('/authors/1/books', headers=dict(bob, **{'If-None-Match': etag})).status_code == 200
+
+
+def test_rating_a_book_changes_its_etag(client, books, bob):
+    etag = client.get('/books/1001', headers=bob).headers['ETag']
+    assert client.post('/books/1001/ratings', json={'rating': 4}, headers=bob).status_code == 201
+    resp = client.get('/books/1001', headers=dict(bob, **{'If-None-Match': etag}))
+    assert resp.status_code == 200
+    assert resp.json['average_rating'] == 4
+
+
+def test_a_bulk_import_changes_the_list_etag(client, books, admin, bob):
+    etag = client.get('/books?limit=10', headers=bob).headers['ETag']
+    resp = client.post('/books/import', headers=admin, data="isbn,title,author_id\n2000,new book,1\n",
+                       content_type='text/csv')
+    assert resp.status_code == 201
+    assert client.get('/books?limit=10', headers=dict(bob, **{'If-None-Match': etag})).status_code == 200
+
+
+def test_a_first_rating_changes_the_list_etag(client, books, bob):
+    etag = client.get('/books?min_rating=4', headers=bob).headers['ETag']
+    assert client.post('/books/1001/ratings', json={'rating': 4}, headers=bob).status_code == 201
+    resp = client.get('/books?min_rating=4', headers=dict(bob, **{'If-None-Match': etag}))
+    assert resp.status_code == 200
+    assert [book['isbn'] for book in resp.json['books_list']] == ['1001']
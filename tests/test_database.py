@@ -0,0 +1,72 @@
+""" DATABASE_URL / DB_PROFILE engine config, the sqlite PRAGMAs and /db-stats """
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool, QueuePool
+
+from ..database import database_config_from_env
+from ..models import db
+
+
+def test_dev_is_the_default():
+    config = database_config_from_env({})
+    assert config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///db.sqlite'
+    assert config['DB_PROFILE'] == 'dev'
+    assert config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
+    assert config['SQLITE_PRAGMAS']['journal_mode'] == 'WAL'
+
+
+def test_production_and_overrides():
+    config = database_config_from_env({'DB_PROFILE': 'Production', 'DB_POOL_SIZE': '3',
+                                       'SQLITE_PRAGMA_MMAP_SIZE': '0', 'SQLITE_PRAGMA_LOCKING_MODE': 'NORMAL'})
+    options = config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['poolclass'] is QueuePool and options['pool_size'] == 3
+    assert config['SQLITE_PRAGMAS']['mmap_size'] == 0
+    assert config['SQLITE_PRAGMAS']['locking_mode'] == 'NORMAL'
+
+    # a pool size turns pooling on for the dev profile too
+    options = database_config_from_env({'DB_POOL_SIZE': '2'})['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['poolclass'] is QueuePool and options['connect_args'] == {'check_same_thread': False}
+
+
+def test_postgres():
+    config = database_config_from_env({'DATABASE_URL': 'postgres://u:p@db/geektext', 'DB_PROFILE': 'production'})
+    assert config['SQLALCHEMY_DATABASE_URI'] == 'postgresql://u:p@db/geektext'
+    assert config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'] is True
+    assert config['SQLITE_PRAGMAS'] == {}
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        database_config_from_env({'DB_PROFILE': 'fast'})
+
+
+def pragma(name):
+    return db.session.execute(text(f"PRAGMA {name}")).scalar()
+
+
+def test_pragmas_run_on_connect(app):
+    with app.app_context():
+        assert isinstance(db.engine.pool, NullPool)
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('busy_timeout') == 5000
+
+
+def test_the_production_profile(app, tmp_path, monkeypatch):
+    config = database_config_from_env({'DATABASE_URL': f"sqlite:///{tmp_path / 'prod.sqlite'}",
+                                       'DB_PROFILE': 'production'})
+    for key, value in config.items():
+        monkeypatch.setitem(app.config, key, value)
+    with app.app_context():
+        assert isinstance(db.engine.pool, QueuePool)
+        assert pragma('cache_size') == -65536
+        assert pragma('temp_store') == 2  # MEMORY
+
+
+def test_db_stats(client, admin, bob):
+    assert client.get('/db-stats', headers=bob).status_code == 401
+    resp = client.get('/db-stats', headers=admin)
+    assert resp.status_code == 200
+    assert resp.json['profile'] == 'dev'
+    stats = resp.json['db_stats']
+    assert stats['pool'] == 'NullPool'
+    assert stats['checkouts'] > 0 and stats['connects'] > 0
@@ -0,0 +1,104 @@
+""" Idempotency-Key replays and the 409 after losing too many optimistic locking races """
+import pytest
+from sqlalchemy.orm.exc import StaleDataError
+
+from ..api import shopping_cart, wishlist_routes
+from .. import transactions
+
+
+def cart(client):
+    resp = client.get('/get-shopping-cart', json={'username': 'bob'})
+    return {book['isbn']: book['quantity'] for book in resp.json['shopping_cart']}
+
+
+def add(client, bob, isbn, key=None):
+    headers = dict(bob, **{'Idempotency-Key': key}) if key else bob
+    return client.put('/shopping-cart', json={'username': 'bob', 'isbn': isbn}, headers=headers)
+
+
+def test_same_key_replays_the_first_response(client, books, bob):
+    first = add(client, bob, '1001', key='k1')
+    assert first.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+
+    again = add(client, bob, '1001', key='k1')
+    assert again.status_code == 200
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.get_data() == first.get_data()
+    assert cart(client) == {'1001': 1}
+
+    # a new key is a new request
+    assert add(client, bob, '1001', key='k2').status_code == 200
+    assert cart(client) == {'1001': 2}
+
+
+def test_same_key_for_another_request_is_422(client, books, bob):
+    assert add(client, bob, '1001', key='k1').status_code == 200
+    assert add(client, bob, '1002', key='k1').status_code == 422
+    assert cart(client) == {'1001': 1}
+
+
+def test_bad_key_is_400(client, books, bob):
+    assert add(client, bob, '1001', key='x' * 101).status_code == 400
+
+
+def test_conflicts_are_retried_then_409(app, client, books, bob, monkeypatch):
+    assert add(client, bob, '1001').status_code == 200
+    attempts = []
+
+    def always_stale(cart):
+        attempts.append(cart.id)
+        raise StaleDataError("changed by another request")
+
+    monkeypatch.setattr(shopping_cart, 'touch_cart', always_stale)
+    monkeypatch.setattr(transactions.time, 'sleep', lambda seconds: None)
+    # the statement budget is for one attempt, this runs them all
+    monkeypatch.setattr(app.view_functions['shopping_cart_routes.update_shopping_cart'], 'max_statements', 0)
+
+    resp = add(client, bob, '1002', key='k1')
+    assert resp.status_code == 409
+    assert len(attempts) == transactions.MAX_RETRIES + 1
+
+    # nothing was written, and the key wasn't used up
+    monkeypatch.undo()
+    assert cart(client) == {'1001': 1}
+    resp = add(client, bob, '1002', key='k1')
+    assert resp.status_code == 200
+    assert 'Idempotent-Replayed' not in resp.headers
+    assert cart(client) == {'1001': 1, '1002': 1}
+
+
+def test_a_conflict_that_clears_up_is_retried(client, books, bob, monkeypatch):
+    touch_cart = shopping_cart.touch_cart
+    attempts = []
+
+    def stale_once(cart):
+        attempts.append(cart.id)
+        if len(attempts) == 1:
+            raise StaleDataError("changed by another request")
+        touch_cart(cart)
+
+    monkeypatch.setattr(shopping_cart, 'touch_cart', stale_once)
+    monkeypatch.setattr(transactions.time, 'sleep', lambda seconds: None)
+
+    assert add(client, bob, '1001').status_code == 200
+    assert len(attempts) == 2
+    assert cart(client) == {'1001': 1}
+
+
+def test_a_failed_move_leaves_the_book_in_the_wishlist(client, books, bob, monkeypatch):
+    assert client.post('/add/wishlist', json={'user_id': 1}, headers=bob).status_code == 200
+    assert client.post('/wishlist/add', json={'username': 'bob', 'isbn': '1001'}, headers=bob).status_code == 200
+
+    def broken(cart_id, book_id, quantity=1):
+        raise RuntimeError("db went away")
+    monkeypatch.setattr(wishlist_routes, 'add_to_cart', broken)
+    with pytest.raises(RuntimeError):
+        client.put('/wishlist/1/remove/1001', headers=bob)
+
+    # the wishlist delete was rolled back with the rest
+    wishlist = client.get('/wishlist/1', headers=bob).json['message']["bob's Wishlist "]
+    assert [book['isbn'] for book in wishlist] == ['1001']
+    monkeypatch.undo()
+    assert client.put('/wishlist/1/remove/1001', headers=bob).status_code == 200
+    assert cart(client) == {'1001': 1}
@@ -0,0 +1,60 @@
+""" the Server-Timing header and GET /metrics """
+import re
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .. import instrumentation
+from ..instrumentation import Histogram
+
+
+@pytest.fixture(autouse=True)
+def no_metrics():
+    instrumentation.reset_metrics()
+    yield
+    instrumentation.reset_metrics()
+
+
+def test_server_timing_counts_the_requests_statements(client, books, bob):
+    ran = []
+    count = lambda *args: ran.append(1)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        resp = client.get('/authors/1/books', headers=bob)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    timing = re.fullmatch(r'db;dur=([\d.]+);desc="(\d+) statements", app;dur=([\d.]+)', resp.headers['Server-Timing'])
+    assert timing, resp.headers['Server-Timing']
+    db_ms, statements, app_ms = float(timing[1]), int(timing[2]), float(timing[3])
+    assert statements == len(ran)
+    assert 0 < db_ms <= app_ms
+
+
+def test_server_timing_can_be_turned_off(app, client, books, bob, monkeypatch):
+    monkeypatch.setitem(app.config, 'SERVER_TIMING', False)
+    assert 'Server-Timing' not in client.get('/books/1001', headers=bob).headers
+
+
+def test_metrics_per_endpoint(client, books, admin, bob):
+    for isbn in ('1001', '1002', '1003'):
+        client.get(f'/books/{isbn}', headers=bob)
+    client.get('/nowhere')
+
+    assert client.get('/metrics', headers=bob).status_code == 401
+    endpoints = client.get('/metrics', headers=admin).json['endpoints']
+    details = endpoints['book_routes.book_details']
+    assert details['requests'] == 3
+    assert details['statements'] > 0
+    assert details['statements_per_request'] == round(details['statements'] / 3, 2)
+    assert details['slowest_statement']['sql'].startswith('SELECT')
+    assert sum(bucket['count'] for bucket in details['request_ms_histogram']) == 3
+    assert endpoints['<unmatched>']['requests'] == 1
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(1, 10))
+    for ms in (0.5, 1, 3, 10, 11, 5000):
+        histogram.observe(ms)
+    assert histogram.as_list() == [{'bucket': '<=1ms', 'count': 2}, {'bucket': '<=10ms', 'count': 2},
+                                   {'bucket': '>10ms', 'count': 2}]
@@ -0,0 +1,54 @@
+import base64
+import json
+
+from .. import pagination
+from ..pagination import NDJSON_MIMETYPE, encode_cursor
+
+
+def walk(client, headers, path):
+    """ every page of `path`, following next_cursor """
+    pages, after = [], None
+    while True:
+        resp = client.get(path + (f'&after={after}' if after else ''), headers=headers)
+        assert resp.status_code == 200, resp.get_data()
+        pages.append(resp.json['books_list'])
+        after = resp.json['next_cursor']
+        if after is None:
+            return pages
+
+
+def test_pages_cover_every_book_once(client, books, bob):
+    pages = walk(client, bob, '/books?limit=7')
+    assert [len(page) for page in pages] == [7] * 8 + [4]
+    assert [book['id'] for page in pages for book in page] == list(range(1, 61))
+
+
+def test_pages_by_isbn(client, books, bob):
+    pages = walk(client, bob, '/books?limit=25&order_by=isbn')
+    isbns = [book['isbn'] for page in pages for book in page]
+    assert isbns == sorted(isbns) and len(isbns) == 60
+
+
+def test_limit_is_capped(client, books, bob, monkeypatch):
+    monkeypatch.setattr(pagination, 'MAX_PAGE_SIZE', 10)
+    assert len(client.get('/books?limit=1000', headers=bob).json['books_list']) == 10
+
+
+def test_bad_page_args_are_400(client, books, bob):
+    made_up = base64.urlsafe_b64encode(json.dumps({"k": "id", "v": {"a": 1}}).encode()).decode()
+    for query in ('limit=0', 'limit=ten', 'order_by=title', 'after=notacursor', f'after={made_up}',
+                  f'after={encode_cursor("id", 2 ** 70)}', f'after={encode_cursor("id", 5)}&order_by=isbn',
+                  f'after={encode_cursor("isbn", 5)}&order_by=isbn'):
+        resp = client.get(f'/books?{query}', headers=bob)
+        assert resp.status_code == 400, query
+
+
+def test_stream_returns_every_book_as_ndjson(client, books, bob):
+    for query, headers in (('?stream=true', bob), ('', dict(bob, Accept=NDJSON_MIMETYPE))):
+        resp = client.get('/books' + query, headers=headers)
+        assert resp.status_code == 200
+        assert resp.mimetype == NDJSON_MIMETYPE
+        lines = resp.get_data(as_text=True).splitlines()
+        # (a streamed response holds its request context until it's closed)
+        resp.close()
+        assert [json.loads(line)['id'] for line in lines] == list(range(1, 61))
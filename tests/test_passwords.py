@@ -0,0 +1,104 @@
+""" scrypt hashes, rehashing old ones on login, and the hashing pool's limits """
+from concurrent.futures import Future
+from threading import BoundedSemaphore
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from ..models import db, User
+from ..passwords import passwords, make_hash, check_hash
+from .conftest import PASSWORD, basic_auth, login
+
+
+def test_make_and_check_hash():
+    stored = make_hash('secret', 1024, 8, 1)
+    assert stored.startswith('scrypt:1024:8:1$')
+    assert stored != make_hash('secret', 1024, 8, 1)  # salted
+    assert check_hash('secret', stored, 1024, 8, 1) == (True, None)
+    assert check_hash('wrong', stored, 1024, 8, 1) == (False, None)
+    assert check_hash('secret', '', 1024, 8, 1) == (False, None)
+    assert check_hash('secret', 'scrypt:x:8:1$salt$hash', 1024, 8, 1) == (False, None)
+
+
+def test_old_hashes_and_costs_get_a_new_hash():
+    matches, new_hash = check_hash('secret', make_hash('secret', 1024, 8, 1), 2048, 8, 1)
+    assert matches and new_hash.startswith('scrypt:2048:8:1$')
+    matches, new_hash = check_hash('secret', generate_password_hash('secret', method='sha256'), 1024, 8, 1)
+    assert matches and check_hash('secret', new_hash, 1024, 8, 1) == (True, None)
+    assert check_hash('wrong', generate_password_hash('secret', method='sha256'), 1024, 8, 1) == (False, None)
+
+
+def test_login_rehashes_an_old_hash(app, client):
+    login(client, 'bob')
+    with app.app_context():
+        user = User.query.filter_by(username='bob').first()
+        assert user.password.startswith('scrypt:1024:')
+        user.password = generate_password_hash(PASSWORD, method='sha256')
+        db.session.commit()
+
+    assert 'token' in client.post('/get-token', headers=basic_auth('bob')).json
+    with app.app_context():
+        assert User.query.filter_by(username='bob').first().password.startswith('scrypt:1024:')
+    assert client.post('/get-token', headers=basic_auth('bob', 'wrong')).status_code == 401
+
+
+@pytest.fixture
+def pool(app, monkeypatch):
+    """ a one worker pool with no queue, the executor is whatever the test puts in pool.executor """
+    monkeypatch.setitem(app.config, 'PASSWORD_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_QUEUE_DEPTH', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_RETRY_AFTER', 3)
+    fake = SimpleNamespace(executor=None, slots=BoundedSemaphore(1))
+    monkeypatch.setattr(passwords, '_get_executor', lambda config: (fake.executor, fake.slots))
+    return fake
+
+
+class HangingExecutor:
+    """ takes the work and never does it """
+    def submit(self, fn, *args):
+        self.future = Future()
+        return self.future
+
+
+def test_a_full_pool_answers_503(app, client, pool):
+    pool.executor = HangingExecutor()
+    pool.slots.acquire()
+    with app.app_context():
+        rejected = passwords.stats()['rejected']
+
+    resp = client.post('/create-user', json={'username': 'bob', 'password': PASSWORD})
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '3'
+    with app.app_context():
+        assert passwords.stats()['rejected'] == rejected + 1
+        assert User.query.count() == 0
+
+
+def test_a_slow_hash_times_out_and_keeps_its_slot(app, client, pool, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_TIMEOUT', 0)
+    pool.executor = HangingExecutor()
+    with app.app_context():
+        timeouts = passwords.stats()['timeouts']
+
+    assert client.post('/create-user', json={'username': 'bob', 'password': PASSWORD}).status_code == 503
+    # the hash is still running, so the next one has no slot
+    assert client.post('/create-user', json={'username': 'bob', 'password': PASSWORD}).status_code == 503
+    with app.app_context():
+        assert passwords.stats()['timeouts'] == timeouts + 1
+
+    pool.executor.future.set_result('done')
+    assert pool.slots.acquire(blocking=False)
+
+
+def test_hashes_on_worker_processes(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_WORKERS', 1)
+    passwords.shutdown()
+    try:
+        with app.app_context():
+            stored = passwords.hash('secret')
+            assert passwords.verify('secret', stored) == (True, None)
+            assert passwords.verify('wrong', stored) == (False, None)
+            assert passwords.stats()['workers'] == 1
+    finally:
+        passwords.shutdown()
@@ -0,0 +1,47 @@
+""" the hot queries use indexes, and the migrations build the same indexes as the models """
+import os
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from ..models import db, Book, User
+from ..query_plan import check_query_plans, full_scans, HOT_QUERIES
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations')
+
+
+def indexes():
+    rows = db.session.execute(text(
+        "SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' AND name NOT LIKE 'sqlite_autoindex%'"))
+    return set(rows)
+
+
+def test_no_hot_query_scans_a_table(app):
+    with app.app_context():
+        assert set(HOT_QUERIES) and check_query_plans() == {}
+
+
+def test_a_scan_is_reported(app):
+    with app.app_context():
+        assert full_scans(Book.query.filter_by(title='x')) == ['SCAN books']
+        assert check_query_plans({'by title': lambda: Book.query.filter_by(title='x')}) == {'by title': ['SCAN books']}
+
+
+def test_usernames_are_unique(app):
+    with app.app_context():
+        db.session.add_all([User(username='bob'), User(username='bob')])
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_migrations_match_the_models(app, tmp_path, monkeypatch):
+    with app.app_context():
+        from_models = indexes()
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_DATABASE_URI', 'sqlite:///' + str(tmp_path / 'migrated.sqlite'))
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        assert indexes() == from_models
+        db.session.remove()
@@ -0,0 +1,122 @@
+""" GET /books/top-sellers, the in-process ranking behind it, and GET /books/genre/<genre> """
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .. import rankings
+from ..models import db, Book
+from ..rankings import TopSellers, top_sellers
+
+
+def top(client, headers, limit=5):
+    resp = client.get(f'/books/top-sellers?limit={limit}', headers=headers)
+    assert resp.status_code == 200, resp.get_data()
+    return [book['isbn'] for book in resp.json['books_list']]
+
+
+def test_best_sellers_first(client, books, bob):
+    # book i sold i copies
+    assert top(client, bob) == ['1059', '1058', '1057', '1056', '1055']
+    assert len(top(client, bob, 100)) == 60
+    for limit in ('0', '101', 'ten'):
+        assert client.get(f'/books/top-sellers?limit={limit}', headers=bob).status_code == 400
+
+
+def test_writes_move_books_without_a_rescan(app, client, books, admin):
+    assert top(client, admin, 3) == ['1059', '1058', '1057']
+
+    refills = []
+    def count(conn, cursor, statement, *args):
+        if 'ORDER BY books.copies_sold DESC' in statement:
+            refills.append(statement)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        assert client.put('/books', json={'isbn': '1000', 'copies_sold': 1000}, headers=admin).status_code == 202
+        assert top(client, admin, 3) == ['1000', '1059', '1058']
+        assert client.delete('/books', json={'isbn': '1059'}, headers=admin).status_code < 400
+        assert top(client, admin, 3) == ['1000', '1058', '1057']
+        # dropping below the last one held takes the book out of the list
+        assert client.put('/books', json={'isbn': '1058', 'copies_sold': 0}, headers=admin).status_code == 202
+        assert top(client, admin, 3) == ['1000', '1057', '1056']
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    assert refills == []
+
+
+def test_rollbacks_dont_move_anything(app, client, books, bob):
+    assert top(client, bob, 1) == ['1059']
+    with app.app_context():
+        Book.query.filter_by(isbn='1000').one().copies_sold = 1000
+        db.session.flush()
+        db.session.rollback()
+    assert top(client, bob, 1) == ['1059']
+
+
+def test_the_list_only_keeps_a_prefix_and_refills(app, books):
+    with app.app_context():
+        ranking = TopSellers(size=3)
+        assert ranking.top(3) == [60, 59, 58]  # book ids are isbn - 999
+        ranking.apply({58: 0})
+        assert ranking.keys == [(-59, 60), (-58, 59)]
+        # asking for more than it holds refills it from the db (where book 58 didn't change)
+        assert ranking.top(2) == [60, 59] and len(ranking.keys) == 2
+        assert ranking.top(3) == [60, 59, 58]
+
+
+def test_another_workers_change_forces_a_refill(app, books):
+    with app.app_context():
+        ours, theirs = TopSellers(), TopSellers()
+        assert ours.top(1) == theirs.top(1) == [60]
+
+        Book.query.get(1).copies_sold = 1000
+        db.session.commit()  # applied to the module's top_sellers, which bumps the shared generation
+        assert ours.generation != rankings._shared_generation()
+        assert ours.top(1) == theirs.top(1) == [1]
+
+
+def test_an_evicted_counter_comes_back_at_a_random_value(app, books, monkeypatch):
+    # not at 1, where a worker may have been before the counter was evicted
+    monkeypatch.setattr(rankings.random, 'getrandbits', lambda bits: 10 ** 9)
+    with app.app_context():
+        rankings.cache.delete(rankings.GENERATION_KEY)
+        assert rankings._bump_generation() == 10 ** 9 + 1
+        assert rankings._bump_generation() == 10 ** 9 + 2
+
+
+def test_a_failed_bump_refills(app, books, monkeypatch):
+    with app.app_context():
+        ranking = TopSellers()
+        ranking.top(1)
+        monkeypatch.setattr(rankings, '_bump_generation', lambda: None)
+        ranking.apply({1: 1000})
+        assert ranking.generation is None
+
+
+def test_invalidate(app, books):
+    with app.app_context():
+        assert top_sellers.top(1) == [60]
+        db.session.execute(Book.__table__.update().where(Book.id == 1).values(copies_sold=1000))
+        db.session.commit()
+        assert top_sellers.top(1) == [60]  # Core writes don't go through the session events
+        top_sellers.invalidate()
+        assert top_sellers.top(1) == [1]
+
+
+def test_genre_pages(client, books, bob):
+    seen, after = [], ''
+    while True:
+        resp = client.get(f'/books/genre/horror?limit=7{after}', headers=bob).json
+        assert {book['genre'] for book in resp['books_list']} <= {'horror'}
+        seen += [book['isbn'] for book in resp['books_list']]
+        if resp['next_cursor'] is None:
+            break
+        after = '&after=' + resp['next_cursor']
+    assert seen == [f'{1000 + i}' for i in range(1, 60, 2)]
+    assert client.get('/books/genre/poetry', headers=bob).json['books_list'] == []
+    assert client.get('/books/genre/horror?after=nope', headers=bob).status_code == 400
+
+
+def test_genre_pages_are_evicted(client, books, admin):
+    assert len(client.get('/books/genre/poetry', headers=admin).json['books_list']) == 0
+    assert client.put('/books', json={'isbn': '1000', 'genre': 'poetry'}, headers=admin).status_code == 202
+    assert len(client.get('/books/genre/poetry', headers=admin).json['books_list']) == 1
+    assert len(client.get('/books/genre/drama?limit=100', headers=admin).json['books_list']) == 29
@@ -0,0 +1,93 @@
+""" 429s from the token buckets and 503s from admission control, both with a Retry-After """
+import pytest
+
+from ..cache_backends import SQLiteCache
+from ..ratelimit import limiter, Limiter, RATE_LIMITS
+from .conftest import basic_auth, login
+
+
+@pytest.fixture
+def limits(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', dict(RATE_LIMITS, catalog=(1, 3), auth=(1, 3)))
+    return app.config
+
+
+def test_over_the_limit_is_429(client, books, bob, limits):
+    statuses = [client.get('/books/1001', headers=bob).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    resp = client.get('/books/1001', headers=bob)
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) >= 1
+
+
+def test_each_user_has_their_own_bucket(client, books, limits):
+    bob = {'Authorization': login(client, 'bob')['token']}
+    alice = {'Authorization': login(client, 'alice')['token']}
+    assert [client.get('/authors', headers=bob).status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert client.get('/authors', headers=alice).status_code == 200
+
+
+def test_limits_are_per_route_class(client, books, bob, limits):
+    assert [client.get('/books/1001', headers=bob).status_code for _ in range(4)][-1] == 429
+    # a cart write isn't a catalog read
+    assert client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob).status_code == 200
+
+
+def test_password_guesses_are_limited_per_ip(client, limits):
+    client.post('/create-user', json={'username': 'bob', 'password': 'pw'})
+    guesses = [client.post('/get-token', headers=basic_auth('bob', 'nope')).status_code for _ in range(3)]
+    # the create-user took a token too
+    assert guesses == [401, 401, 429]
+
+    # bob, somewhere else, can still log in
+    resp = client.post('/get-token', headers=basic_auth('bob'), environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert resp.status_code == 200
+
+
+def test_turned_off(client, books, bob, limits, monkeypatch):
+    monkeypatch.setitem(limits, 'RATE_LIMIT_ENABLED', False)
+    assert {client.get('/books/1001', headers=bob).status_code for _ in range(10)} == {200}
+
+
+def test_busy_worker_sheds_with_503(app, client, books, bob, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONCURRENT_REQUESTS', 1)
+    # a request that's still running
+    with app.test_request_context('/books/1001'):
+        assert limiter.admit(app.config) is None
+        try:
+            resp = client.get('/books/1001', headers=bob)
+            assert resp.status_code == 503
+            assert resp.headers['Retry-After'] == '1'
+        finally:
+            limiter.release()
+    assert client.get('/books/1001', headers=bob).status_code == 200
+
+
+def test_writes_have_their_own_limit(app, client, books, bob, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONCURRENT_WRITES', 1)
+    with app.test_request_context('/shopping-cart', method='PUT'):
+        assert limiter.admit(app.config) is None
+        try:
+            resp = client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob)
+            assert resp.status_code == 503
+            assert 'Retry-After' in resp.headers
+            # reads still get in
+            assert client.get('/books/1001', headers=bob).status_code == 200
+        finally:
+            limiter.release()
+
+
+def test_workers_share_their_buckets_on_sync(tmp_path):
+    shared = SQLiteCache(str(tmp_path / 'cache.sqlite'))
+    one, other = Limiter(), Limiter()
+    bucket = [('rl:catalog:ip', 0.001, 4)]
+
+    assert [one.buckets.take_tokens(bucket)[0] for _ in range(3)] == [True] * 3
+    one.sync(shared)
+    # the other worker hasn't synced yet, it still has all 4
+    assert other.buckets.take_tokens(bucket)[0]
+    other.sync(shared)
+    # 4 - 3 - 1
+    assert not other.buckets.take_tokens(bucket)[0]
@@ -0,0 +1,112 @@
+""" ratings and the per-book rating totals """
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from ..models import db, Book, Rating, Comment
+from .conftest import login
+
+
+def rate(client, headers, isbn, rating):
+    return client.post(f'/books/{isbn}/ratings', json={'rating': rating}, headers=headers)
+
+
+def totals(app, isbn):
+    with app.app_context():
+        book = Book.query.filter_by(isbn=isbn).one()
+        return book.rating_count, book.rating_sum
+
+
+def test_totals_follow_the_ratings(app, client, books, bob):
+    resp = rate(client, bob, '1001', 4)
+    assert resp.status_code == 201
+    assert (resp.json['rating_count'], resp.json['average_rating']) == (1, 4)
+
+    alice = {'Authorization': login(client, 'alice')['token']}
+    resp = rate(client, alice, '1001', 1)
+    assert resp.status_code == 201
+    assert (resp.json['rating_count'], resp.json['average_rating']) == (2, 2.5)
+    assert totals(app, '1001') == (2, 5)
+
+
+def test_rating_again_changes_the_rating(app, client, books, bob):
+    assert rate(client, bob, '1001', 4).status_code == 201
+    resp = rate(client, bob, '1001', 2)
+    assert resp.status_code == 200
+    assert (resp.json['rating_count'], resp.json['average_rating']) == (1, 2)
+    assert totals(app, '1001') == (1, 2)
+    with app.app_context():
+        assert Rating.query.count() == 1
+
+
+def test_one_rating_per_user_and_book(app, client, books, bob):
+    assert rate(client, bob, '1001', 4).status_code == 201
+    with app.app_context():
+        rating = Rating.query.one()
+        db.session.add(Rating(book_id=rating.book_id, user_id=rating.user_id, rating=1))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+
+
+def test_a_rating_someone_else_inserted_first_isnt_counted_twice(app, client, books, bob):
+    # what a concurrent first rating leaves behind: the row is there, its totals are the other request's to add
+    assert rate(client, bob, '1002', 3).status_code == 201
+    with app.app_context():
+        rating = Rating.query.one()
+        book = Book.query.filter_by(isbn='1001').one()
+        db.session.add(Rating(book_id=book.id, user_id=rating.user_id, rating=5))
+        book.rating_count, book.rating_sum = 1, 5
+        db.session.commit()
+
+    resp = rate(client, bob, '1001', 2)
+    assert resp.status_code == 200
+    assert totals(app, '1001') == (1, 2)
+
+
+def test_cached_reads_see_new_ratings(client, books, bob):
+    assert client.get('/books/1001', headers=bob).json['average_rating'] is None
+    assert client.get('/books/1001/ratings', headers=bob).json['ratings'] == []
+    assert client.get('/books?min_rating=3', headers=bob).json['books_list'] == []
+
+    assert rate(client, bob, '1001', 4).status_code == 201
+
+    assert client.get('/books/1001', headers=bob).json['average_rating'] == 4
+    resp = client.get('/books/1001/ratings', headers=bob).json
+    assert (resp['rating_count'], [rating['rating'] for rating in resp['ratings']]) == (1, [4])
+    assert [book['isbn'] for book in client.get('/books?min_rating=3', headers=bob).json['books_list']] == ['1001']
+
+    assert rate(client, bob, '1001', 2).status_code == 200
+    assert client.get('/books?min_rating=3', headers=bob).json['books_list'] == []
+
+
+def test_bad_ratings_are_400(app, client, books, bob):
+    for rating in (0, 6, 'five', 4.5, True, None):
+        assert rate(client, bob, '1001', rating).status_code == 400
+    assert rate(client, bob, '9999', 3).status_code == 404
+    assert totals(app, '1001') == (0, 0)
+
+
+def test_comments(client, books, bob):
+    for i in range(3):
+        resp = client.post('/books/1001/comments', json={'comment_text': f'comment {i}'}, headers=bob)
+        assert resp.status_code == 201
+    assert resp.json['comment_text'] == 'comment 2'
+
+    page = client.get('/books/1001/comments?limit=2', headers=bob).json
+    assert [c['comment_text'] for c in page['comments']] == ['comment 0', 'comment 1']
+    page = client.get(f"/books/1001/comments?limit=2&after={page['next_cursor']}", headers=bob).json
+    assert [c['comment_text'] for c in page['comments']] == ['comment 2']
+    assert page['next_cursor'] is None
+
+    assert client.post('/books/1001/comments', json={}, headers=bob).status_code == 400
+    assert client.post('/books/1001/comments', json={'comment_text': 'x' * 201}, headers=bob).status_code == 400
+    assert client.post('/books/9999/comments', json={'comment_text': 'hi'}, headers=bob).status_code == 404
+
+
+def test_deleting_a_rated_book(app, client, books, admin, bob):
+    assert rate(client, bob, '1001', 4).status_code == 201
+    assert client.post('/books/1001/comments', json={'comment_text': 'good'}, headers=bob).status_code < 300
+
+    assert client.delete('/books', json={'isbn': '1001'}, headers=admin).status_code == 200
+    with app.app_context():
+        assert db.session.query(Rating).count() == 0
+        assert db.session.query(Comment).count() == 0
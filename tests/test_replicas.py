@@ -0,0 +1,117 @@
+""" GET reads go to DATABASE_REPLICA_URLS, writes and a writer's next reads go to the primary """
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from ..cache import cache
+from ..database import database_config_from_env, STICKY_PREFIX
+from ..models import db, User, CreditCard
+from .conftest import login
+
+
+@pytest.fixture
+def alice(client):
+    return {'Authorization': login(client, 'alice')['token']}
+
+
+@pytest.fixture
+def replica(app, books, bob, alice, tmp_path, monkeypatch):
+    """ a copy of the db as it is now, set up as the app's only replica """
+    path = tmp_path / 'replica.sqlite'
+    primary = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    copy = sqlite3.connect(path)
+    primary.backup(copy)
+    primary.close()
+    copy.close()
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_REPLICA_URLS', [f'sqlite:///{path}'])
+    monkeypatch.setitem(app.extensions, 'db_replicas', None)
+    return path
+
+
+def add_card_on_the_primary(app, username, number):
+    """ a write the replica never sees, made outside of any request so nobody gets sticky """
+    with app.app_context():
+        user = User.query.filter_by(username=username).one()
+        db.session.add(CreditCard(user_id=user.id, credit_card=number))
+        db.session.commit()
+
+
+def cards(client, headers, username):
+    resp = client.get('/credit-cards', json={'username': username}, headers=headers)
+    assert resp.status_code == 202, resp.get_data()
+    return sorted(card['credit_card'] for card in resp.json)
+
+
+def test_gets_read_from_the_replica(app, client, replica, bob):
+    add_card_on_the_primary(app, 'bob', '4111')
+    assert cards(client, bob, 'bob') == []
+
+
+def test_a_writer_reads_from_the_primary_for_a_while(app, client, replica, bob, alice):
+    add_card_on_the_primary(app, 'bob', '4111')
+    add_card_on_the_primary(app, 'alice', '4333')
+
+    assert client.post('/add-cc', json={'username': 'bob', 'credit_card': '4222'}, headers=bob).status_code == 202
+    assert cards(client, bob, 'bob') == ['4111', '4222']
+    # only bob wrote
+    assert cards(client, alice, 'alice') == []
+
+    with app.app_context():
+        bob_id = User.query.filter_by(username='bob').one().id
+    assert cache.get(f'{STICKY_PREFIX}{bob_id}') == 1
+    cache.delete(f'{STICKY_PREFIX}{bob_id}')
+    assert cards(client, bob, 'bob') == []
+
+
+def test_nothing_is_sticky_without_replicas(app, client, books, bob):
+    assert client.post('/add-cc', json={'username': 'bob', 'credit_card': '4222'}, headers=bob).status_code == 202
+    with app.app_context():
+        bob_id = User.query.filter_by(username='bob').one().id
+    assert cache.get(f'{STICKY_PREFIX}{bob_id}') is None
+    assert cards(client, bob, 'bob') == ['4222']
+
+
+def test_replicas_are_read_only(app, replica):
+    with app.app_context():
+        engine = db.replica_engines(app)[0]
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM books")).scalar() == 60
+            with pytest.raises(OperationalError, match='readonly'):
+                conn.execute(text("DELETE FROM books"))
+
+
+def test_db_stats_lists_the_replicas(client, admin, replica, bob):
+    # admin is made before the copy, so the replica knows them
+    cards(client, bob, 'bob')
+    stats = client.get('/db-stats', headers=admin).json['db_stats']
+    assert [r['url'] for r in stats['replicas']] == [f'sqlite:///file:{replica}?mode=ro&uri=true']
+    assert stats['replica_statements'] > 0
+
+
+def test_replica_urls_from_env():
+    config = database_config_from_env({'DATABASE_REPLICA_URLS': ' sqlite:///a.sqlite, ,sqlite:///b.sqlite',
+                                       'DB_STICKY_SECONDS': '9'})
+    assert config['SQLALCHEMY_REPLICA_URLS'] == ['sqlite:///a.sqlite', 'sqlite:///b.sqlite']
+    assert config['DB_STICKY_SECONDS'] == 9
+    assert database_config_from_env({})['SQLALCHEMY_REPLICA_URLS'] == []
+
+
+def cart(client, username, ip='127.0.0.1'):
+    """ the isbns in the user's cart, None if they have no cart. GET /get-shopping-cart takes no token """
+    resp = client.get('/get-shopping-cart', json={'username': username}, environ_base={'REMOTE_ADDR': ip})
+    assert resp.status_code == 200, resp.get_data()
+    if 'shopping_cart' not in resp.json:
+        return None
+    return [book['isbn'] for book in resp.json['shopping_cart']]
+
+
+def test_reads_without_a_token_stick_to_the_writers_ip(app, client, replica, bob):
+    assert client.put('/shopping-cart', json={'username': 'bob', 'isbn': '1001'}, headers=bob).status_code == 200
+    assert cart(client, 'bob') == ['1001']
+    # anybody else without a token still reads the replica, where bob has no cart yet
+    assert cart(client, 'bob', ip='10.0.0.2') is None
+
+    cache.delete(f'{STICKY_PREFIX}ip:127.0.0.1')
+    assert cart(client, 'bob') is None
@@ -0,0 +1,73 @@
+""" the response cache: keys, per user entries, stale entries and the counters """
+import time
+from types import SimpleNamespace
+
+from .. import cache as cache_module
+from ..cache import cache, response_cache_key
+from .conftest import login
+
+
+def test_second_read_is_a_hit(client, books, bob):
+    first = client.get('/books/1001', headers=bob)
+    assert first.headers['X-Cache'] == 'MISS'
+    second = client.get('/books/1001', headers=bob)
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_data() == first.get_data()
+
+
+def test_query_string_order_doesnt_matter(client, books, bob):
+    assert client.get('/books?limit=5&order_by=isbn', headers=bob).headers['X-Cache'] == 'MISS'
+    assert client.get('/books?order_by=isbn&limit=5', headers=bob).headers['X-Cache'] == 'HIT'
+    assert client.get('/books?order_by=isbn&limit=6', headers=bob).headers['X-Cache'] == 'MISS'
+
+
+def test_the_token_is_checked_before_the_cache(client, books, bob):
+    client.get('/books/1001', headers=bob)
+    resp = client.get('/books/1001', headers={'Authorization': 'not a token'})
+    assert 'X-Cache' not in resp.headers
+    assert resp.json == {'message': 'token is invalid'}
+
+
+def test_user_views_are_cached_per_user(client, books):
+    bob = {'Authorization': login(client, 'bob')['token']}
+    alice = {'Authorization': login(client, 'alice')['token']}
+    assert client.post('/add/wishlist', json={'user_id': 1}, headers=bob).status_code == 200
+
+    assert client.get('/wishlist/1', headers=bob).headers['X-Cache'] == 'MISS'
+    assert client.get('/wishlist/1', headers=bob).headers['X-Cache'] == 'HIT'
+    assert client.get('/wishlist/1', headers=alice).headers['X-Cache'] == 'MISS'
+
+
+def test_streams_and_errors_arent_cached(client, books, bob):
+    for _ in range(2):
+        resp = client.get('/books?stream=true', headers=bob)
+        resp.close()
+        assert 'X-Cache' not in resp.headers
+    assert client.get('/books/9999', headers=bob).status_code == 404
+    assert client.get('/books/9999', headers=bob).headers.get('X-Cache') != 'HIT'
+
+
+def test_expired_entries_are_refreshed_by_one_request(app, client, books, bob, monkeypatch):
+    client.get('/authors', headers=bob)
+    # a bit past the TTL, still inside the stale window
+    later = time.time() + cache_module.CATALOG_TTL + 1
+    monkeypatch.setattr(cache_module, 'time', SimpleNamespace(time=lambda: later))
+
+    # somebody else is already refreshing it: the stale body is served
+    with app.test_request_context('/authors'):
+        assert cache.add(response_cache_key() + ':refreshing', 1)
+    assert client.get('/authors', headers=bob).headers['X-Cache'] == 'STALE'
+
+    # nobody is: this request refreshes it
+    with app.test_request_context('/authors'):
+        cache.delete(response_cache_key() + ':refreshing')
+    assert client.get('/authors', headers=bob).headers['X-Cache'] == 'MISS'
+
+
+def test_cache_stats(client, books, admin, bob):
+    client.get('/books/1001', headers=bob)
+    client.get('/books/1001', headers=bob)
+    stats = client.get('/cache-stats', headers=admin).json['cache_stats']
+    assert stats['hits'] >= 1 and stats['misses'] >= 1
+    assert 0 < stats['hit_ratio'] <= 1
+    assert client.get('/cache-stats', headers=bob).status_code == 401
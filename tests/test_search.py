@@ -0,0 +1,112 @@
+""" GET /books/search and the books_fts triggers that keep it in sync """
+import datetime
+
+import pytest
+
+from ..models import db, Author, Book
+from ..search import match_expression
+
+
+@pytest.fixture
+def catalog(app, books):
+    """ the 60 books plus a few with words worth searching for """
+    with app.app_context():
+        ursula = Author(first_name='ursula', last_name='le guin', publisher='ace')
+        db.session.add(ursula)
+        db.session.flush()
+        db.session.add_all([
+            Book(title='cien años de soledad', isbn='2000', author_id=books, genre='fiction', price=25,
+                 date_published=datetime.date(1967, 5, 30), description='a family in macondo'),
+            Book(title='the dispossessed', isbn='2001', author_id=ursula.id, genre='scifi', price=15,
+                 date_published=datetime.date(1974, 5, 1), description='an ambiguous utopia, not soledad'),
+            Book(title='the lathe of heaven', isbn='2002', author_id=ursula.id, genre='scifi', price=9,
+                 date_published=datetime.date(1971, 1, 1), description='dreams'),
+        ])
+        db.session.commit()
+        return ursula.id
+
+
+def search(client, headers, query):
+    resp = client.get('/books/search?' + query, headers=headers)
+    assert resp.status_code == 200, resp.get_data()
+    return [book['isbn'] for book in resp.json['books_list']]
+
+
+def test_match_expression():
+    assert match_expression('soledad gab') == '"soledad" "gab"*'
+    assert match_expression('gab ma') == '"gab" "ma"'
+    # operators are just words, and a one letter last word isn't a prefix
+    assert match_expression('the* OR "x"') == '"the"* "OR" "x"'
+    assert match_expression(' -- ') is None
+
+
+def test_title_hits_rank_above_description_hits(client, catalog, bob):
+    assert search(client, bob, 'q=soledad') == ['2000', '2001']
+    # diacritics don't matter
+    assert search(client, bob, 'q=anos') == ['2000']
+
+
+def test_every_word_must_match_and_the_last_is_a_prefix(client, catalog, bob):
+    assert search(client, bob, 'q=ursula disp') == ['2001']
+    assert sorted(search(client, bob, 'q=le guin')) == ['2001', '2002']
+    assert search(client, bob, 'q=soledad heaven') == []
+
+
+def test_filters(client, catalog, bob):
+    assert sorted(search(client, bob, 'q=guin&max_price=10')) == ['2002']
+    assert sorted(search(client, bob, 'q=guin&min_price=10')) == ['2001']
+    assert sorted(search(client, bob, 'q=guin&min_price=8.5&max_price=9.5')) == ['2002']
+    assert sorted(search(client, bob, 'q=guin&min_price=15.01')) == []
+    assert search(client, bob, 'q=soledad&genre=scifi') == ['2001']
+    assert search(client, bob, 'q=guin&published_after=1972-01-01') == ['2001']
+    assert search(client, bob, 'q=guin&published_before=1972-01-01') == ['2002']
+
+
+def test_bad_requests(client, catalog, bob):
+    for query in ('q=', 'q=-', 'q=x&published_after=someday', 'q=x&after=nope', 'q=x&min_price=cheap',
+                  'q=x&max_price=', 'q=x&max_price=nan', 'q=x&min_price=inf'):
+        assert client.get('/books/search?' + query, headers=bob).status_code == 400, query
+
+
+def test_pages(client, catalog, bob):
+    seen, after = [], ''
+    while True:
+        resp = client.get(f'/books/search?q=things&limit=25{after}', headers=bob).json
+        seen += [book['isbn'] for book in resp['books_list']]
+        if resp['next_cursor'] is None:
+            break
+        after = '&after=' + resp['next_cursor']
+    assert sorted(seen) == [f'{1000 + i}' for i in range(60)]
+
+
+def test_triggers_keep_the_index_in_sync(app, client, catalog, bob):
+    with app.app_context():
+        book = Book.query.filter_by(isbn='2002').one()
+        book.title = 'always coming home'
+        db.session.commit()
+    assert search(client, bob, 'q=lathe') == []
+    assert search(client, bob, 'q=coming home') == ['2002']
+
+    with app.app_context():
+        ursula = db.session.get(Author, catalog)
+        ursula.last_name = 'k le guin'
+        ursula.first_name = 'ursula k'
+        db.session.commit()
+    assert sorted(search(client, bob, 'q=ursula k')) == ['2001', '2002']
+
+    with app.app_context():
+        db.session.delete(Book.query.filter_by(isbn='2001').one())
+        db.session.commit()
+    assert search(client, bob, 'q=dispossessed') == []
+
+    # raw sql goes through the triggers too
+    with app.app_context():
+        db.session.execute(Book.__table__.insert().values(title='the word for world is forest', isbn='2003'))
+        db.session.commit()
+    assert search(client, bob, 'q=forest') == ['2003']
+
+
+def test_writes_through_the_api_evict_cached_results(client, catalog, admin):
+    assert search(client, admin, 'q=macondo') == ['2000']
+    assert client.put('/books', json={'isbn': '2000', 'description': 'a family'}, headers=admin).status_code == 202
+    assert search(client, admin, 'q=macondo') == []
@@ -0,0 +1,52 @@
+""" the compiled column plans give the same dicts as_dict() used to """
+import datetime
+import json
+
+from .. import serializers
+from ..benchmarks.serializer_bench import legacy_as_dict
+from ..models import db, Author, Book, Comment, book_serializer, author_serializer
+from ..serializers import RowSerializer, dumps
+
+
+def test_orm_objects_and_core_rows_match_the_old_as_dict(app, books):
+    with app.app_context():
+        objects = Book.query.order_by(Book.id).all()
+        rows = db.session.execute(book_serializer.select().order_by(Book.id)).all()
+        old = [legacy_as_dict(book) for book in objects]
+        assert [book.as_dict() for book in objects] == old
+        assert book_serializer.dump_rows(rows) == old
+        assert old[0]['date_published'] == '2020-01-01'
+
+
+def test_nulls_and_excluded_columns(app):
+    with app.app_context():
+        book = Book(title='undated', isbn='1', date_published=None)
+        db.session.add(book)
+        db.session.commit()
+        assert book.as_dict()['date_published'] is None
+        assert 'isbn' not in RowSerializer(Book, exclude=('isbn',)).dump(book)
+
+        author = Author(first_name='ursula', last_name='le guin')
+        db.session.add(author)
+        db.session.commit()
+        assert author_serializer.dump(author) == legacy_as_dict(author)
+
+
+def test_extra_trailing_values_are_ignored():
+    serializer = RowSerializer(Comment)
+    row = tuple(range(len(serializer.columns))) + ('extra',)
+    assert list(serializer.dump_row(row).values()) == list(range(len(serializer.columns)))
+
+
+def test_dumps_with_and_without_orjson(monkeypatch):
+    data = {'a': [1, 'b', None], 'when': datetime.date(2020, 1, 2).isoformat()}
+    assert json.loads(dumps(data)) == data
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert dumps(data) == b'{"a":[1,"b",null],"when":"2020-01-02"}'
+
+
+def test_routes_return_the_same_json(client, books, bob):
+    resp = client.get('/books?limit=2', headers=bob)
+    assert resp.mimetype == 'application/json'
+    assert [book['isbn'] for book in resp.json['books_list']] == ['1000', '1001']
+    assert resp.json['books_list'][0]['date_published'] == '2020-01-01'
@@ -0,0 +1,126 @@
+""" the list endpoints run a fixed number of SQL statements, however many rows they return (no N+1) """
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..cache import cache
+from ..api.shopping_cart import UPDATE_CART_STATEMENTS
+from ..api.wishlist_routes import REMOVE_BOOK_STATEMENTS
+from ..instrumentation import TooManyQueries
+from ..models import db, User, Rating, Comment
+from .conftest import login
+
+LIST_ENDPOINTS = [
+    ('/books?limit=50', None),
+    ('/books?limit=50&order_by=isbn', None),
+    ('/books/genre/horror?limit=50', None),
+    ('/books/top-sellers?limit=50', None),
+    ('/authors', None),
+    ('/authors/1/books', None),
+    ('/wishlist/1', None),
+    ('/get-shopping-cart', {'username': 'bob'}),
+    ('/books/1000/ratings', None),
+    ('/books/1000/comments', None),
+]
+
+
+def add_rows(app, client, bob, start, stop):
+    """ puts books start..stop in bob's wishlist and cart, and rates and comments book 1000 that many times """
+    for i in range(start, stop):
+        assert client.post('/wishlist/add', json={'username': 'bob', 'isbn': f'{1000 + i}'}, headers=bob).status_code == 200
+        assert client.put('/shopping-cart', json={'username': 'bob', 'isbn': f'{1000 + i}'}, headers=bob).status_code == 200
+    with app.app_context():
+        for i in range(start, stop):
+            user = User(username=f'reader{i}')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Rating(book_id=1, user_id=user.id, rating=1 + i % 5))
+            db.session.add(Comment(book_id=1, user_id=user.id, comment_text=f'comment {i}'))
+        db.session.commit()
+    # the book and author lists don't change with the cart, and the ratings/comments above didn't go
+    # through the routes, so they'd still be cached
+    cache.clear()
+
+
+@pytest.fixture
+def lists(app, client, books, bob):
+    assert client.post('/add/wishlist', json={'user_id': 1}, headers=bob).status_code == 200
+    add_rows(app, client, bob, 0, 1)
+    return bob
+
+
+def statements(client, headers, path, body=None, method='GET'):
+    """ how many statements the request ran """
+    ran = []
+    count = lambda *args: ran.append(1)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        resp = client.open(path, method=method, json=body, headers=headers)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    assert resp.status_code == 200, resp.get_data()
+    return len(ran)
+
+
+@pytest.mark.parametrize('path,body', LIST_ENDPOINTS)
+def test_statements_dont_grow_with_rows(app, client, lists, path, body):
+    one_row = statements(client, lists, path, body)
+    assert one_row > 0  # not served from the cache
+    add_rows(app, client, lists, 1, 20)
+    # testing mode: a request over SQL_STATEMENT_LIMIT raises TooManyQueries here
+    many_rows = statements(client, lists, path, body)
+    assert many_rows == one_row
+    assert many_rows <= app.config['SQL_STATEMENT_LIMIT']
+
+
+def test_guard_raises_past_the_limit(app, client, lists, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_STATEMENT_LIMIT', 1)
+    with pytest.raises(TooManyQueries):
+        client.get('/authors/1/books', headers=lists)
+
+
+def test_guard_is_off_outside_testing_mode(app, client, lists, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_STATEMENT_LIMIT', 1)
+    monkeypatch.setitem(app.config, 'TESTING', False)
+    assert client.get('/authors/1/books', headers=lists).status_code == 200
+
+
+def test_moving_a_book_to_the_cart_stays_within_its_budget(app, client, lists):
+    # the book is in the cart already, so this is the longer path (the cart row is updated)
+    ran = statements(client, lists, '/wishlist/1/remove/1000', method='PUT')
+    assert ran <= REMOVE_BOOK_STATEMENTS
+
+
+@pytest.fixture
+def no_denylist_reload(app, monkeypatch):
+    # the token denylist reloads every TOKEN_DENYLIST_SYNC seconds, on whichever request comes along
+    monkeypatch.setitem(app.config, 'TOKEN_DENYLIST_SYNC', 3600)
+
+
+def test_moving_a_book_into_a_new_cart_with_a_key_is_the_whole_budget(app, client, lists, no_denylist_reload):
+    alice = {'Authorization': login(client, 'alice')['token']}
+    with app.app_context():
+        alice_id = User.query.filter_by(username='alice').one().id
+    assert client.post('/add/wishlist', json={'user_id': alice_id}, headers=alice).status_code == 200
+    assert client.post('/wishlist/add', json={'username': 'alice', 'isbn': '1000'}, headers=alice).status_code == 200
+    ran = statements(client, dict(alice, **{'Idempotency-Key': 'move'}), f'/wishlist/{alice_id}/remove/1000',
+                     method='PUT')
+    assert ran == REMOVE_BOOK_STATEMENTS
+
+
+def test_adding_to_the_cart_stays_within_its_budget(app, client, lists, no_denylist_reload):
+    ran = statements(client, lists, '/shopping-cart', {'username': 'bob', 'isbn': '1001'}, method='PUT')
+    assert ran <= UPDATE_CART_STATEMENTS
+
+    # the longest path: a new cart, with an Idempotency-Key
+    alice = {'Authorization': login(client, 'alice')['token'], 'Idempotency-Key': 'add'}
+    ran = statements(client, alice, '/shopping-cart', {'username': 'alice', 'isbn': '1001'}, method='PUT')
+    assert ran == UPDATE_CART_STATEMENTS
+
+
+def test_the_denylist_reload_isnt_counted(app, client, lists, monkeypatch):
+    monkeypatch.setitem(app.config, 'TOKEN_DENYLIST_SYNC', 0)
+    alice = {'Authorization': login(client, 'alice')['token'], 'Idempotency-Key': 'add'}
+    # one more than the budget, and the guard lets it through
+    ran = statements(client, alice, '/shopping-cart', {'username': 'alice', 'isbn': '1001'}, method='PUT')
+    assert ran == UPDATE_CART_STATEMENTS + 1
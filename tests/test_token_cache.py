@@ -0,0 +1,87 @@
+""" verified tokens are cached, and revoked when the user they belong to changes """
+from types import SimpleNamespace
+
+import jwt
+
+from .. import auth
+from ..auth import TokenCache, Principal
+from ..models import db, User
+from .conftest import login, basic_auth
+
+
+def test_lru_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth, 'time', SimpleNamespace(time=lambda: now[0]))
+    tokens = TokenCache(maxsize=2, ttl=60)
+    bob, alice = Principal(1, 'bob', False), Principal(2, 'alice', False)
+
+    tokens.set('a', bob)
+    tokens.set('b', alice)
+    assert tokens.get('a') == bob
+    # 'b' is the least recently used now
+    tokens.set('c', bob)
+    assert tokens.get('b') is None
+    assert tokens.get('a') == bob and tokens.get('c') == bob
+
+    # never kept past the token's own exp
+    tokens.set('short', bob, token_exp=now[0] + 5)
+    now[0] += 6
+    assert tokens.get('short') is None
+    assert tokens.get('c') == bob
+    now[0] += 60
+    assert tokens.get('c') is None
+
+
+def test_a_token_is_decoded_once(client, books, monkeypatch):
+    token = login(client, 'bob')['token']
+    decoded = []
+    decode = jwt.decode
+    monkeypatch.setattr(auth.jwt, 'decode', lambda *args, **kwargs: decoded.append(1) or decode(*args, **kwargs))
+
+    for _ in range(3):
+        assert client.get('/books/1001', headers={'Authorization': token}).status_code == 200
+    assert len(decoded) == 1
+
+
+def test_bad_tokens(client, books):
+    login(client, 'bob')
+    other_secret = jwt.encode({'username': 'bob', 'id': 1}, 'not the secret', 'HS256')
+    nobody = jwt.encode({'username': 'nobody', 'id': 7}, client.application.config['SECRET_KEY'], 'HS256')
+    for token in ('garbage', other_secret, nobody):
+        assert client.get('/books/1001', headers={'Authorization': token}).json == {'message': 'token is invalid'}
+    assert client.get('/books/1001').json == {'message': 'a valid token is missing'}
+
+
+def test_making_a_user_admin_revokes_their_cached_token(app, client, books):
+    bob = {'Authorization': login(client, 'bob')['token']}
+    assert client.get('/cache-stats', headers=bob).status_code == 401
+
+    with app.app_context():
+        User.query.filter_by(username='bob').one().isAdmin = True
+        db.session.commit()
+    # the token still says he isn't one
+    assert client.get('/cache-stats', headers=bob).status_code == 401
+    bob = {'Authorization': client.post('/get-token', headers=basic_auth('bob')).json['token']}
+    assert client.get('/cache-stats', headers=bob).status_code == 200
+
+
+def test_deleting_a_user_drops_their_cached_token(app, client, books):
+    bob = {'Authorization': login(client, 'bob')['token']}
+    assert client.get('/books/1001', headers=bob).status_code == 200
+
+    with app.app_context():
+        db.session.delete(User.query.filter_by(username='bob').one())
+        db.session.commit()
+    assert client.get('/books/1001', headers=bob).json == {'message': 'token is invalid'}
+
+
+def test_credit_cards_are_only_for_their_owner(client):
+    bob = {'Authorization': login(client, 'bob')['token']}
+    alice = {'Authorization': login(client, 'alice')['token']}
+
+    assert client.post('/add-cc', json={'username': 'bob', 'credit_card': '4111'}, headers=bob).status_code == 202
+    assert client.post('/add-cc', json={'username': 'bob', 'credit_card': '4222'}, headers=alice).status_code == 401
+    resp = client.get('/credit-cards', json={'username': 'bob'}, headers=bob)
+    assert resp.status_code == 202
+    assert [card['credit_card'] for card in resp.json] == ['4111']
+    assert client.get('/get-cc', json={'username': 'bob'}, headers=alice).status_code == 401
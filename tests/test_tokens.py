@@ -0,0 +1,126 @@
+""" refresh tokens work once, logging out revokes every token the user has """
+import time
+
+import jwt
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..models import db, User, TokenRevocation
+from .conftest import login, basic_auth
+
+INVALID = {'message': 'token is invalid'}
+
+
+def works(client, token):
+    resp = client.get('/books?limit=1', headers={'Authorization': token})
+    return resp.status_code == 200 and resp.json != INVALID
+
+
+def refresh(client, refresh_token):
+    return client.post('/refresh-token', json={'refresh_token': refresh_token})
+
+
+def test_login_gives_a_token_pair(client):
+    tokens = login(client, 'bob')
+    assert set(tokens) == {'token', 'refresh_token', 'expires_in'}
+    assert works(client, tokens['token'])
+    # a refresh token isn't an access token, and the other way around
+    assert not works(client, tokens['refresh_token'])
+    assert refresh(client, tokens['token']).status_code == 401
+
+
+def test_refresh_token_works_once(client):
+    tokens = login(client, 'bob')
+
+    resp = refresh(client, tokens['refresh_token'])
+    assert resp.status_code == 200
+    assert works(client, resp.json['token'])
+
+    # reused: someone else got it
+    assert refresh(client, tokens['refresh_token']).status_code == 401
+    # the new one still works
+    assert refresh(client, resp.json['refresh_token']).status_code == 200
+
+
+def test_logout_revokes_every_token(client):
+    first = login(client, 'bob')
+    second = login(client, 'alice')
+
+    resp = client.post('/logout', headers={'Authorization': first['token']})
+    assert resp.status_code == 200
+
+    assert not works(client, first['token'])
+    assert refresh(client, first['refresh_token']).status_code == 401
+    # other users are fine
+    assert works(client, second['token'])
+
+
+def test_logging_in_again_after_logout_works(client):
+    tokens = login(client, 'bob')
+    assert client.post('/logout', headers={'Authorization': tokens['token']}).status_code == 200
+
+    resp = client.post('/get-token', headers=basic_auth('bob'))
+    assert resp.status_code == 200
+    assert works(client, resp.json['token'])
+    assert not works(client, tokens['token'])
+
+
+def test_wrong_password_is_401(client):
+    login(client, 'bob')
+    assert client.post('/get-token', headers=basic_auth('bob', 'nope')).status_code == 401
+
+
+def test_access_tokens_carry_the_role(app, client, books):
+    token = login(client, 'admin', is_admin=True)['token']
+    claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+    assert (claims['role'], claims['type']) == ('admin', 'access')
+
+    users = []
+    count = lambda conn, cursor, statement, *args: 'users' in statement and users.append(statement)
+    event.listen(Engine, 'before_cursor_execute', count)
+    try:
+        assert client.get('/cache-stats', headers={'Authorization': token}).status_code == 200
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count)
+    assert users == []
+
+
+def test_old_tokens_without_claims_still_work(app, client, books):
+    login(client, 'bob')
+    old = jwt.encode({'username': 'bob', 'id': 1, 'exp': int(time.time()) + 60}, app.config['SECRET_KEY'], 'HS256')
+    assert works(client, old)
+
+
+def test_other_workers_revocations_apply_on_the_next_sync(app, client, monkeypatch):
+    tokens = login(client, 'bob')
+    assert works(client, tokens['token'])
+
+    # another worker logs bob out: the row is in the db, this worker's denylist doesn't know yet
+    with app.app_context():
+        user = User.query.filter_by(username='bob').one()
+        db.session.execute(TokenRevocation.__table__.insert().values(
+            user_id=user.id, version=user.token_version + 1, expires_at=int(time.time()) + 60))
+        db.session.commit()
+    assert works(client, tokens['token'])
+
+    monkeypatch.setitem(app.config, 'TOKEN_DENYLIST_SYNC', 0)
+    assert not works(client, tokens['token'])
+    assert refresh(client, tokens['refresh_token']).status_code == 401
+
+
+def test_expired_revocations_are_ignored(app, client, monkeypatch):
+    tokens = login(client, 'bob')
+    with app.app_context():
+        user = User.query.filter_by(username='bob').one()
+        db.session.add(TokenRevocation(user_id=user.id, version=user.token_version + 1,
+                                       expires_at=int(time.time()) - 1))
+        db.session.commit()
+    monkeypatch.setitem(app.config, 'TOKEN_DENYLIST_SYNC', 0)
+    assert works(client, tokens['token'])
+
+
+def test_bad_admin_tokens_are_logged(client, caplog, capsys):
+    with caplog.at_level('INFO'):
+        assert client.get('/cache-stats', headers={'Authorization': 'garbage'}).status_code == 401
+    assert 'invalid token' in caplog.text
+    assert capsys.readouterr().out == ''
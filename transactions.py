@@ -0,0 +1,118 @@
+"""
+    transactions for write endpoints.
+
+    @atomic runs a view as one transaction: the view doesn't commit, the decorator commits if the view
+    returned a success and rolls back if it returned an error or raised. a view that lost an optimistic
+    locking race (StaleDataError, i.e. carts.touch_cart or a version_id_col UPDATE) is rolled back and run
+    again, up to MAX_RETRIES times.
+
+    it also makes the view idempotent for clients that send an `Idempotency-Key` header: the response is
+    stored with the key in the same transaction as the write, and a retry with the same key gets the
+    stored response back (one SELECT, nothing written) instead of adding the book to the cart twice.
+    only successes are stored, a request that failed can be retried with the same key.
+"""
+from datetime import datetime, timedelta
+from functools import wraps
+from hashlib import sha256
+from http import HTTPStatus
+import random
+import time
+
+from flask import request, jsonify, make_response, current_app
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from .models import db, IdempotencyKey
+from .instrumentation import statements_so_far, uncount_since
+
+MAX_RETRIES = 5
+# stored responses are kept this long, after that the key can be used for a new request
+IDEMPOTENCY_TTL = timedelta(hours=24)
+MAX_KEY_LENGTH = 100
+
+
+def request_fingerprint():
+    """ what a key is tied to: reusing a key for a different request is a client bug, not a retry """
+    digest = sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def stored_response(user_id, key):
+    """ the IdempotencyKey stored for this user and key, if it hasn't expired """
+    stored = db.session.get(IdempotencyKey, (user_id, key))
+    if stored is None or stored.created_at < datetime.utcnow() - IDEMPOTENCY_TTL:
+        return None
+    return stored
+
+
+def replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return jsonify(message={"Error": "Idempotency-Key was already used for a different request"}), \
+            HTTPStatus.UNPROCESSABLE_ENTITY
+    resp = current_app.response_class(stored.body, status=stored.status_code, mimetype=stored.mimetype)
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+def store_response(user_id, key, fingerprint, resp):
+    # this user's expired keys go first, so an expired key can be used again
+    db.session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.created_at < datetime.utcnow() - IDEMPOTENCY_TTL))
+    db.session.add(IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, status_code=resp.status_code,
+                                  mimetype=resp.mimetype, body=resp.get_data(as_text=True)))
+
+
+def atomic(retries=MAX_RETRIES):
+    """ runs the view in one transaction, retrying it on StaleDataError and honouring Idempotency-Key.
+        goes below @token_required (keys are per user)
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            fingerprint = None
+            if key is not None:
+                if not key or len(key) > MAX_KEY_LENGTH:
+                    return jsonify(message={"Error": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}), \
+                        HTTPStatus.BAD_REQUEST
+                fingerprint = request_fingerprint()
+                stored = stored_response(current_user.id, key)
+                if stored is not None:
+                    return replay(stored, fingerprint)
+
+            for attempt in range(retries + 1):
+                start = statements_so_far()
+                try:
+                    resp = make_response(f(current_user, *args, **kwargs))
+                    if resp.status_code >= 400:
+                        db.session.rollback()
+                        return resp
+                    if key is not None:
+                        store_response(current_user.id, key, fingerprint, resp)
+                    db.session.commit()
+                    return resp
+                except StaleDataError:
+                    db.session.rollback()
+                    # the view's statement budget is per attempt
+                    uncount_since(start)
+                    # back off a little so the requests that collided don't collide again
+                    time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+                except IntegrityError:
+                    db.session.rollback()
+                    # the same key sent twice at once: the other request stored its response first
+                    stored = stored_response(current_user.id, key) if key is not None else None
+                    if stored is None:
+                        raise
+                    return replay(stored, fingerprint)
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+            return jsonify(message={"Error": "the request conflicted with other changes, try again"}), \
+                HTTPStatus.CONFLICT
+
+        return decorated
+
+    return decorator